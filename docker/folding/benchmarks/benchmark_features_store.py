@@ -0,0 +1,134 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare load time and peak RSS of the features storage formats.
+
+Each measurement runs in a fresh Python process, so the peak RSS of one format
+does not hide the peak of another.
+
+Usage:
+    python benchmarks/benchmark_features_store.py --num_msa 30000 --num_res 800
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from foldhelpers import features_store
+
+
+def make_features(num_msa, num_res, num_templates=20):
+    """Synthetic features with the shapes and dtypes of a monomer features.pkl."""
+    rng = np.random.default_rng(0)
+    return {
+        "aatype": np.eye(21, dtype=np.int32)[rng.integers(0, 21, num_res)],
+        "between_segment_residues": np.zeros(num_res, dtype=np.int32),
+        "domain_name": np.array([b"benchmark"], dtype=np.object_),
+        "residue_index": np.arange(num_res, dtype=np.int32),
+        "seq_length": np.full(num_res, num_res, dtype=np.int32),
+        "sequence": np.array([b"A" * num_res], dtype=np.object_),
+        "deletion_matrix_int": rng.integers(
+            0, 3, (num_msa, num_res), dtype=np.int32),
+        "msa": rng.integers(0, 22, (num_msa, num_res), dtype=np.int32),
+        "num_alignments": np.full(num_res, num_msa, dtype=np.int32),
+        "template_aatype": np.zeros(
+            (num_templates, num_res, 22), dtype=np.float32),
+        "template_all_atom_masks": np.zeros(
+            (num_templates, num_res, 37), dtype=np.float32),
+        "template_all_atom_positions": rng.random(
+            (num_templates, num_res, 37, 3), dtype=np.float32),
+        "template_domain_names": np.array(
+            [b"1abc_A"] * num_templates, dtype=np.object_),
+        "template_sequence": np.array(
+            [b"A" * num_res] * num_templates, dtype=np.object_),
+        "template_sum_probs": np.ones((num_templates, 1), dtype=np.float32),
+    }
+
+
+def measure(path, touch):
+    """Runs in the child process: load the features and report cost."""
+    t_0 = time.time()
+    feature_dict = features_store.load_features(path)
+    t_load = time.time() - t_0
+    if touch:
+        # Read every array, as the data pipeline of the model does.
+        for value in feature_dict.values():
+            if isinstance(value, np.ndarray) and value.dtype != np.object_:
+                value.sum()
+    t_total = time.time() - t_0
+    print(json.dumps({"load_sec": t_load, "load_and_read_sec": t_total,
+                      "peak_rss_mb": _peak_rss_kb() / 1024}))
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives exec, so it would include the RSS of the parent at
+    # fork time. VmHWM is reset with the address space.
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _path_size(path):
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(dirpath, name))
+            for dirpath, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path)
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_msa", type=int, default=20000)
+    parser.add_argument("--num_res", type=int, default=500)
+    parser.add_argument("--touch", action="store_true",
+                        help="Read every array after loading it.")
+    parser.add_argument("--child", type=str, default=None,
+                        help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    if args.child is not None:
+        measure(args.child, args.touch)
+        sys.exit(0)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        feature_dict = make_features(args.num_msa, args.num_res)
+        print(f"{'format':<16}{'write_sec':>10}{'size_mb':>10}"
+              f"{'load_sec':>10}{'read_sec':>10}{'peak_rss_mb':>13}")
+        for fmt in features_store.FORMATS:
+            path = features_store.features_output_path(
+                os.path.join(work_dir, fmt), fmt)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            t_0 = time.time()
+            written = features_store.save_features(feature_dict, path, fmt)
+            t_write = time.time() - t_0
+            size_mb = sum(_path_size(p) for p in written) / 1024 ** 2
+            command = [sys.executable, os.path.abspath(__file__), "--child", path]
+            if args.touch:
+                command.append("--touch")
+            result = json.loads(subprocess.check_output(command))
+            print(f"{fmt:<16}{t_write:>10.2f}{size_mb:>10.1f}"
+                  f"{result['load_sec']:>10.3f}{result['load_and_read_sec']:>10.3f}"
+                  f"{result['peak_rss_mb']:>13.1f}")
+    finally:
+        shutil.rmtree(work_dir)
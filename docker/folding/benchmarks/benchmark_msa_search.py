@@ -0,0 +1,186 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare the serial and concurrent monomer data pipelines with fake tools.
+
+The jackhmmer, hhblits and hhsearch binaries are replaced by scripts that
+read the query, spend --search_seconds (scaled per database, part of it busy
+on the CPU) and write canned Stockholm, A3M or HHR output, so the benchmark
+runs anywhere AlphaFold is installed (e.g. in the folding container) without
+the sequence databases.
+
+Usage:
+    python benchmarks/benchmark_msa_search.py --num_cpus 8 --search_seconds 4
+"""
+import argparse
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+import numpy as np
+from alphafold.data import pipeline
+from alphafold.data import templates
+from alphafold.data.tools import hhsearch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from foldhelpers import msa_search
+
+# Relative search time of each fake database.
+DATABASE_SCALES = {
+    "uniref90.fasta": 1.0,
+    "mgnify.fa": 0.8,
+    "bfd": 0.6,
+    "uniclust30": 0.6,
+    "pdb70": 0.2,
+}
+
+FAKE_TOOL = '''#!{python}
+import json, os, sys, time
+
+args = sys.argv[1:]
+def value(option):
+    return args[args.index(option) + 1] if option in args else None
+
+config = json.load(open({config_path!r}))
+database = value("-d") or args[-1]
+seconds = config["search_seconds"] * config["scales"][os.path.basename(database)]
+deadline = time.time() + seconds * config["cpu_fraction"]
+while time.time() < deadline:
+    pass
+time.sleep(seconds * (1 - config["cpu_fraction"]))
+
+query_path = value("-i") or args[-2]
+lines = [line.strip() for line in open(query_path) if line.strip()]
+query = ""
+for line in lines[1:]:
+    if line.startswith(">"):
+        break
+    query += line
+hits = [query[i:] + query[:i] for i in range(1, config["num_hits"] + 1)]
+if value("-A"):
+    rows = ["query"] + [f"hit_{{i}}/1-{{len(query)}}" for i in range(len(hits))]
+    with open(value("-A"), "w") as f:
+        f.write("# STOCKHOLM 1.0\\n\\n")
+        for name, sequence in zip(rows, [query] + hits):
+            f.write(f"{{name:<20}}{{sequence}}\\n")
+        f.write(f"{{'#=GC RF':<20}}{{'x' * len(query)}}\\n//\\n")
+elif value("-oa3m"):
+    with open(value("-oa3m"), "w") as f:
+        f.write(f">query\\n{{query}}\\n")
+        for i, hit in enumerate(hits):
+            f.write(f">hit_{{i}}\\n{{hit}}\\n")
+else:
+    with open(value("-o"), "w") as f:
+        f.write(f"Query         query\\nMatch_columns {{len(query)}}\\nNo_of_seqs    1\\n")
+'''
+
+
+def write_fake_tools(work_dir, args):
+    config_path = os.path.join(work_dir, "fake_tools.json")
+    with open(config_path, "w") as f:
+        json.dump({
+            "search_seconds": args.search_seconds,
+            "cpu_fraction": args.cpu_fraction,
+            "num_hits": args.num_hits,
+            "scales": DATABASE_SCALES,
+        }, f)
+    tool_path = os.path.join(work_dir, "fake_tool")
+    with open(tool_path, "w") as f:
+        f.write(FAKE_TOOL.format(python=sys.executable, config_path=config_path))
+    os.chmod(tool_path, os.stat(tool_path).st_mode | stat.S_IEXEC)
+
+    databases = {}
+    for name in DATABASE_SCALES:
+        path = os.path.join(work_dir, name)
+        # jackhmmer databases are files, hh-suite ones are prefixes.
+        for file_path in (path, f"{path}_a3m.ffdata"):
+            open(file_path, "w").close()
+        databases[name] = path
+    mmcif_dir = os.path.join(work_dir, "mmcif")
+    os.makedirs(mmcif_dir)
+    open(os.path.join(mmcif_dir, "1abc.cif"), "w").close()
+    return tool_path, databases, mmcif_dir
+
+
+def pipeline_kwargs(tool_path, databases, mmcif_dir):
+    return dict(
+        jackhmmer_binary_path=tool_path,
+        hhblits_binary_path=tool_path,
+        uniref90_database_path=databases["uniref90.fasta"],
+        mgnify_database_path=databases["mgnify.fa"],
+        bfd_database_path=databases["bfd"],
+        uniclust30_database_path=databases["uniclust30"],
+        small_bfd_database_path=None,
+        template_searcher=hhsearch.HHSearch(
+            binary_path=tool_path, databases=[databases["pdb70"]]),
+        template_featurizer=templates.HhsearchHitFeaturizer(
+            mmcif_dir=mmcif_dir,
+            max_template_date="2022-01-01",
+            max_hits=20,
+            kalign_binary_path=tool_path,
+            release_dates_path=None,
+            obsolete_pdbs_path=None),
+        use_small_bfd=False)
+
+
+def run_pipeline(data_pipeline, fasta_path, work_dir):
+    msa_output_dir = tempfile.mkdtemp(dir=work_dir)
+    t_0 = time.time()
+    features = data_pipeline.process(
+        input_fasta_path=fasta_path, msa_output_dir=msa_output_dir)
+    return features, time.time() - t_0
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_cpus", type=int, default=8)
+    parser.add_argument("--search_seconds", type=float, default=4.0)
+    parser.add_argument("--cpu_fraction", type=float, default=0.25)
+    parser.add_argument("--num_res", type=int, default=256)
+    parser.add_argument("--num_hits", type=int, default=64)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        tool_path, databases, mmcif_dir = write_fake_tools(work_dir, args)
+        fasta_path = os.path.join(work_dir, "query.fasta")
+        rng = np.random.default_rng(0)
+        with open(fasta_path, "w") as f:
+            f.write(">query\n" + "".join(
+                rng.choice(list("ACDEFGHIKLMNPQRSTVWY"), args.num_res)) + "\n")
+        kwargs = pipeline_kwargs(tool_path, databases, mmcif_dir)
+
+        serial_features, serial_time = run_pipeline(
+            pipeline.DataPipeline(**kwargs), fasta_path, work_dir)
+        concurrent_pipeline = msa_search.ConcurrentDataPipeline(
+            num_cpus=args.num_cpus, **kwargs)
+        concurrent_features, concurrent_time = run_pipeline(
+            concurrent_pipeline, fasta_path, work_dir)
+
+        same_features = serial_features.keys() == concurrent_features.keys() and all(
+            np.array_equal(serial_features[name], concurrent_features[name])
+            for name in serial_features)
+        print(f"{'pipeline':<12}{'wall_sec':>10}")
+        print(f"{'serial':<12}{serial_time:>10.2f}")
+        print(f"{'concurrent':<12}{concurrent_time:>10.2f}")
+        print(f"same features: {same_features}")
+        print(f"{'search':<16}{'wall_sec':>10}{'cpu_sec':>10}")
+        for name in sorted(concurrent_pipeline.last_timings):
+            if name.endswith("_search_wall"):
+                search = name[:-len("_search_wall")]
+                wall_time = concurrent_pipeline.last_timings[name]
+                cpu_time = concurrent_pipeline.last_timings[f"{search}_search_cpu"]
+                print(f"{search:<16}{wall_time:>10.2f}{cpu_time:>10.2f}")
+    finally:
+        shutil.rmtree(work_dir)
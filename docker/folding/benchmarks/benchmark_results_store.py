@@ -0,0 +1,87 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare bytes written and serialization time of the result output profiles.
+
+Usage:
+    python benchmarks/benchmark_results_store.py --num_res 1000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from foldhelpers import results_store
+
+
+def make_prediction_result(num_res, num_msa=508, multimer=False):
+    """Synthetic prediction result with the shapes of a model_*_ptm result."""
+    rng = np.random.default_rng(0)
+    probs = rng.random((num_res, num_res, 64), dtype=np.float32)
+    result = {
+        "distogram": {
+            "bin_edges": np.linspace(2.3125, 21.6875, 63, dtype=np.float32),
+            "logits": rng.standard_normal(
+                (num_res, num_res, 64), dtype=np.float32),
+        },
+        "experimentally_resolved": {
+            "logits": rng.standard_normal((num_res, 37), dtype=np.float32),
+        },
+        "masked_msa": {
+            "logits": rng.standard_normal(
+                (num_msa, num_res, 23), dtype=np.float32),
+        },
+        "predicted_lddt": {
+            "logits": rng.standard_normal((num_res, 50), dtype=np.float32),
+        },
+        "structure_module": {
+            "final_atom_mask": (rng.random((num_res, 37)) > 0.5).astype(np.float32),
+            "final_atom_positions": rng.standard_normal(
+                (num_res, 37, 3), dtype=np.float32) * 30,
+        },
+        "plddt": rng.random(num_res, dtype=np.float32) * 100,
+        "aligned_confidence_probs": probs / probs.sum(-1, keepdims=True),
+        "predicted_aligned_error": rng.random(
+            (num_res, num_res), dtype=np.float32) * 31.75,
+        "max_predicted_aligned_error": np.float32(31.75),
+        "ptm": np.float32(0.8),
+        "ranking_confidence": np.float32(0.8),
+    }
+    if multimer:
+        result["iptm"] = np.float32(0.7)
+    return result
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_res", type=int, default=500)
+    parser.add_argument("--multimer", action="store_true")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    result = make_prediction_result(args.num_res, multimer=args.multimer)
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'profile':<10}{'write_sec':>10}{'size_mb':>10}{'load_sec':>10}")
+        for profile in results_store.PROFILES:
+            t_0 = time.time()
+            path = results_store.save_result(result, work_dir, "model_1", profile)
+            t_write = time.time() - t_0
+            t_0 = time.time()
+            results_store.load_result(path)
+            t_load = time.time() - t_0
+            size_mb = os.path.getsize(path) / 1024 ** 2
+            print(f"{profile:<10}{t_write:>10.2f}{size_mb:>10.1f}{t_load:>10.2f}")
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,213 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare the target-major and model-major schedules of run_aws_alphafold.
+
+Stub model runners stand in for AlphaFold. Each one is a
+lazy_params.LazyRunModel that memory-maps its parameters from an .npz file on
+first use, "compiles" once per input shape (a sleep of --compile_seconds, like
+the jit cache of RunModel.apply, which outlives released parameters) and
+multiplies the synthetic features by its parameters. The script runs
+run_aws_alphafold._predict_all_targets on --num_targets precomputed feature
+files with each --schedule and --release_params_after_use, and reports the
+wall time, the number of parameter loads and compiles, and the largest number
+of models whose parameters were loaded at the same time.
+
+Usage:
+    python benchmarks/benchmark_schedules.py --num_targets 8 --num_models 5
+"""
+import argparse
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import run_aws_alphafold
+from alphafold.common import protein
+from foldhelpers import lazy_params
+from foldhelpers import scheduling
+from foldhelpers import tracing
+
+NUM_CHANNELS = 256
+
+
+class Stats:
+
+    def __init__(self):
+        self.loads = 0
+        self.compiles = 0
+        self.loaded = 0
+        self.max_loaded = 0
+
+
+class StubModelRunner(lazy_params.LazyRunModel):
+    multimer_mode = False
+
+    def __init__(self, model_name, params_path, compile_seconds, stats):
+        # RunModel.__init__ would build the haiku model, which is not needed.
+        self.model_name = model_name
+        self.path = params_path
+        self.params = None
+        self.load_seconds = None
+        self.compile_seconds = compile_seconds
+        self.stats = stats
+        self.compiled_shapes = set()
+
+    def load(self):
+        if self.loaded:
+            return 0.0
+        self.stats.loads += 1
+        self.stats.loaded += 1
+        self.stats.max_loaded = max(self.stats.max_loaded, self.stats.loaded)
+        return super().load()
+
+    def release(self):
+        if self.loaded:
+            self.stats.loaded -= 1
+        super().release()
+
+    def process_features(self, raw_features, random_seed):
+        return {
+            "aatype": raw_features["aatype"].argmax(axis=-1)[None],
+            "residue_index": raw_features["residue_index"][None],
+            "msa_feat": raw_features["msa_feat"][None],
+        }
+
+    def predict(self, feat, random_seed):
+        self.load()
+        shape = feat["msa_feat"].shape
+        if shape not in self.compiled_shapes:
+            time.sleep(self.compile_seconds)
+            self.stats.compiles += 1
+            self.compiled_shapes.add(shape)
+        activations = feat["msa_feat"][0]
+        for scope in sorted(self.params):
+            weights = self.params[scope]
+            if isinstance(weights, dict):
+                weights = weights["weights"]
+            activations = np.tanh(activations @ weights)
+        num_res = activations.shape[0]
+        plddt = 50 + 40 / (1 + np.exp(-activations.mean(axis=-1)))
+        rng = np.random.default_rng(random_seed)
+        return {
+            "plddt": plddt,
+            "ranking_confidence": float(plddt.mean()),
+            "structure_module": {
+                "final_atom_positions": rng.standard_normal((num_res, 37, 3)),
+                "final_atom_mask": np.ones((num_res, 37)),
+            },
+        }
+
+
+class StubRelaxer:
+
+    def process(self, *, prot):
+        return protein.to_pdb(prot), None, None
+
+
+def write_params(path, params_mb, seed):
+    rng = np.random.default_rng(seed)
+    num_layers = max(1, int(params_mb * 1024 ** 2 / (4 * NUM_CHANNELS ** 2)))
+    # Flat names, as in the AlphaFold parameter files.
+    np.savez(path, **{
+        f"layer_{i:03d}//weights": rng.standard_normal(
+            (NUM_CHANNELS, NUM_CHANNELS), dtype=np.float32) / NUM_CHANNELS ** 0.5
+        for i in range(num_layers)
+    })
+
+
+def write_features(path, num_res, seed):
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        pickle.dump({
+            "aatype": np.eye(21)[rng.integers(0, 20, num_res)],
+            "residue_index": np.arange(num_res),
+            "msa_feat": rng.standard_normal(
+                (num_res, NUM_CHANNELS), dtype=np.float32),
+        }, f)
+
+
+def run_schedule(schedule, args, params_paths, features_paths, output_dir):
+    run_aws_alphafold.FLAGS.schedule = schedule
+    run_aws_alphafold.FLAGS.output_dir = output_dir
+    stats = Stats()
+    model_runners = {
+        f"model_{i + 1}_pred_0": StubModelRunner(
+            f"model_{i + 1}", path, args.compile_seconds, stats)
+        for i, path in enumerate(params_paths)
+    }
+    fasta_names = [f"target_{i}" for i in range(len(features_paths))]
+    t_0 = time.time()
+    run_aws_alphafold._predict_all_targets(
+        fasta_paths=[None] * len(features_paths),
+        fasta_names=fasta_names,
+        features_paths=features_paths,
+        data_pipeline=None,
+        model_runners=model_runners,
+        amber_relaxer=StubRelaxer() if args.relax else None,
+        random_seed=0,
+        on_output=None,
+        relax_workers=None,
+        relax_top_k=None,
+        length_buckets=[],
+        job_trace=tracing.NULL_TRACE,
+    )
+    return time.time() - t_0, stats
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_targets", type=int, default=8)
+    parser.add_argument("--num_models", type=int, default=5)
+    parser.add_argument("--num_res", type=int, default=384)
+    parser.add_argument("--params_mb", type=float, default=90)
+    parser.add_argument("--compile_seconds", type=float, default=0.5)
+    parser.add_argument("--relax", action="store_true")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        run_aws_alphafold.FLAGS([
+            "benchmark_schedules", f"--output_dir={work_dir}",
+            "--release_params_after_use", "--nodeduplicate_targets",
+        ])
+        params_paths = []
+        for i in range(args.num_models):
+            path = os.path.join(work_dir, f"params_model_{i + 1}.npz")
+            write_params(path, args.params_mb, seed=i)
+            params_paths.append(path)
+        features_paths = []
+        for i in range(args.num_targets):
+            path = os.path.join(work_dir, f"features_{i}.pkl")
+            write_features(path, args.num_res, seed=i)
+            features_paths.append(path)
+
+        rankings = {}
+        print(f"{'schedule':<14}{'wall_sec':>10}{'loads':>8}{'compiles':>10}"
+              f"{'max_loaded':>12}")
+        for schedule in scheduling.SCHEDULES:
+            output_dir = os.path.join(work_dir, schedule)
+            wall_time, stats = run_schedule(
+                schedule, args, params_paths, features_paths, output_dir)
+            print(f"{schedule:<14}{wall_time:>10.2f}{stats.loads:>8}"
+                  f"{stats.compiles:>10}{stats.max_loaded:>12}")
+            rankings[schedule] = [
+                open(os.path.join(output_dir, f"target_{i}",
+                                  "ranking_debug.json")).read()
+                for i in range(args.num_targets)
+            ]
+        print(f"same rankings: {len(set(map(tuple, rankings.values()))) == 1}")
+    finally:
+        shutil.rmtree(work_dir)
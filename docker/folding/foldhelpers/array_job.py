@@ -0,0 +1,37 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Shards of an AWS Batch array job.
+
+nbhelpers.submit_batch_alphafold_array_job packs the FASTA files of a library
+into shards of similar estimated cost and writes them to a JSON manifest,
+{"shards": [[fasta_path, ...], ...]}. Every child job of the array runs the
+same command and processes the shard at its index, which AWS Batch sets in
+the AWS_BATCH_JOB_ARRAY_INDEX environment variable.
+"""
+import json
+import os
+from typing import List
+
+ARRAY_INDEX_ENV = "AWS_BATCH_JOB_ARRAY_INDEX"
+
+
+def array_index() -> int:
+    """Index of this child of an array job, 0 for a job that is not an array."""
+    return int(os.environ.get(ARRAY_INDEX_ENV, 0))
+
+
+def read_shard(manifest_str: str, index: int) -> List[str]:
+    """FASTA paths of one shard of a shard manifest.
+
+    Args:
+        manifest_str (str): Contents of the JSON manifest.
+        index (int): Index of the shard, i.e. of the child job.
+    """
+    shards = json.loads(manifest_str)["shards"]
+    if not 0 <= index < len(shards):
+        raise ValueError(
+            f"Array index {index} is out of range, the manifest has "
+            f"{len(shards)} shards.")
+    return list(shards[index])
@@ -0,0 +1,199 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Sequence-length bucketing, so compiled JAX executables are reused across targets.
+
+JAX compiles `RunModel.predict` once per distinct set of input shapes. For
+monomer models the only shape that changes between targets is the number of
+residues (the MSA, extra MSA and template dimensions are already padded to
+fixed sizes by the data pipeline), so padding the residue dimension up to one
+of a few bucket sizes lets targets of similar length share one executable.
+Predictions are cropped back to the real length afterwards, and the
+confidence metrics that depend on the length are recomputed.
+"""
+from typing import Any, Dict, Hashable, List, Mapping, Optional, Sequence
+
+import numpy as np
+
+# Residue axes of the results of a monomer model. Heads map to the axes of
+# all of their arrays, or to the axes of each array by name. Results that are
+# not listed (e.g. distogram.bin_edges) are not cropped.
+_RESIDUE_AXES = {
+    "structure_module": (0,),
+    "predicted_lddt": (0,),
+    "experimentally_resolved": (0,),
+    "distogram": {"logits": (0, 1)},
+    "masked_msa": {"logits": (1,)},
+    "representations": {
+        "msa": (1,),
+        "msa_first_row": (0,),
+        "pair": (0, 1),
+        "single": (0,),
+        "structure_module": (0,),
+    },
+    "plddt": (0,),
+    "predicted_aligned_error": (0, 1),
+    "aligned_confidence_probs": (0, 1),
+}
+
+
+def parse_buckets(values: Optional[Sequence[str]]) -> List[int]:
+    """Sorted bucket sizes from a --length_buckets flag value."""
+    if not values:
+        return []
+    buckets = sorted({int(value) for value in values})
+    if buckets[0] <= 0:
+        raise ValueError("Length buckets must be positive integers.")
+    return buckets
+
+
+def bucket_for(num_res: int, buckets: Sequence[int]) -> int:
+    """Smallest bucket that fits `num_res`, or `num_res` if none does."""
+    for bucket in buckets:
+        if bucket >= num_res:
+            return bucket
+    return num_res
+
+
+def order_by_bucket(lengths: Sequence[int], buckets: Sequence[int]) -> List[int]:
+    """Indices of `lengths` grouped by bucket, or sorted by length without buckets.
+
+    The sort is stable, so targets in the same bucket keep their order.
+    """
+    if buckets:
+        key = lambda i: bucket_for(lengths[i], buckets)
+    else:
+        key = lambda i: lengths[i]
+    return sorted(range(len(lengths)), key=key)
+
+
+def resize_features(
+    processed_features: Mapping[str, np.ndarray],
+    feature_schema: Mapping[str, Sequence[Any]],
+    num_res_placeholder: str,
+    num_res: int,
+) -> Dict[str, np.ndarray]:
+    """Zero-pad (or crop) the residue axes of processed monomer features.
+
+    Args:
+        processed_features: Output of `RunModel.process_features`. Every
+            feature has a leading ensemble dimension.
+        feature_schema: Shape of each feature, without the ensemble dimension,
+            as in `config.data.eval.feat`.
+        num_res_placeholder: Placeholder used for the residue dimension in
+            `feature_schema`.
+        num_res: New size of the residue dimension.
+    """
+    resized = {}
+    for name, value in processed_features.items():
+        value = np.asarray(value)
+        schema = feature_schema.get(name)
+        if schema is None:
+            resized[name] = value
+            continue
+        # Account for the leading ensemble dimension.
+        schema = [None] + list(schema)
+        padding = [(0, 0)] * value.ndim
+        crop = [slice(None)] * value.ndim
+        for axis, dim in enumerate(schema[: value.ndim]):
+            if dim != num_res_placeholder:
+                continue
+            if value.shape[axis] < num_res:
+                padding[axis] = (0, num_res - value.shape[axis])
+            else:
+                crop[axis] = slice(0, num_res)
+        resized[name] = np.pad(value[tuple(crop)], padding)
+    return resized
+
+
+def predicted_tm_score(aligned_confidence_probs: np.ndarray,
+                       max_error_bin: float, num_bins: int) -> float:
+    """pTM from the PAE bin probabilities, as in alphafold.common.confidence."""
+    num_res = aligned_confidence_probs.shape[0]
+    breaks = np.linspace(0.0, max_error_bin, num_bins - 1)
+    step = breaks[1] - breaks[0]
+    bin_centers = np.concatenate([breaks + step / 2, [breaks[-1] + 3 * step / 2]])
+    clipped_num_res = max(num_res, 19)
+    d0 = 1.24 * (clipped_num_res - 15) ** (1.0 / 3) - 1.8
+    tm_per_bin = 1.0 / (1 + np.square(bin_centers) / np.square(d0))
+    predicted_tm_term = np.sum(aligned_confidence_probs * tm_per_bin, axis=-1)
+    per_alignment = predicted_tm_term.mean(axis=-1)
+    return float(per_alignment.max())
+
+
+def _crop(value: Any, axes: Optional[Sequence[int]], num_res: int) -> Any:
+    if axes is None or np.ndim(value) == 0:
+        return value
+    value = np.asarray(value)
+    crop = [slice(None)] * value.ndim
+    for axis in axes:
+        crop[axis] = slice(0, num_res)
+    return value[tuple(crop)]
+
+
+def crop_prediction_result(
+    result: Mapping[str, Any],
+    num_res: int,
+    padded_num_res: int,
+    pae_max_error_bin: float,
+    pae_num_bins: int,
+) -> Dict[str, Any]:
+    """Crop a monomer prediction made on padded features to `num_res`.
+
+    Only the residue axes listed in `_RESIDUE_AXES` are cropped, other axes
+    (e.g. the bins of predicted_lddt.logits) can have the same size as the
+    padded residue axis. pLDDT and the ranking confidence (mean pLDDT for
+    monomer models) and pTM are recomputed over the real residues only.
+    """
+    if num_res > padded_num_res:
+        raise ValueError(f"Cannot crop {padded_num_res} padded residues to "
+                         f"{num_res}.")
+    cropped = {}
+    for key, value in result.items():
+        axes = _RESIDUE_AXES.get(key)
+        if isinstance(value, Mapping):
+            cropped[key] = {
+                name: _crop(v, axes.get(name) if isinstance(axes, dict) else axes,
+                            num_res)
+                for name, v in value.items()
+            }
+        else:
+            cropped[key] = _crop(value, axes, num_res)
+    cropped["ranking_confidence"] = np.mean(cropped["plddt"])
+    if "aligned_confidence_probs" in cropped:
+        cropped["ptm"] = np.asarray(predicted_tm_score(
+            cropped["aligned_confidence_probs"], pae_max_error_bin, pae_num_bins))
+    return cropped
+
+
+def shape_signature(features: Mapping[str, Any]) -> tuple:
+    """Hashable summary of the shapes and dtypes that JAX compiles for."""
+    return tuple(sorted(
+        (name, np.shape(value), str(np.asarray(value).dtype))
+        for name, value in features.items()
+    ))
+
+
+class CompileCacheTracker:
+    """Counts how often a model is run on shapes it has already compiled for.
+
+    `RunModel.apply` is a jitted function, so a second call with the same input
+    shapes on the same runner reuses the compiled executable.
+    """
+
+    def __init__(self):
+        self._seen = set()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, runner_key: Hashable, signature: Hashable) -> bool:
+        """Record a predict call. Returns True for a cache hit."""
+        key = (runner_key, signature)
+        hit = key in self._seen
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._seen.add(key)
+        return hit
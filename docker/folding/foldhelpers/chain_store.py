@@ -0,0 +1,140 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Chain-level MSA reuse for the multimer data pipeline.
+
+`pipeline_multimer.DataPipeline` already searches each distinct sequence of a
+complex only once, but repeats the searches for chains that appear in other
+complexes (e.g. one bait against a panel of preys). Here the per-chain results
+are kept in a features cache store (see foldhelpers.feature_cache), in two
+entries per sequence: the monomer pipeline features with their MSAs, and the
+UniProt "all_seq" features used for pairing in heteromers. A chain that was
+first seen in a homomer then only needs the UniProt search when it shows up
+in a heteromer.
+"""
+import os
+import tempfile
+from typing import Any, Callable, Dict, Mapping
+
+from absl import logging
+from alphafold.data import pipeline_multimer
+import numpy as np
+
+from foldhelpers import feature_cache
+
+MONOMER_STEP = "monomer"
+ALL_SEQ_STEP = "all_seq"
+
+
+class ChainCachingDataPipeline(pipeline_multimer.DataPipeline):
+    """Multimer data pipeline that looks up each chain in a store first.
+
+    Args:
+        store: `feature_cache.LocalCacheStore` or `feature_cache.S3CacheStore`.
+        context (dict): Output of `feature_cache.pipeline_context`.
+        kwargs: Arguments of `pipeline_multimer.DataPipeline`.
+    """
+
+    def __init__(self, store, context: Mapping[str, Any], **kwargs):
+        super().__init__(**kwargs)
+        self.store = store
+        self.context = dict(context)
+        # Chain statistics of the last call to process(), for timings.json.
+        self.last_timings = {"chain_msa_hits": 0, "chain_msa_misses": 0}
+
+    def process(self, input_fasta_path: str, msa_output_dir: str):
+        self.last_timings = {"chain_msa_hits": 0, "chain_msa_misses": 0}
+        return super().process(input_fasta_path=input_fasta_path,
+                               msa_output_dir=msa_output_dir)
+
+    def _cached(self, step: str, sequence: str, msa_output_dir: str,
+                compute: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Features of one search step of a chain, from the store if possible.
+
+        MSA files written by `compute` to `msa_output_dir` are stored with the
+        features and copied back on a hit.
+        """
+        key = feature_cache.cache_key(
+            [sequence], {**self.context, "chain_step": step})
+        try:
+            cached = feature_cache.fetch_entry(self.store, key, msa_output_dir)
+        except Exception as err:
+            logging.warning(f"Chain MSA lookup of {key} failed: {err}")
+            cached = None
+        if cached is not None:
+            logging.info(f"Reusing the {step} search of chain {key}")
+            self.last_timings["chain_msa_hits"] += 1
+            return cached[0]
+
+        files_before = set(os.listdir(msa_output_dir))
+        features = compute()
+        self.last_timings["chain_msa_misses"] += 1
+        try:
+            feature_cache.store_entry(
+                self.store, key, features, msa_output_dir,
+                msa_files=sorted(set(os.listdir(msa_output_dir)) - files_before),
+                chain_step=step)
+        except Exception as err:
+            logging.warning(f"Unable to store chain {key}: {err}")
+        return features
+
+    def _process_single_chain(self, chain_id: str, sequence: str,
+                              description: str, msa_output_dir: str,
+                              is_homomer_or_monomer: bool):
+        """Same as the parent method, with both search steps cached."""
+        chain_fasta_str = f'>chain_{chain_id}\n{sequence}\n'
+        chain_msa_output_dir = os.path.join(msa_output_dir, chain_id)
+        os.makedirs(chain_msa_output_dir, exist_ok=True)
+        with pipeline_multimer.temp_fasta_file(chain_fasta_str) as chain_fasta_path:
+            logging.info('Running monomer pipeline on chain %s: %s',
+                         chain_id, description)
+            chain_features = self._cached(
+                MONOMER_STEP, sequence, chain_msa_output_dir,
+                lambda: self._monomer_data_pipeline.process(
+                    input_fasta_path=chain_fasta_path,
+                    msa_output_dir=chain_msa_output_dir))
+            # The cached features may come from a chain with another id.
+            chain_features['domain_name'] = np.array(
+                [f'chain_{chain_id}'.encode()], dtype=np.object_)
+
+            # We only construct the pairing features if there are 2 or more
+            # unique sequences.
+            if not is_homomer_or_monomer:
+                chain_features.update(self._cached(
+                    ALL_SEQ_STEP, sequence, chain_msa_output_dir,
+                    lambda: self._all_seq_msa_features(
+                        chain_fasta_path, chain_msa_output_dir)))
+        return chain_features
+
+    def precompute_chain(self, sequence: str, paired: bool):
+        """Search one chain and store the results, unless they are stored.
+
+        Args:
+            sequence (str): Chain sequence.
+            paired (bool): Whether the chain appears in a heteromer, which
+                also needs the UniProt search used for pairing.
+        """
+        with tempfile.TemporaryDirectory() as msa_output_dir:
+            self._process_single_chain(
+                chain_id="A", sequence=sequence, description="precompute",
+                msa_output_dir=msa_output_dir,
+                is_homomer_or_monomer=not paired)
+
+
+def unique_chains(fasta_sequences: Mapping[str, Any]) -> Dict[str, bool]:
+    """Distinct chain sequences of a batch, and whether each needs pairing.
+
+    Args:
+        fasta_sequences (dict): Sequences of each FASTA file, by name.
+
+    Returns:
+        dict: For each distinct sequence, True if it is a chain of at least one
+            heteromer.
+    """
+    chains = {}
+    for sequences in fasta_sequences.values():
+        heteromer = len(set(sequences)) > 1
+        for sequence in sequences:
+            chains[sequence] = chains.get(sequence, False) or heteromer
+    return chains
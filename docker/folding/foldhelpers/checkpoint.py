@@ -0,0 +1,148 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Checkpoints of the stages that a target has completed, to resume a job.
+
+`TargetCheckpoint` keeps a small manifest, checkpoint.json, in the output
+directory of a target. It lists the completed stages: the features, and the
+prediction and relaxation of each model. Each stage records the SHA-256 digest
+of the files it wrote and the values needed to skip it, e.g. the ranking
+confidence and timings of a model. The manifest is rewritten after each stage
+and passed to `on_output`, so it is streamed to S3 with the outputs. A stage
+that wrote a directory (e.g. features saved as .npy files) records every file
+under it.
+
+When the job runs again, e.g. after a Spot interruption, a stage is skipped if
+its files are present locally, or can be fetched from S3, and still match
+their digests. Otherwise it is run again.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from absl import logging
+
+MANIFEST_NAME = "checkpoint.json"
+VERSION = 1
+
+
+def file_digest(path: str, chunk_bytes: int = 8 * 1024 * 1024) -> str:
+    """SHA-256 digest of a file, in hex."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _files(paths: Sequence[str]) -> List[str]:
+    """`paths`, with each directory replaced by the files under it."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                files.extend(os.path.join(dirpath, name)
+                             for name in sorted(filenames))
+        else:
+            files.append(path)
+    return files
+
+
+class TargetCheckpoint:
+    """Completed stages of one target, in <output_dir>/checkpoint.json.
+
+    Args:
+        output_dir (str): Output directory of the target.
+        fetch (callable): Called with the local path of a file that is missing,
+            e.g. to download it from S3. Returns whether the file now exists.
+        on_output (callable): Called with the path of the manifest each time it
+            is written.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        fetch: Optional[Callable[[str], bool]] = None,
+        on_output: Optional[Callable[[str], None]] = None,
+    ):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self._fetch = fetch if fetch is not None else lambda path: False
+        self._on_output = on_output if on_output is not None else lambda path: None
+        self._manifest = self._load()
+
+    def _exists(self, path: str) -> bool:
+        return os.path.exists(path) or self._fetch(path)
+
+    def _load(self) -> Dict[str, Any]:
+        empty = {"version": VERSION, "target": {}, "models": {}}
+        if not self._exists(self.path):
+            return empty
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError) as err:
+            logging.warning(f"Ignoring the unreadable checkpoint {self.path}: {err}")
+            return empty
+        if manifest.get("version") != VERSION:
+            logging.warning(f"Ignoring {self.path}, written by another version")
+            return empty
+        return manifest
+
+    def _stages(self, model_name: Optional[str]) -> Dict[str, Any]:
+        if model_name is None:
+            return self._manifest["target"]
+        return self._manifest["models"].setdefault(model_name, {})
+
+    def completed(self, stage: str, model_name: Optional[str] = None
+                  ) -> Optional[Dict[str, Any]]:
+        """Values recorded with a stage, or None if it must be run (again).
+
+        Args:
+            stage (str): Name of the stage, e.g. "features" or "predicted".
+            model_name (str): Model the stage belongs to, None for the stages
+                of the target.
+        """
+        stages = self._stages(model_name)
+        record = stages.get(stage)
+        if record is None:
+            return None
+        for name, digest in record["files"].items():
+            path = os.path.join(self.output_dir, name)
+            if not self._exists(path) or file_digest(path) != digest:
+                logging.warning(
+                    f"{path} is missing or was modified, running the {stage} "
+                    f"stage of {model_name or 'the target'} again")
+                del stages[stage]
+                return None
+        return record["values"]
+
+    def record(self, stage: str, paths: Sequence[str],
+               model_name: Optional[str] = None, **values: Any):
+        """Mark a stage as completed and write the manifest.
+
+        Args:
+            stage (str): Name of the stage.
+            paths (list): Files or directories written by the stage, under
+                the output directory.
+            model_name (str): Model the stage belongs to, None for the stages
+                of the target.
+            values: JSON-serializable values returned by `completed`.
+        """
+        self._stages(model_name)[stage] = {
+            "files": {
+                os.path.relpath(path, self.output_dir): file_digest(path)
+                for path in _files(paths)
+            },
+            "values": values,
+        }
+        # Replaced atomically, so a job killed while writing it still leaves
+        # the previous manifest.
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(self._manifest, indent=4))
+        os.replace(tmp_path, self.path)
+        self._on_output(self.path)
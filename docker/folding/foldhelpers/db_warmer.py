@@ -0,0 +1,364 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Page-cache warm-up and residency profiling of the sequence databases.
+
+jackhmmer and hhblits stream through their databases, so the first job on a
+node pays the full FSx for Lustre read cost of every database it searches.
+`warm` reads the database files into the page cache before the first search,
+with parallel sequential reads and readahead hints. It skips the parts of the
+files that are already resident and stops at a memory budget, so that warming
+one database does not evict another. Residency is measured with mincore(2).
+
+Usage:
+    python -m foldhelpers.db_warmer /mnt/uniref90_database_path/uniref90.fasta
+    python -m foldhelpers.db_warmer --warm --max_gb 64 /mnt/bfd_database_path/bfd
+"""
+import argparse
+from concurrent import futures
+import ctypes
+import ctypes.util
+import functools
+import glob
+import mmap
+import os
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from absl import logging
+import numpy as np
+
+from foldhelpers import resource_sampler
+
+MB = 1024 * 1024
+# Unit of work of the read threads. Each one is read sequentially.
+SEGMENT_BYTES = 256 * MB
+READ_BYTES = 8 * MB
+# Size of the mappings used to query residency.
+WINDOW_BYTES = 1024 * MB
+
+
+@functools.lru_cache(maxsize=None)
+def _libc():
+    """libc with mmap, munmap and mincore, or None if unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.mmap.restype = ctypes.c_void_p
+        libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int,
+                              ctypes.c_int, ctypes.c_int, ctypes.c_long]
+        libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+        libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t,
+                                 ctypes.POINTER(ctypes.c_ubyte)]
+    except (AttributeError, OSError):
+        return None
+    return libc
+
+
+def resident_page_counts(path: str, pages_per_chunk: int) -> Optional[np.ndarray]:
+    """Number of pages of each chunk of a file that are in the page cache.
+
+    Residency is queried one window at a time, so that memory does not grow
+    with the size of the file.
+
+    Args:
+        path (str): File to measure.
+        pages_per_chunk (int): Number of pages of each chunk. The last chunk
+            may be shorter.
+
+    Returns:
+        np.ndarray: Resident pages of each chunk, or None if residency cannot
+            be measured on this platform.
+    """
+    libc = _libc()
+    if libc is None:
+        return None
+    num_bytes = os.path.getsize(path)
+    num_pages = (num_bytes + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    counts = np.zeros(-(-num_pages // pages_per_chunk), dtype=np.int64)
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for offset in range(0, num_bytes, WINDOW_BYTES):
+            length = min(WINDOW_BYTES, num_bytes - offset)
+            address = libc.mmap(None, length, mmap.PROT_READ, mmap.MAP_SHARED,
+                                fd, offset)
+            if address in (None, ctypes.c_void_p(-1).value):
+                return None
+            try:
+                window_pages = (length + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+                vec = (ctypes.c_ubyte * window_pages)()
+                if libc.mincore(address, length, vec) != 0:
+                    return None
+                first_page = offset // mmap.PAGESIZE
+                chunks = np.arange(
+                    first_page, first_page + window_pages) // pages_per_chunk
+                window_counts = np.bincount(
+                    chunks - chunks[0], weights=np.frombuffer(vec, dtype=np.uint8) & 1)
+                counts[chunks[0]:chunks[0] + len(window_counts)] += (
+                    window_counts.astype(np.int64))
+            finally:
+                libc.munmap(address, length)
+    finally:
+        os.close(fd)
+    return counts
+
+
+def _chunk_pages(num_bytes: int, pages_per_chunk: int) -> np.ndarray:
+    """Number of pages of each chunk of a file of `num_bytes` bytes."""
+    num_pages = (num_bytes + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    first_pages = np.arange(0, num_pages, pages_per_chunk)
+    return np.minimum(pages_per_chunk, num_pages - first_pages)
+
+
+def resident_bytes(path: str) -> Optional[int]:
+    """Number of bytes of a file in the page cache, or None if unknown."""
+    counts = resident_page_counts(path, WINDOW_BYTES // mmap.PAGESIZE)
+    if counts is None:
+        return None
+    return min(int(counts.sum()) * mmap.PAGESIZE, os.path.getsize(path))
+
+
+def residency_profile(path: str, num_buckets: int = 20) -> Optional[List[float]]:
+    """Resident fraction of each of `num_buckets` equal parts of a file.
+
+    Shows which parts of a database the searches actually read, e.g. the
+    few regions of a pdb70 ffdata file that hhsearch touches.
+    """
+    num_bytes = os.path.getsize(path)
+    num_pages = (num_bytes + mmap.PAGESIZE - 1) // mmap.PAGESIZE
+    if not num_pages:
+        return None
+    pages_per_bucket = -(-num_pages // min(num_buckets, num_pages))
+    counts = resident_page_counts(path, pages_per_bucket)
+    if counts is None:
+        return None
+    return [float(fraction) for fraction in
+            counts / _chunk_pages(num_bytes, pages_per_bucket)]
+
+
+def available_memory() -> Optional[int]:
+    """MemAvailable of /proc/meminfo, in bytes."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def memory_headroom() -> Optional[int]:
+    """Memory the job can still fill with page cache, in bytes.
+
+    The container's cgroup limit minus what is already charged to it, page
+    cache included, and at most MemAvailable of the host. The page cache of
+    the whole host may be larger than the limit of the container, which is
+    what the kernel reclaims from when the job nears it.
+    """
+    available = available_memory()
+    limit = resource_sampler.memory_limit()
+    usage = resource_sampler.memory_usage()
+    if limit is None or usage is None:
+        return available
+    headroom = max(0, limit - usage)
+    return min(headroom, available) if available is not None else headroom
+
+
+def database_files(database_paths: Sequence[str]) -> List[str]:
+    """Files of the given databases, in order.
+
+    A path is either a file (jackhmmer databases, pdb_seqres.txt) or the
+    prefix of an hh-suite database, whose _a3m/_hhm/_cs219 ffindex and ffdata
+    files are returned.
+    """
+    files = []
+    for database_path in database_paths:
+        if os.path.isfile(database_path):
+            files.append(database_path)
+            continue
+        prefix_files = sorted(
+            path for path in glob.glob(f"{glob.escape(database_path)}_*")
+            if os.path.isfile(path))
+        if not prefix_files:
+            logging.warning(f"No database files found for {database_path}")
+        files.extend(prefix_files)
+    return files
+
+
+class FileWarmup(NamedTuple):
+    path: str
+    num_bytes: int
+    # None where residency cannot be measured.
+    resident_before: Optional[int]
+    resident_after: Optional[int]
+    bytes_read: int
+    skipped: bool
+
+
+class WarmupReport(NamedTuple):
+    files: List[FileWarmup]
+    seconds: float
+    max_bytes: Optional[int]
+
+    @property
+    def bytes_read(self) -> int:
+        return sum(f.bytes_read for f in self.files)
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "bytes_read": self.bytes_read,
+            "max_bytes": self.max_bytes,
+            "files": [f._asdict() for f in self.files],
+        }
+
+
+def _read_segment(path: str, offset: int, length: int) -> int:
+    """Read a part of a file sequentially, discarding the data."""
+    buffer = bytearray(min(READ_BYTES, length))
+    bytes_read = 0
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+        while bytes_read < length:
+            view = memoryview(buffer)[:min(len(buffer), length - bytes_read)]
+            num_bytes = os.preadv(fd, [view], offset + bytes_read)
+            if num_bytes == 0:
+                break
+            bytes_read += num_bytes
+    finally:
+        os.close(fd)
+    return bytes_read
+
+
+def _missing_segments(
+    num_bytes: int, counts: Optional[np.ndarray]
+) -> List[Tuple[int, int]]:
+    """(offset, length) of the segments of a file that are not all resident.
+
+    Args:
+        num_bytes (int): Size of the file.
+        counts (np.ndarray): Resident pages of each segment, None if unknown.
+    """
+    segment_pages = _chunk_pages(num_bytes, SEGMENT_BYTES // mmap.PAGESIZE)
+    return [
+        (offset, min(SEGMENT_BYTES, num_bytes - offset))
+        for i, offset in enumerate(range(0, num_bytes, SEGMENT_BYTES))
+        if counts is None or counts[i] < segment_pages[i]
+    ]
+
+
+def warm(
+    database_paths: Sequence[str],
+    max_bytes: Optional[int] = None,
+    num_threads: int = 8,
+) -> WarmupReport:
+    """Read the files of the databases into the page cache.
+
+    Files are warmed in order until the next one does not fit in the budget.
+    That file is skipped and the following, smaller files may still fit.
+
+    Args:
+        database_paths (list): Database files or hh-suite prefixes, most
+            important first.
+        max_bytes (int): Budget of bytes that are not resident yet. Defaults to
+            80% of the memory headroom of the container (see memory_headroom).
+        num_threads (int): Number of segments read concurrently.
+
+    Returns:
+        WarmupReport: Residency before and after, and bytes read, per file.
+    """
+    if max_bytes is None:
+        headroom = memory_headroom()
+        max_bytes = int(0.8 * headroom) if headroom is not None else None
+    t_0 = time.time()
+    planned = []
+    budget = max_bytes
+    for path in database_files(database_paths):
+        num_bytes = os.path.getsize(path)
+        counts = resident_page_counts(path, SEGMENT_BYTES // mmap.PAGESIZE)
+        before = (min(int(counts.sum()) * mmap.PAGESIZE, num_bytes)
+                  if counts is not None else None)
+        segments = _missing_segments(num_bytes, counts)
+        missing = num_bytes - (before or 0)
+        skipped = budget is not None and missing > budget
+        if skipped:
+            logging.warning(
+                f"Not warming {path}: {missing / MB:.0f} MB are not resident "
+                f"and only {budget / MB:.0f} MB of the budget are left")
+            segments = []
+        elif budget is not None:
+            budget -= missing
+        planned.append((path, num_bytes, before, segments, skipped))
+
+    with futures.ThreadPoolExecutor(max_workers=num_threads) as pool:
+        reads = [
+            [pool.submit(_read_segment, path, offset, length)
+             for offset, length in segments]
+            for path, _, _, segments, _ in planned
+        ]
+        files = []
+        for (path, num_bytes, before, _, skipped), file_reads in zip(planned, reads):
+            bytes_read = sum(read.result() for read in file_reads)
+            files.append(FileWarmup(
+                path=path,
+                num_bytes=num_bytes,
+                resident_before=before,
+                resident_after=resident_bytes(path),
+                bytes_read=bytes_read,
+                skipped=skipped,
+            ))
+
+    report = WarmupReport(files, time.time() - t_0, max_bytes)
+    for f in report.files:
+        logging.info(
+            f"{f.path}: {f.num_bytes / MB:.0f} MB, resident "
+            f"{_percent(f.resident_before, f.num_bytes)} before and "
+            f"{_percent(f.resident_after, f.num_bytes)} after, "
+            f"{f.bytes_read / MB:.0f} MB read")
+    logging.info(
+        f"Warmed the page cache with {report.bytes_read / MB:.0f} MB in "
+        f"{report.seconds:.1f}s "
+        f"({report.bytes_read / MB / max(report.seconds, 1e-6):.0f} MB/s)")
+    return report
+
+
+def _percent(num_bytes: Optional[int], total_bytes: int) -> str:
+    if num_bytes is None:
+        return "unknown"
+    return f"{100 * num_bytes / max(total_bytes, 1):.0f}%"
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser(
+        description="Show (and optionally warm) the page-cache residency of "
+                    "database files.")
+    parser.add_argument("database_paths", type=str, nargs="+")
+    parser.add_argument("--warm", action="store_true")
+    parser.add_argument("--max_gb", type=float, default=None)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--buckets", type=int, default=40)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    if args.warm:
+        warm(args.database_paths,
+             max_bytes=(int(args.max_gb * 1024 ** 3)
+                        if args.max_gb is not None else None),
+             num_threads=args.threads)
+    for path in database_files(args.database_paths):
+        profile = residency_profile(path, args.buckets)
+        if profile is None:
+            print(f"{path}: residency unknown")
+            continue
+        bars = "".join(" .:-=+*#%@"[min(9, int(fraction * 10))] for fraction in profile)
+        print(f"{path} ({os.path.getsize(path) / MB:.0f} MB, "
+              f"{_percent(resident_bytes(path), os.path.getsize(path))} "
+              f"resident) |{bars}|")
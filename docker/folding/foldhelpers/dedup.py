@@ -0,0 +1,122 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Deduplication of identical targets within a job.
+
+Screening libraries often list the same sequences several times, under
+different names or in reruns. `group_targets` normalizes and hashes the
+sequences of each target, so that only the first of a group of identical
+targets is computed. Its outputs are then materialized in the output directory
+of every duplicate: `link_outputs` hard-links the files locally and
+`copy_outputs` copies the objects within S3, without downloading them.
+
+The order of the chains of a multimer target is kept in the hash, since it
+determines the chain IDs of the outputs.
+"""
+import hashlib
+import os
+import shutil
+from typing import Any, Dict, List, Sequence, Tuple
+
+from absl import logging
+
+# Prefixes of the timings.json entries that measure the work done for a
+# target (the relax entries of models, not relax_wait or relax_saved_estimate).
+WORK_TIMINGS_PREFIXES = (
+    "process_features_",
+    "predict_and_compile_",
+    "predict_benchmark_",
+    "relax_model_",
+)
+
+
+def normalize_sequence(sequence: str) -> str:
+    """Sequence in upper case, without whitespace or a trailing stop codon.
+
+    Also used by the features cache, so that targets that are identical here
+    share their cached features.
+    """
+    return "".join(sequence.split()).upper().rstrip("*")
+
+
+def target_digest(sequences: Sequence[str]) -> str:
+    """SHA-256 digest of the normalized chains of a target, in order."""
+    normalized = "\n".join(normalize_sequence(sequence) for sequence in sequences)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def group_targets(target_sequences: Sequence[Sequence[str]]) -> List[int]:
+    """Index of the first identical target of each target.
+
+    A target whose own index is returned is computed, the others are
+    duplicates of the target at the returned index.
+    """
+    first_index = {}
+    return [
+        first_index.setdefault(target_digest(sequences), i)
+        for i, sequences in enumerate(target_sequences)
+    ]
+
+
+def work_seconds(timings: Dict[str, Any]) -> float:
+    """Time spent computing a target, from its timings.json."""
+    return sum(
+        value for name, value in timings.items()
+        if name == "features" or name.startswith(WORK_TIMINGS_PREFIXES)
+    )
+
+
+def link_outputs(source_dir: str, dest_dir: str) -> Tuple[int, int]:
+    """Hard-link every file under source_dir into dest_dir.
+
+    Files are copied where they cannot be linked, e.g. across file systems.
+
+    Returns:
+        tuple: Number of files and bytes materialized.
+    """
+    num_files = num_bytes = 0
+    for dirpath, _, filenames in os.walk(source_dir):
+        target_dirpath = os.path.join(dest_dir, os.path.relpath(dirpath, source_dir))
+        os.makedirs(target_dirpath, exist_ok=True)
+        for name in filenames:
+            source_path = os.path.join(dirpath, name)
+            dest_path = os.path.join(target_dirpath, name)
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(source_path, dest_path)
+            except OSError:
+                shutil.copy2(source_path, dest_path)
+            num_files += 1
+            num_bytes += os.path.getsize(source_path)
+    return num_files, num_bytes
+
+
+def copy_outputs(client, bucket: str, source_prefix: str,
+                 dest_prefix: str) -> Tuple[int, int]:
+    """Copy every object under source_prefix to dest_prefix, within S3.
+
+    Args:
+        client (boto3 object): S3 client.
+        bucket (str): Bucket of both prefixes.
+        source_prefix (str): Output directory of the computed target.
+        dest_prefix (str): Output directory of the duplicate.
+
+    Returns:
+        tuple: Number of objects and bytes materialized.
+    """
+    source_prefix = source_prefix.rstrip("/") + "/"
+    dest_prefix = dest_prefix.rstrip("/") + "/"
+    num_files = num_bytes = 0
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=source_prefix):
+        for obj in page.get("Contents", []):
+            dest_key = dest_prefix + obj["Key"][len(source_prefix):]
+            # Managed copy, which uses multipart copies for large objects.
+            client.copy({"Bucket": bucket, "Key": obj["Key"]}, bucket, dest_key)
+            num_files += 1
+            num_bytes += obj["Size"]
+    if not num_files:
+        logging.warning(f"No outputs found under s3://{bucket}/{source_prefix}")
+    return num_files, num_bytes
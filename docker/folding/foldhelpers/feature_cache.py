@@ -0,0 +1,409 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Content-addressed cache of data pipeline results (MSAs and template hits).
+
+Entries are keyed by a hash of the normalized input sequences and of
+everything else that determines the features: the identity (size and mtime)
+of every database file, digests of the search tool binaries, and pipeline
+settings such as db_preset and max_template_date. An entry holds the feature
+dictionary (as a compressed .npz with a JSON sidecar, so reading an entry
+never unpickles data written by another job) and the raw MSA files, and lives
+in a shared directory (e.g. on FSx) or under an S3 prefix:
+
+    <root>/<key>/entry.json
+    <root>/<key>/features.npz
+    <root>/<key>/features.json
+    <root>/<key>/msas/...
+
+entry.json is written last, so entries without it are incomplete and ignored.
+"""
+from concurrent import futures
+import functools
+import glob
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence
+
+from absl import logging
+import botocore
+import numpy as np
+
+from foldhelpers import dedup
+from foldhelpers import features_store
+from foldhelpers import prefetch
+from foldhelpers import tracing
+
+CACHE_VERSION = 1
+ENTRY_FILE = "entry.json"
+FEATURES_FILE = "features.npz"
+MSAS_DIR = "msas"
+
+
+def file_identity(path: str) -> List[List[Any]]:
+    """Size and mtime of a database, given as a file, directory or file prefix.
+
+    Databases such as BFD and PDB70 are passed as a prefix of several files,
+    so every file that starts with `path` is included. Directories (e.g. the
+    mmCIF directory) are identified by their own mtime, not their contents.
+    """
+    if os.path.isdir(path):
+        return [[path, "dir", os.stat(path).st_mtime_ns]]
+    identity = []
+    for file_path in sorted(glob.glob(f"{glob.escape(path)}*")):
+        stat = os.stat(file_path)
+        identity.append([file_path, stat.st_size, stat.st_mtime_ns])
+    return identity
+
+
+@functools.lru_cache(maxsize=None)
+def binary_digest(path: str) -> str:
+    """SHA-256 of a tool binary, which changes with the tool version."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pipeline_context(database_paths: Mapping[str, Optional[str]],
+                     binary_paths: Mapping[str, Optional[str]],
+                     **settings) -> Dict[str, Any]:
+    """Everything besides the sequences that the features depend on.
+
+    Args:
+        database_paths (dict): Database (or mmCIF directory) paths by name.
+            Unused databases may be None.
+        binary_paths (dict): Tool binary paths by name.
+        settings: Other pipeline settings, e.g. db_preset and max_template_date.
+    """
+    return {
+        "cache_version": CACHE_VERSION,
+        "databases": {name: file_identity(path)
+                      for name, path in sorted(database_paths.items()) if path},
+        "tools": {name: binary_digest(path)
+                  for name, path in sorted(binary_paths.items()) if path},
+        "settings": settings,
+    }
+
+
+def cache_key(sequences: Sequence[str], context: Mapping[str, Any]) -> str:
+    payload = json.dumps(
+        {"sequences": [dedup.normalize_sequence(s) for s in sequences],
+         "context": context},
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CacheEntry(NamedTuple):
+    key: str
+    num_bytes: int
+    created: float
+    last_used: float
+
+
+def _dir_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, filenames in os.walk(path) for name in filenames
+    )
+
+
+class LocalCacheStore:
+    """Cache entries in a shared directory, e.g. on FSx for Lustre."""
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def fetch(self, key: str, local_dir: str) -> Optional[int]:
+        """Copy entry `key` to `local_dir`. Returns its size, or None on a miss."""
+        entry_dir = self._entry_dir(key)
+        if not os.path.exists(os.path.join(entry_dir, ENTRY_FILE)):
+            return None
+        shutil.copytree(entry_dir, local_dir, dirs_exist_ok=True)
+        return _dir_size(local_dir)
+
+    def store(self, key: str, local_dir: str, metadata: Mapping[str, Any]):
+        # Build the entry next to its final location and rename it into place,
+        # so concurrent jobs never see a partial entry.
+        tmp_dir = os.path.join(self.root, f".tmp-{key}-{uuid.uuid4().hex}")
+        shutil.copytree(local_dir, tmp_dir)
+        with open(os.path.join(tmp_dir, ENTRY_FILE), "w") as f:
+            json.dump(metadata, f, indent=4)
+        try:
+            os.rename(tmp_dir, self._entry_dir(key))
+        except OSError:
+            # Another job stored the same entry first.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def touch(self, key: str):
+        entry_path = os.path.join(self._entry_dir(key), ENTRY_FILE)
+        with open(entry_path) as f:
+            metadata = json.load(f)
+        metadata["last_used"] = time.time()
+        tmp_path = f"{entry_path}.{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            json.dump(metadata, f, indent=4)
+        os.replace(tmp_path, entry_path)
+
+    def entries(self) -> List[CacheEntry]:
+        entries = []
+        for key in os.listdir(self.root):
+            entry_path = os.path.join(self._entry_dir(key), ENTRY_FILE)
+            try:
+                with open(entry_path) as f:
+                    metadata = json.load(f)
+            except (FileNotFoundError, NotADirectoryError, json.JSONDecodeError):
+                continue
+            entries.append(CacheEntry(key, metadata["num_bytes"],
+                                      metadata["created"], metadata["last_used"]))
+        return entries
+
+    def delete(self, key: str):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+
+class S3CacheStore:
+    """Cache entries under an S3 prefix."""
+
+    def __init__(self, client, bucket: str, prefix: str):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _entry_prefix(self, key: str) -> str:
+        return f"{self.prefix}/{key}/" if self.prefix else f"{key}/"
+
+    def _list(self, prefix: str):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for result in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from result.get("Contents", [])
+
+    def _read_metadata(self, key: str) -> Dict[str, Any]:
+        response = self.client.get_object(
+            Bucket=self.bucket, Key=self._entry_prefix(key) + ENTRY_FILE)
+        return json.loads(response["Body"].read())
+
+    def fetch(self, key: str, local_dir: str) -> Optional[int]:
+        entry_prefix = self._entry_prefix(key)
+        objects = list(self._list(entry_prefix))
+        if not any(obj["Key"] == entry_prefix + ENTRY_FILE for obj in objects):
+            return None
+        for obj in objects:
+            prefetch.download_file(
+                self.client, self.bucket, obj["Key"],
+                os.path.join(local_dir, obj["Key"][len(entry_prefix):]))
+        return sum(obj["Size"] for obj in objects)
+
+    def store(self, key: str, local_dir: str, metadata: Mapping[str, Any]):
+        entry_prefix = self._entry_prefix(key)
+        for dirpath, _, filenames in os.walk(local_dir):
+            for name in filenames:
+                local_path = os.path.join(dirpath, name)
+                relative_path = os.path.relpath(local_path, local_dir)
+                self.client.upload_file(local_path, self.bucket,
+                                        entry_prefix + relative_path)
+        self.client.put_object(Bucket=self.bucket, Key=entry_prefix + ENTRY_FILE,
+                               Body=json.dumps(metadata, indent=4).encode())
+
+    def touch(self, key: str):
+        metadata = self._read_metadata(key)
+        metadata["last_used"] = time.time()
+        self.client.put_object(Bucket=self.bucket,
+                               Key=self._entry_prefix(key) + ENTRY_FILE,
+                               Body=json.dumps(metadata, indent=4).encode())
+
+    def entries(self, max_workers: int = 16) -> List[CacheEntry]:
+        # One level of the prefix, instead of every object of every entry.
+        root = f"{self.prefix}/" if self.prefix else ""
+        paginator = self.client.get_paginator("list_objects_v2")
+        keys = [
+            common_prefix["Prefix"][len(root):].rstrip("/")
+            for result in paginator.paginate(
+                Bucket=self.bucket, Prefix=root, Delimiter="/")
+            for common_prefix in result.get("CommonPrefixes", [])
+        ]
+
+        def read_entry(key):
+            try:
+                metadata = self._read_metadata(key)
+            except (botocore.exceptions.ClientError, json.JSONDecodeError):
+                # Incomplete, or deleted by another job since the listing.
+                return None
+            return CacheEntry(key, metadata["num_bytes"], metadata["created"],
+                              metadata["last_used"])
+
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            entries = list(executor.map(read_entry, keys))
+        return [entry for entry in entries if entry is not None]
+
+    def delete(self, key: str):
+        # Delete entry.json first, so the entry is never read half-deleted.
+        entry_prefix = self._entry_prefix(key)
+        self.client.delete_object(Bucket=self.bucket,
+                                  Key=entry_prefix + ENTRY_FILE)
+        for obj in self._list(entry_prefix):
+            self.client.delete_object(Bucket=self.bucket, Key=obj["Key"])
+
+
+def open_store(uri: str, client=None):
+    """A store for a local/FSx directory or an s3://bucket/prefix URI."""
+    if uri.startswith("s3://"):
+        bucket, _, prefix = uri[len("s3://"):].partition("/")
+        return S3CacheStore(client, bucket, prefix)
+    return LocalCacheStore(uri)
+
+
+def evict(store, max_bytes: Optional[int] = None,
+          ttl_seconds: Optional[float] = None) -> int:
+    """Delete expired entries, then least recently used ones above `max_bytes`.
+
+    Returns:
+        int: Number of deleted entries.
+    """
+    if max_bytes is None and ttl_seconds is None:
+        return 0
+    now = time.time()
+    entries = sorted(store.entries(), key=lambda entry: entry.last_used)
+    total_bytes = sum(entry.num_bytes for entry in entries)
+    num_deleted = 0
+    for entry in entries:
+        expired = ttl_seconds is not None and now - entry.created > ttl_seconds
+        over_size = max_bytes is not None and total_bytes > max_bytes
+        if not (expired or over_size):
+            continue
+        logging.info(f"Evicting {entry.key} from the features cache")
+        store.delete(entry.key)
+        total_bytes -= entry.num_bytes
+        num_deleted += 1
+    return num_deleted
+
+
+def fetch_entry(store, key: str, msa_output_dir: str):
+    """Load the features of entry `key` and copy its MSA files to `msa_output_dir`.
+
+    Returns:
+        tuple: (feature dict, size of the entry in bytes), or None on a miss.
+    """
+    with tempfile.TemporaryDirectory() as entry_dir:
+        num_bytes = store.fetch(key, entry_dir)
+        if num_bytes is None:
+            return None
+        feature_dict = features_store.load_features(
+            os.path.join(entry_dir, FEATURES_FILE), mmap=False)
+        msas_dir = os.path.join(entry_dir, MSAS_DIR)
+        if os.path.isdir(msas_dir):
+            shutil.copytree(msas_dir, msa_output_dir, dirs_exist_ok=True)
+    return feature_dict, num_bytes
+
+
+def store_entry(store, key: str, feature_dict: Mapping[str, Any],
+                msa_output_dir: str, msa_files: Optional[Sequence[str]] = None,
+                **metadata):
+    """Store `feature_dict` and the MSA files of `msa_output_dir` as entry `key`.
+
+    Args:
+        msa_files (list): Names of the files to store, relative to
+            `msa_output_dir`. The whole directory is stored if omitted.
+        metadata: Extra fields for entry.json.
+    """
+    with tempfile.TemporaryDirectory() as entry_dir:
+        features_store.save_features(
+            feature_dict, os.path.join(entry_dir, FEATURES_FILE),
+            "npz_compressed")
+        msas_dir = os.path.join(entry_dir, MSAS_DIR)
+        if msa_files is None:
+            shutil.copytree(msa_output_dir, msas_dir)
+        else:
+            os.makedirs(msas_dir)
+            for name in msa_files:
+                shutil.copy(os.path.join(msa_output_dir, name), msas_dir)
+        now = time.time()
+        store.store(key, entry_dir, {
+            "key": key,
+            "num_bytes": _dir_size(entry_dir),
+            "created": now,
+            "last_used": now,
+            **metadata,
+        })
+
+
+class CachedDataPipeline:
+    """Wraps a monomer or multimer data pipeline with a features cache.
+
+    Cache errors are logged and never fail the prediction: a failed lookup is
+    a miss and a failed store only loses the entry.
+
+    Args:
+        data_pipeline: `pipeline.DataPipeline` or `pipeline_multimer.DataPipeline`.
+        store: `LocalCacheStore` or `S3CacheStore`.
+        context (dict): Output of `pipeline_context`.
+    """
+
+    def __init__(self, data_pipeline, store, context: Mapping[str, Any]):
+        self.data_pipeline = data_pipeline
+        self.store = store
+        self.context = dict(context)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        # Cache statistics of the last call to process(), for timings.json.
+        self.last_timings = {}
+
+    def process(self, input_fasta_path: str, msa_output_dir: str):
+        from alphafold.data import parsers
+        with open(input_fasta_path) as f:
+            sequences, descriptions = parsers.parse_fasta(f.read())
+        key = cache_key(sequences, self.context)
+
+        try:
+            with tracing.span("feature_cache_fetch"):
+                cached = fetch_entry(self.store, key, msa_output_dir)
+        except Exception as err:
+            logging.warning(f"Features cache lookup of {key} failed: {err}")
+            cached = None
+        if cached is not None:
+            logging.info(f"Features cache hit for {input_fasta_path} ({key})")
+            feature_dict, num_bytes = cached
+            if "domain_name" in feature_dict and len(descriptions) == 1:
+                # The only feature that depends on the FASTA description.
+                feature_dict["domain_name"] = np.array(
+                    [descriptions[0].encode()], dtype=np.object_)
+            try:
+                self.store.touch(key)
+            except Exception as err:
+                logging.warning(f"Unable to update the last use of {key}: {err}")
+            self.hits += 1
+            self.bytes_saved += num_bytes
+            self.last_timings = {"feature_cache_hits": 1,
+                                 "feature_cache_misses": 0,
+                                 "feature_cache_bytes_saved": num_bytes}
+            return feature_dict
+
+        logging.info(f"Features cache miss for {input_fasta_path} ({key})")
+        feature_dict = self.data_pipeline.process(
+            input_fasta_path=input_fasta_path, msa_output_dir=msa_output_dir)
+        self.misses += 1
+        self.last_timings = {"feature_cache_hits": 0,
+                             "feature_cache_misses": 1,
+                             "feature_cache_bytes_saved": 0}
+        # Statistics of a wrapped pipeline, e.g. chain MSA reuse.
+        self.last_timings.update(getattr(self.data_pipeline, "last_timings", {}))
+        try:
+            with tracing.span("feature_cache_store"):
+                store_entry(self.store, key, feature_dict, msa_output_dir,
+                            num_sequences=len(sequences))
+        except Exception as err:
+            logging.warning(f"Unable to store {key} in the features cache: {err}")
+        return feature_dict
@@ -0,0 +1,97 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+CPU-only featurization of many targets in a pool of worker processes.
+
+Each worker builds its own data pipeline once and then featurizes one target
+at a time, so N targets run their MSA and template searches concurrently and
+a CPU instance stays busy while the targets are of uneven sizes. Workers upload
+the outputs of each target as soon as it is done.
+"""
+from concurrent import futures
+import multiprocessing
+import time
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+
+# Data pipeline of the current worker process, created by _init_worker.
+_data_pipeline = None
+
+
+def read_manifest(manifest_str: str) -> List[str]:
+    """FASTA paths listed in a manifest, one per line.
+
+    Blank lines and lines starting with "#" are ignored.
+    """
+    fasta_paths = []
+    for line in manifest_str.splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            fasta_paths.append(line)
+    return fasta_paths
+
+
+def _init_worker(create_pipeline: Callable[..., Any], create_args: Sequence[Any]):
+    global _data_pipeline
+    _data_pipeline = create_pipeline(*create_args)
+
+
+def _featurize(featurize: Callable[..., Any], target: Sequence[Any]) -> float:
+    t_0 = time.time()
+    featurize(_data_pipeline, *target)
+    return time.time() - t_0
+
+
+class FeatureWorkerPool:
+    """Featurizes targets in a pool of worker processes.
+
+    Workers are started with "spawn", like the relax workers, and call
+    `create_pipeline(*create_args)` once to build their data pipeline. Both must
+    be picklable, i.e. module-level functions and plain arguments.
+
+    Args:
+        create_pipeline (callable): Returns the data pipeline of a worker.
+        create_args (tuple): Arguments of `create_pipeline`.
+        num_workers (int): Number of targets featurized concurrently.
+    """
+
+    def __init__(self, create_pipeline: Callable[..., Any],
+                 create_args: Sequence[Any], num_workers: int):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+        self._pool = futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(create_pipeline, tuple(create_args)),
+        )
+
+    def run(
+        self,
+        featurize: Callable[..., Any],
+        targets: Sequence[Sequence[Any]],
+    ) -> Iterator[Tuple[Sequence[Any], float, Optional[BaseException]]]:
+        """Featurize every target, in the order in which they finish.
+
+        Args:
+            featurize (callable): Called in a worker as
+                `featurize(data_pipeline, *target)`. Should write and upload
+                the outputs of the target.
+            targets (list): Arguments of `featurize` for each target.
+
+        Yields:
+            tuple: The target, the time it took in seconds, and the exception
+                it raised (None if it succeeded).
+        """
+        pending = {
+            self._pool.submit(_featurize, featurize, tuple(target)): target
+            for target in targets
+        }
+        for future in futures.as_completed(pending):
+            try:
+                yield pending[future], future.result(), None
+            except Exception as err:
+                yield pending[future], 0.0, err
+
+    def close(self, cancel_pending: bool = False):
+        self._pool.shutdown(wait=True, cancel_futures=cancel_pending)
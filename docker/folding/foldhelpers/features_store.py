@@ -0,0 +1,233 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Memory-mapped storage for AlphaFold feature dictionaries.
+
+Besides the original pickle, features can be written as
+  * "npy": a directory with one raw .npy file per array, memory-mapped on load.
+  * "npz": a single uncompressed .npz file. Members are memory-mapped in place.
+  * "npz_compressed": a compressed .npz file, decompressed lazily per array.
+Arrays of Python objects (e.g. the byte-string sequence and domain names) and
+scalars cannot be memory-mapped and are kept in a small JSON sidecar, together
+with the dtype and shape of every array.
+
+Usage:
+    python -m foldhelpers.features_store features.pkl features --format npy
+"""
+import argparse
+import json
+import os
+import pickle
+import struct
+import zipfile
+from typing import Any, Dict, List, Mapping
+
+import numpy as np
+
+FORMATS = ("pkl", "npy", "npz", "npz_compressed")
+FORMAT_VERSION = 1
+METADATA_FILE = "metadata.json"
+# Size of the fixed part of a zip local file header.
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+def features_output_path(output_dir: str, fmt: str) -> str:
+    """Path of the features written to `output_dir` in format `fmt`."""
+    if fmt == "pkl":
+        return os.path.join(output_dir, "features.pkl")
+    elif fmt == "npy":
+        return os.path.join(output_dir, "features")
+    elif fmt in ("npz", "npz_compressed"):
+        return os.path.join(output_dir, "features.npz")
+    raise ValueError(f"Unknown features format {fmt}, expected one of {FORMATS}")
+
+
+def sidecar_path(path: str) -> str:
+    """Path of the JSON metadata for features stored at `path`."""
+    if path.endswith(".npz"):
+        return path[: -len(".npz")] + ".json"
+    return os.path.join(path, METADATA_FILE)
+
+
+def storage_paths(path: str) -> List[str]:
+    """Files that make up the features stored at `path`.
+
+    Directories are returned with a trailing separator.
+    """
+    if path.endswith(".pkl"):
+        return [path]
+    elif path.endswith(".npz"):
+        return [path, sidecar_path(path)]
+    return [os.path.join(path, "")]
+
+
+def _encode_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, np.ndarray):
+        flat = value.reshape(-1).tolist()
+        if all(isinstance(v, bytes) for v in flat):
+            return {
+                "kind": "bytes_array",
+                "shape": list(value.shape),
+                "values": [v.decode("latin-1") for v in flat],
+            }
+        return {"kind": "object_array", "shape": list(value.shape),
+                "values": flat}
+    if isinstance(value, np.generic):
+        return {"kind": "scalar", "dtype": value.dtype.str,
+                "values": value.item()}
+    return {"kind": "json", "values": value}
+
+
+def _decode_value(entry: Mapping[str, Any]) -> Any:
+    kind = entry["kind"]
+    if kind == "bytes_array":
+        values = [v.encode("latin-1") for v in entry["values"]]
+        return np.array(values, dtype=np.object_).reshape(entry["shape"])
+    if kind == "object_array":
+        return np.array(entry["values"], dtype=np.object_).reshape(entry["shape"])
+    if kind == "scalar":
+        return np.dtype(entry["dtype"]).type(entry["values"])
+    return entry["values"]
+
+
+def save_features(feature_dict: Mapping[str, Any], path: str, fmt: str) -> List[str]:
+    """Write `feature_dict` to `path` in format `fmt`.
+
+    Returns:
+        list: The files (or directories) that were written.
+    """
+    if fmt == "pkl":
+        with open(path, "wb") as f:
+            pickle.dump(feature_dict, f, protocol=4)
+        return [path]
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown features format {fmt}, expected one of {FORMATS}")
+
+    arrays = {}
+    metadata = {"format_version": FORMAT_VERSION, "format": fmt,
+                "arrays": {}, "values": {}}
+    for name, value in feature_dict.items():
+        if isinstance(value, np.ndarray) and value.dtype != np.object_:
+            arrays[name] = np.ascontiguousarray(value)
+            metadata["arrays"][name] = {"dtype": value.dtype.str,
+                                        "shape": list(value.shape)}
+        else:
+            metadata["values"][name] = _encode_value(value)
+
+    if fmt == "npy":
+        os.makedirs(path, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array, allow_pickle=False)
+    elif fmt == "npz":
+        np.savez(path, **arrays)
+    else:
+        np.savez_compressed(path, **arrays)
+
+    # The sidecar is written last, so a complete sidecar implies complete arrays.
+    with open(sidecar_path(path), "w") as f:
+        json.dump(metadata, f, indent=4)
+    return storage_paths(path)
+
+
+def load_npz(path: str, mmap: bool = True) -> Mapping[str, np.ndarray]:
+    """Load the arrays of an .npz file.
+
+    Members that are stored uncompressed are memory-mapped in place (read-only),
+    so no data is read until it is accessed. Compressed members are
+    decompressed lazily when first accessed.
+    """
+    if not mmap:
+        return np.load(path, allow_pickle=False)
+    arrays = {}
+    with open(path, "rb") as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return np.load(path, allow_pickle=False)
+            # Skip the local header, whose extra field may differ from the
+            # one in the central directory.
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + _ZIP_LOCAL_HEADER_SIZE
+                   + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                header = np.lib.format.read_array_header_2_0(f)
+            else:
+                return np.load(path, allow_pickle=False)
+            shape, fortran_order, dtype = header
+            name = info.filename[: -len(".npy")]
+            if 0 in shape:
+                arrays[name] = np.empty(shape, dtype=dtype)
+                continue
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def load_features(path: str, mmap: bool = True) -> Dict[str, Any]:
+    """Load features written by `save_features`, in any of the formats.
+
+    The format is inferred from the path: a .pkl file, a .npz file or a
+    directory of .npy files.
+    """
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    with open(sidecar_path(path)) as f:
+        metadata = json.load(f)
+    if metadata["format_version"] > FORMAT_VERSION:
+        raise ValueError(
+            f"{path} was written with features format version "
+            f"{metadata['format_version']}, which is newer than the supported "
+            f"version {FORMAT_VERSION}."
+        )
+
+    feature_dict = {}
+    if path.endswith(".npz"):
+        archive = load_npz(path, mmap=mmap)
+        for name in metadata["arrays"]:
+            feature_dict[name] = archive[name]
+    else:
+        for name in metadata["arrays"]:
+            feature_dict[name] = np.load(
+                os.path.join(path, f"{name}.npy"),
+                mmap_mode="r" if mmap else None,
+                allow_pickle=False,
+            )
+    for name, entry in metadata["values"].items():
+        feature_dict[name] = _decode_value(entry)
+    return feature_dict
+
+
+def convert(input_path: str, output_path: str, fmt: str) -> List[str]:
+    """Convert stored features (e.g. an existing features.pkl) to `fmt`."""
+    return save_features(load_features(input_path, mmap=False), output_path, fmt)
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser(
+        description="Convert AlphaFold features between storage formats.")
+    parser.add_argument("input_path", type=str)
+    parser.add_argument("output_path", type=str)
+    parser.add_argument("--format", type=str, default="npy", choices=FORMATS)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    for written_path in convert(args.input_path, args.output_path, args.format):
+        print(f"Wrote {written_path}")
@@ -0,0 +1,143 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Persistent XLA compilation cache, shared between jobs through a directory on FSx.
+
+JAX writes each compiled executable to a file of the cache directory, and
+later jobs load it instead of compiling the model again. This needs a JAX
+with a persistent compilation cache: the jax_compilation_cache_dir option, or
+jax.experimental.compilation_cache.initialize_cache in the releases before it.
+With the JAX that the image pins (0.2.14), which has neither, `enable_cache`
+logs a warning and returns False, and jobs compile as before.
+
+Where JAX caps the size of the cache itself (jax_compilation_cache_max_size),
+the cap is passed to it. Otherwise `evict` removes the least recently used
+files when the cache is enabled, until it fits the cap.
+
+Whether a predict loaded or compiled its executable is counted from the cache
+hit and miss events of jax.monitoring, which only see this process, so other
+jobs that write to the cache at the same time do not change the count.
+"""
+import os
+import threading
+from typing import Optional, Tuple
+
+from absl import logging
+
+
+def jax_version() -> str:
+    import jax
+    return jax.__version__
+
+
+def enable_cache(cache_dir: str, max_bytes: Optional[int] = None) -> bool:
+    """Point JAX's persistent compilation cache at `cache_dir`.
+
+    Args:
+        cache_dir (str): Shared, writable directory (e.g. on FSx for Lustre).
+        max_bytes (int): Cap on the size of the cache.
+
+    Returns:
+        bool: False if the installed JAX has no persistent compilation cache.
+    """
+    import jax
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        if hasattr(jax.config, "jax_compilation_cache_dir"):
+            jax.config.update("jax_compilation_cache_dir", cache_dir)
+        else:
+            from jax.experimental.compilation_cache import compilation_cache
+            compilation_cache.initialize_cache(cache_dir)
+    except (ImportError, AttributeError, AssertionError) as err:
+        logging.warning(
+            f"JAX {jax_version()} has no persistent compilation cache, models "
+            f"will be compiled in every job: {err}")
+        return False
+    if max_bytes is not None:
+        if hasattr(jax.config, "jax_compilation_cache_max_size"):
+            jax.config.update("jax_compilation_cache_max_size", max_bytes)
+        else:
+            evict(cache_dir, max_bytes)
+    return True
+
+
+def evict(cache_dir: str, max_bytes: int) -> int:
+    """Remove the least recently used files until the cache fits `max_bytes`.
+
+    Files that another job removes or is still writing are skipped.
+
+    Returns:
+        int: Number of bytes removed.
+    """
+    files = []
+    for entry in os.scandir(cache_dir):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        if entry.is_file():
+            files.append((max(stat.st_atime, stat.st_mtime), stat.st_size,
+                          entry.path))
+    total_bytes = sum(size for _, size, _ in files)
+    removed_bytes = 0
+    for _, size, path in sorted(files):
+        if total_bytes - removed_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed_bytes += size
+    if removed_bytes:
+        logging.info(f"Evicted {removed_bytes / 1024 ** 3:.1f} GB of compiled "
+                     f"models from {cache_dir}")
+    return removed_bytes
+
+
+class CacheEvents:
+    """Persistent cache hits and misses of this process, from jax.monitoring.
+
+    Usage:
+        events = CacheEvents()
+        before = events.counts()
+        model_runner.predict(...)
+        loaded = events.loaded_since(before)
+    """
+
+    _EVENTS = {
+        "/jax/compilation_cache/cache_hits": "hits",
+        "/jax/compilation_cache/cache_misses": "misses",
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0}
+        try:
+            from jax import monitoring
+            monitoring.register_event_listener(self._on_event)
+            self.available = True
+        except (ImportError, AttributeError):
+            self.available = False
+
+    def _on_event(self, event: str, **kwargs):
+        name = self._EVENTS.get(event)
+        if name is not None:
+            with self._lock:
+                self._counts[name] += 1
+
+    def counts(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._counts["hits"], self._counts["misses"]
+
+    def loaded_since(self, before: Tuple[int, int]) -> Optional[bool]:
+        """Whether the compilations since `before` were all loaded from the
+        cache, or None if unknown."""
+        if not self.available:
+            return None
+        hits, misses = self.counts()
+        if hits == before[0] and misses == before[1]:
+            # Nothing was compiled, e.g. the executable was in memory.
+            return None
+        return misses == before[1]
+
@@ -0,0 +1,74 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Model runners that load their parameters on first use, from a memory-mapped .npz.
+"""
+import os
+import time
+from typing import Optional
+
+from absl import logging
+from alphafold.model import model
+from alphafold.model import utils
+
+from foldhelpers import features_store
+
+
+def params_path(data_dir: str, model_name: str) -> str:
+    """Path of the parameters of `model_name`, as in `data.get_model_haiku_params`."""
+    return os.path.join(data_dir, "params", f"params_{model_name}.npz")
+
+
+class LazyRunModel(model.RunModel):
+    """`RunModel` whose parameters are loaded by the first predict.
+
+    `data.get_model_haiku_params` reads the whole .npz file into memory before
+    decoding it. Here the file is memory-mapped instead, so the host only holds
+    the pages that are being copied to the device.
+
+    Args:
+        config (ml_collections.ConfigDict): Model config.
+        model_name (str): Name of the model, e.g. "model_1_multimer_v2".
+        data_dir (str): Directory that holds params/params_<model_name>.npz.
+    """
+
+    def __init__(self, config, model_name: str, data_dir: str):
+        super().__init__(config, params=None)
+        self.model_name = model_name
+        self.path = params_path(data_dir, model_name)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Model parameters not found: {self.path}")
+        # Seconds spent by the last load(), None until the parameters are loaded.
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.params is not None
+
+    def load(self) -> float:
+        """Load the parameters, if they are not loaded yet.
+
+        Returns:
+            float: Seconds spent loading (0 if they were already loaded).
+        """
+        if self.loaded:
+            return 0.0
+        t_0 = time.time()
+        flat_params = features_store.load_npz(self.path, mmap=True)
+        self.params = utils.flat_params_to_haiku(flat_params)
+        self.load_seconds = time.time() - t_0
+        logging.info(
+            f"Loaded parameters of {self.model_name} in {self.load_seconds:.1f}s"
+        )
+        return self.load_seconds
+
+    def release(self):
+        """Free the parameters. They are loaded again if the model is reused."""
+        if self.loaded:
+            logging.info(f"Releasing parameters of {self.model_name}")
+        self.params = None
+
+    def init_params(self, feat, random_seed: int = 0):
+        # RunModel initializes missing parameters randomly; load them instead.
+        self.load()
@@ -0,0 +1,340 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Concurrent MSA and template searches for the monomer data pipeline.
+
+`pipeline.DataPipeline.process` runs jackhmmer on UniRef90, jackhmmer on
+MGnify, hhblits on BFD/Uniclust30 (or jackhmmer on small BFD) and the template
+search one after the other, each with the thread count AlphaFold hard-codes.
+Only the template search depends on another search (it takes the UniRef90
+MSA as input), so here the three database searches start together and the
+template search starts as soon as the UniRef90 search ends. The vCPUs given
+to the container are split between the database searches in proportion to
+AlphaFold's default thread counts, and the template search takes over the
+vCPUs of the UniRef90 search.
+
+The tools are subprocesses, so each search runs on a thread of the pipeline.
+The runners of each search start their tool through a `tool_timer` wrapper,
+which gives the CPU time of the search.
+"""
+from concurrent import futures
+import copy
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from absl import logging
+from alphafold.data import parsers
+from alphafold.data import pipeline
+from alphafold.data.tools import hmmsearch
+
+from foldhelpers import tool_timer
+from foldhelpers import tracing
+
+
+def available_cpus() -> int:
+    """vCPUs available to this container.
+
+    Uses the CFS quota of the cgroup (v2 or v1) when there is one, else the
+    CPUs this process may run on.
+    """
+    quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            max_str, period_str = f.read().split()
+        if max_str != "max":
+            quota = int(max_str) / int(period_str)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota_us = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period_us = int(f.read())
+            if quota_us > 0:
+                quota = quota_us / period_us
+        except (OSError, ValueError):
+            pass
+    num_cpus = len(os.sched_getaffinity(0))
+    if quota is not None:
+        num_cpus = min(num_cpus, max(1, int(quota)))
+    return num_cpus
+
+
+def split_cpus(num_cpus: int, weights: Mapping[str, float]) -> Dict[str, int]:
+    """Split `num_cpus` in proportion to `weights`, with at least 1 each.
+
+    Uses the largest remainder method, so the counts add up to `num_cpus`
+    whenever it is at least the number of weights.
+    """
+    total_weight = sum(weights.values())
+    shares = {
+        name: max(num_cpus - len(weights), 0) * weight / total_weight
+        for name, weight in weights.items()
+    }
+    counts = {name: 1 + int(share) for name, share in shares.items()}
+    remaining = num_cpus - sum(counts.values())
+    for name in sorted(shares, key=lambda name: int(shares[name]) - shares[name]):
+        if remaining <= 0:
+            break
+        counts[name] += 1
+        remaining -= 1
+    return counts
+
+
+def _timed_runner(runner, usage_path: str):
+    """Copy of a tool runner whose tool records its CPU time in `usage_path`.
+
+    The Hmmbuild runner of Hmmsearch records to the same file.
+    """
+    runner = copy.copy(runner)
+    runner.binary_path = tool_timer.wrap(runner.binary_path, usage_path)
+    if hasattr(runner, "hmmbuild_runner"):
+        runner.hmmbuild_runner = _timed_runner(runner.hmmbuild_runner,
+                                               usage_path)
+    return runner
+
+
+def _run_search(search: Callable[..., Any], usage_path: str,
+                *args) -> Tuple[Any, float, float, float]:
+    """Run one search, whose runner is a `_timed_runner`.
+
+    Returns:
+        tuple: The search result, its start time, its wall time and the CPU
+            time (user and system) of the tool processes, in seconds.
+    """
+    t_0 = time.time()
+    result = search(*args)
+    return (result, t_0, time.time() - t_0,
+            tool_timer.read_cpu_time(usage_path))
+
+
+class ConcurrentDataPipeline(pipeline.DataPipeline):
+    """Monomer data pipeline that runs the independent searches concurrently.
+
+    Produces the same features and MSA files as `pipeline.DataPipeline`.
+
+    Args:
+        num_cpus (int): vCPUs to split between the searches. Defaults to
+            `available_cpus()`.
+        kwargs: Arguments of `pipeline.DataPipeline`.
+    """
+
+    def __init__(self, num_cpus: Optional[int] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.num_cpus = num_cpus or available_cpus()
+        # Wall and CPU time of each search of the last call to process(),
+        # for timings.json.
+        self.last_timings = {}
+
+    def _msa_searches(self):
+        """Name, runner, output file name and format of each MSA search."""
+        searches = [
+            ("uniref90", self.jackhmmer_uniref90_runner, "uniref90_hits.sto",
+             "sto", self.uniref_max_hits),
+            ("mgnify", self.jackhmmer_mgnify_runner, "mgnify_hits.sto",
+             "sto", self.mgnify_max_hits),
+        ]
+        if self._use_small_bfd:
+            searches.append(("small_bfd", self.jackhmmer_small_bfd_runner,
+                             "small_bfd_hits.sto", "sto", None))
+        else:
+            searches.append(("bfd_uniclust", self.hhblits_bfd_uniclust_runner,
+                             "bfd_uniclust_hits.a3m", "a3m", None))
+        return searches
+
+    def _submit_search(self, pool, usage_dir, name, runner, input_fasta_path,
+                       msa_out_path, msa_format, max_sto_sequences, num_cpus):
+        """Start one search, or return None if its MSA is precomputed."""
+        if self.use_precomputed_msas and os.path.exists(msa_out_path):
+            return None
+        usage_path = os.path.join(usage_dir, f"{name}.cpu")
+        runner = _timed_runner(runner, usage_path)
+        runner.n_cpu = num_cpus
+        logging.info(f"Starting the {name} search with {num_cpus} CPUs")
+        if msa_format == "sto" and max_sto_sequences is not None:
+            return pool.submit(_run_search, runner.query, usage_path,
+                               input_fasta_path, max_sto_sequences)
+        return pool.submit(_run_search, runner.query, usage_path,
+                           input_fasta_path)
+
+    def _search_result(self, name, future, msa_out_path, msa_format,
+                       max_sto_sequences) -> Mapping[str, Any]:
+        """Wait for a search and write its MSA, like `pipeline.run_msa_tool`."""
+        if future is None:
+            return pipeline.run_msa_tool(
+                msa_runner=None,
+                input_fasta_path=None,
+                msa_out_path=msa_out_path,
+                msa_format=msa_format,
+                use_precomputed_msas=True,
+                max_sto_sequences=max_sto_sequences)
+        results, start, wall_time, cpu_time = future.result()
+        self.last_timings[f"{name}_search_wall"] = wall_time
+        self.last_timings[f"{name}_search_cpu"] = cpu_time
+        tracing.record("msa_search", start, start + wall_time,
+                       database=name, cpu_sec=cpu_time)
+        logging.info(f"The {name} search took {wall_time:.1f}s "
+                     f"({cpu_time:.1f}s of CPU time)")
+        result = results[0]
+        with open(msa_out_path, "w") as f:
+            f.write(result[msa_format])
+        return result
+
+    def process(self, input_fasta_path: str,
+                msa_output_dir: str) -> pipeline.FeatureDict:
+        """Runs the alignment tools and creates the input features."""
+        self.last_timings = {}
+        with open(input_fasta_path) as f:
+            input_fasta_str = f.read()
+        input_seqs, input_descs = parsers.parse_fasta(input_fasta_str)
+        if len(input_seqs) != 1:
+            raise ValueError(
+                f"More than one input sequence found in {input_fasta_path}.")
+        input_sequence = input_seqs[0]
+        input_description = input_descs[0]
+        num_res = len(input_sequence)
+
+        searches = self._msa_searches()
+        num_cpus = split_cpus(
+            self.num_cpus,
+            {name: runner.n_cpu for name, runner, _, _, _ in searches})
+        with tempfile.TemporaryDirectory(
+            prefix="msa_search_",
+        ) as usage_dir, futures.ThreadPoolExecutor(
+            max_workers=len(searches), thread_name_prefix="msa-search",
+        ) as pool:
+            pending = {}
+            for name, runner, file_name, msa_format, max_sto_sequences in searches:
+                msa_out_path = os.path.join(msa_output_dir, file_name)
+                future = self._submit_search(
+                    pool, usage_dir, name, runner, input_fasta_path,
+                    msa_out_path, msa_format, max_sto_sequences, num_cpus[name])
+                pending[name] = (future, msa_out_path, msa_format,
+                                 max_sto_sequences)
+
+            # The template search needs the UniRef90 MSA and runs while the
+            # other searches finish.
+            jackhmmer_uniref90_result = self._search_result(
+                "uniref90", *pending.pop("uniref90"))
+            msa_for_templates = jackhmmer_uniref90_result["sto"]
+            msa_for_templates = parsers.deduplicate_stockholm_msa(
+                msa_for_templates)
+            msa_for_templates = parsers.remove_empty_columns_from_stockholm_msa(
+                msa_for_templates)
+            if self.template_searcher.input_format == "sto":
+                template_query = msa_for_templates
+            elif self.template_searcher.input_format == "a3m":
+                template_query = parsers.convert_stockholm_to_a3m(
+                    msa_for_templates)
+            else:
+                raise ValueError("Unrecognized template input format: "
+                                 f"{self.template_searcher.input_format}")
+            # hhsearch (monomer models) has no thread option in AlphaFold and
+            # runs with its default of 2.
+            templates_usage_path = os.path.join(usage_dir, "templates.cpu")
+            template_searcher = _timed_runner(self.template_searcher,
+                                              templates_usage_path)
+            if isinstance(template_searcher, hmmsearch.Hmmsearch):
+                # hmmsearch is run with --cpu 8, the last --cpu flag wins.
+                template_searcher.flags = list(template_searcher.flags or []) + [
+                    "--cpu", str(num_cpus["uniref90"])]
+                logging.info(f"Starting the template search with "
+                             f"{num_cpus['uniref90']} CPUs")
+            templates_future = pool.submit(
+                _run_search, template_searcher.query, templates_usage_path,
+                template_query)
+
+            msa_results = {
+                name: self._search_result(name, *search)
+                for name, search in pending.items()
+            }
+            pdb_templates_result, start, wall_time, cpu_time = (
+                templates_future.result())
+            self.last_timings["pdb_templates_search_wall"] = wall_time
+            self.last_timings["pdb_templates_search_cpu"] = cpu_time
+            tracing.record("template_search", start, start + wall_time,
+                           cpu_sec=cpu_time)
+
+        pdb_hits_out_path = os.path.join(
+            msa_output_dir, f"pdb_hits.{self.template_searcher.output_format}")
+        with open(pdb_hits_out_path, "w") as f:
+            f.write(pdb_templates_result)
+
+        uniref90_msa = parsers.parse_stockholm(jackhmmer_uniref90_result["sto"])
+        uniref90_msa = uniref90_msa.truncate(max_seqs=self.uniref_max_hits)
+        mgnify_msa = parsers.parse_stockholm(msa_results["mgnify"]["sto"])
+        mgnify_msa = mgnify_msa.truncate(max_seqs=self.mgnify_max_hits)
+        if self._use_small_bfd:
+            bfd_msa = parsers.parse_stockholm(msa_results["small_bfd"]["sto"])
+        else:
+            bfd_msa = parsers.parse_a3m(msa_results["bfd_uniclust"]["a3m"])
+
+        pdb_template_hits = self.template_searcher.get_template_hits(
+            output_string=pdb_templates_result, input_sequence=input_sequence)
+        templates_result = self.template_featurizer.get_templates(
+            query_sequence=input_sequence,
+            hits=pdb_template_hits)
+
+        sequence_features = pipeline.make_sequence_features(
+            sequence=input_sequence,
+            description=input_description,
+            num_res=num_res)
+        msa_features = pipeline.make_msa_features(
+            (uniref90_msa, bfd_msa, mgnify_msa))
+
+        logging.info("Uniref90 MSA size: %d sequences.", len(uniref90_msa))
+        logging.info("BFD MSA size: %d sequences.", len(bfd_msa))
+        logging.info("MGnify MSA size: %d sequences.", len(mgnify_msa))
+        logging.info("Final (deduplicated) MSA size: %d sequences.",
+                     msa_features["num_alignments"][0])
+        logging.info("Total number of templates (NOTE: limited by "
+                     "max_templates): %d.",
+                     templates_result.features["template_domain_names"].shape[0])
+
+        return {**sequence_features, **msa_features, **templates_result.features}
+
+
+# Tool runners of the monomer and multimer pipelines, and the database they
+# search.
+_SEARCH_RUNNERS = (
+    ("jackhmmer_uniref90_runner", "uniref90"),
+    ("jackhmmer_mgnify_runner", "mgnify"),
+    ("jackhmmer_small_bfd_runner", "small_bfd"),
+    ("hhblits_bfd_uniclust_runner", "bfd_uniclust"),
+    ("_uniprot_msa_runner", "uniprot"),
+)
+
+
+def trace_data_pipeline(data_pipeline, searches: bool = True):
+    """Trace the searches and template featurization of a data pipeline.
+
+    Replaces the tool runners with `tracing.TracedMethod` proxies, which
+    open spans under the active span of the target.
+
+    Args:
+        data_pipeline: `pipeline.DataPipeline` or
+            `pipeline_multimer.DataPipeline` (whose monomer pipeline is
+            traced too).
+        searches (bool): Whether to trace the MSA and template searches.
+            `ConcurrentDataPipeline` records its searches itself, and copies
+            its runners, so they must not be proxied.
+    """
+    pipelines = [data_pipeline]
+    if hasattr(data_pipeline, "_monomer_data_pipeline"):
+        pipelines.append(data_pipeline._monomer_data_pipeline)
+    for pipeline_ in pipelines:
+        if searches:
+            for attr, database in _SEARCH_RUNNERS:
+                if hasattr(pipeline_, attr):
+                    setattr(pipeline_, attr, tracing.TracedMethod(
+                        getattr(pipeline_, attr), "query", "msa_search",
+                        database=database))
+            if hasattr(pipeline_, "template_searcher"):
+                pipeline_.template_searcher = tracing.TracedMethod(
+                    pipeline_.template_searcher, "query", "template_search")
+        if hasattr(pipeline_, "template_featurizer"):
+            pipeline_.template_featurizer = tracing.TracedMethod(
+                pipeline_.template_featurizer, "get_templates",
+                "template_featurization")
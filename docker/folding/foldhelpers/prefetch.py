@@ -0,0 +1,234 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Asynchronous download of per-target inputs (FASTA, features, timings) from S3.
+"""
+from concurrent import futures
+import os
+import shutil
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+from absl import logging
+import botocore
+
+
+class InputFile(NamedTuple):
+    # Keys that end with "/" are prefixes, downloaded to the local directory.
+    s3_key: str
+    local_path: str
+    # Optional files (e.g. the timings.json of a data prep job) only log a
+    # warning when they are missing.
+    required: bool = True
+    # Files that the target updates and writes as outputs (e.g. timings.json)
+    # are kept when the target is released, other inputs are deleted.
+    keep: bool = False
+
+
+class PrefetchTarget(NamedTuple):
+    name: str
+    files: List[InputFile]
+
+
+class PrefetchError(Exception):
+    """Raised when a required input of a target could not be downloaded."""
+
+    def __init__(self, target: str, s3_key: str, cause: BaseException):
+        super().__init__(f"Unable to download the inputs of {target}: "
+                         f"s3 key {s3_key}: {cause}")
+        self.target = target
+        self.s3_key = s3_key
+        self.cause = cause
+
+
+def download_file(client, bucket: str, s3_key: str, local_path: str):
+    """Download an object to a temporary name, then move it into place."""
+    local_dir = os.path.dirname(local_path)
+    if local_dir and not os.path.exists(local_dir):
+        logging.info(f"Creating directory {local_dir}")
+        os.makedirs(local_dir, exist_ok=True)
+    tmp_path = f"{local_path}.download"
+    client.download_file(bucket, s3_key, tmp_path)
+    os.replace(tmp_path, local_path)
+
+
+class TargetPrefetcher:
+    """Downloads the inputs of upcoming targets while the current one runs.
+
+    Up to `lookahead` targets past the one being processed are downloaded by
+    background threads. The inputs of a target are deleted when the caller
+    releases it, so `max_disk_bytes` caps the local disk used by prefetched
+    inputs; the next target to be processed is always fetched, even if it
+    alone exceeds the cap.
+
+    Usage:
+        with TargetPrefetcher(s3, bucket, targets, lookahead=2) as prefetcher:
+            for i, target in enumerate(targets):
+                prefetcher.wait(i)  # raises PrefetchError
+                ...
+                prefetcher.release(i)
+
+    Args:
+        client (boto3 object): S3 client.
+        bucket (str): Bucket that holds the inputs.
+        targets (list): PrefetchTarget for each target, in processing order.
+        lookahead (int): Number of targets to download ahead of the current one.
+        max_disk_bytes (int): Optional cap on the local disk used by the
+            inputs of the targets that are not released yet.
+    """
+
+    def __init__(self, client, bucket: str, targets: Sequence[PrefetchTarget],
+                 lookahead: int = 1, max_disk_bytes: Optional[int] = None):
+        if lookahead < 0:
+            raise ValueError("lookahead must not be negative.")
+        self.client = client
+        self.bucket = bucket
+        self.targets = list(targets)
+        self.lookahead = lookahead
+        self.max_disk_bytes = max_disk_bytes
+        self._pool = futures.ThreadPoolExecutor(
+            max_workers=max(1, lookahead), thread_name_prefix="s3-prefetch")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._sizes = {}
+        self._next_index = 0
+        self._current_index = 0
+
+    def __enter__(self):
+        self._schedule()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._pool.shutdown(wait=True)
+
+    def _list_prefix(self, prefix: str):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for result in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from result.get("Contents", [])
+
+    def _object_size(self, s3_key: str) -> int:
+        if s3_key.endswith("/"):
+            return sum(obj["Size"] for obj in self._list_prefix(s3_key))
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket, Key=s3_key)["ContentLength"]
+        except botocore.exceptions.ClientError:
+            # Missing objects are reported when the download fails.
+            return 0
+
+    def _download(self, s3_key: str, local_path: str):
+        if not s3_key.endswith("/"):
+            download_file(self.client, self.bucket, s3_key, local_path)
+            return
+        objects = list(self._list_prefix(s3_key))
+        if not objects:
+            raise FileNotFoundError(f"No objects found under prefix {s3_key}")
+        for obj in objects:
+            relative_path = obj["Key"][len(s3_key):]
+            download_file(self.client, self.bucket, obj["Key"],
+                          os.path.join(local_path, relative_path))
+
+    def _bytes_in_use(self) -> int:
+        return sum(self._sizes[i] for i in self._futures)
+
+    def _schedule(self):
+        """Start downloads up to the lookahead depth, within the disk cap."""
+        while True:
+            with self._lock:
+                index = self._next_index
+                if (index >= len(self.targets)
+                        or index > self._current_index + self.lookahead):
+                    return
+                size = self._sizes.get(index)
+            if size is None:
+                # Sized without the lock, the HEAD requests are not needed
+                # without a cap.
+                size = 0
+                if self.max_disk_bytes is not None:
+                    size = sum(self._object_size(f.s3_key)
+                               for f in self.targets[index].files)
+            with self._lock:
+                self._sizes[index] = size
+                if self._next_index != index:
+                    continue
+                if (self.max_disk_bytes is not None
+                        and index > self._current_index
+                        and self._bytes_in_use() + size > self.max_disk_bytes):
+                    logging.info(
+                        f"Deferring prefetch of {self.targets[index].name}: "
+                        f"disk cap of {self.max_disk_bytes} bytes reached"
+                    )
+                    return
+                self._futures[index] = self._pool.submit(
+                    self._download_target, self.targets[index])
+                self._next_index += 1
+
+    def _download_target(self, target: PrefetchTarget) -> float:
+        t_0 = time.time()
+        for input_file in target.files:
+            logging.info(
+                f"Downloading s3://{self.bucket}/{input_file.s3_key} "
+                f"to {input_file.local_path}"
+            )
+            try:
+                self._download(input_file.s3_key, input_file.local_path)
+            except Exception as err:
+                if input_file.required:
+                    raise PrefetchError(target.name, input_file.s3_key, err) from err
+                logging.warning(
+                    f"Optional input s3://{self.bucket}/{input_file.s3_key} of "
+                    f"{target.name} was not downloaded: {err}"
+                )
+        return time.time() - t_0
+
+    def wait(self, index: int) -> float:
+        """Block until the inputs of target `index` are on disk.
+
+        Returns:
+            float: Seconds spent waiting for the download.
+        """
+        with self._lock:
+            self._current_index = index
+        self._schedule()
+        t_0 = time.time()
+        try:
+            self._futures[index].result()
+        except PrefetchError:
+            self.release(index)
+            raise
+        t_wait = time.time() - t_0
+        logging.info(
+            f"Inputs of {self.targets[index].name} ready after waiting {t_wait:.1f}s"
+        )
+        return t_wait
+
+    def release(self, index: int):
+        """Delete the inputs of target `index`, freeing disk budget."""
+        with self._lock:
+            future = self._futures.pop(index, None)
+        if future is not None:
+            # Wait for a download that is still running, e.g. after a failed
+            # input, so that none of its files are left behind.
+            futures.wait([future])
+            for input_file in self.targets[index].files:
+                if not input_file.keep:
+                    _remove(input_file.local_path)
+        self._schedule()
+
+
+def _remove(local_path: str):
+    """Delete a downloaded file or directory, and any partial download."""
+    if os.path.isdir(local_path):
+        shutil.rmtree(local_path, ignore_errors=True)
+    for path in (local_path, f"{local_path}.download"):
+        try:
+            os.remove(path)
+        except (FileNotFoundError, IsADirectoryError):
+            pass
@@ -0,0 +1,90 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Amber relaxation in worker processes, concurrent with model inference.
+"""
+from concurrent import futures
+import multiprocessing
+import time
+from typing import Any, List, Mapping, Optional, Tuple
+
+# Relaxer of the current worker process, created by _init_worker.
+_relaxer = None
+
+
+def _init_worker(relax_kwargs: Mapping[str, Any]):
+    global _relaxer
+    from alphafold.relax import relax
+    _relaxer = relax.AmberRelaxation(**relax_kwargs)
+
+
+def _relax(prot) -> Tuple[str, float]:
+    t_0 = time.time()
+    relaxed_pdb_str, _, _ = _relaxer.process(prot=prot)
+    return relaxed_pdb_str, time.time() - t_0
+
+
+class RelaxPool:
+    """Runs `AmberRelaxation.process` in a pool of worker processes.
+
+    Workers are started with "spawn" rather than "fork", so they do not inherit
+    the JAX/CUDA state of the process that runs the models.
+
+    Args:
+        relax_kwargs (dict): Keyword arguments of `relax.AmberRelaxation`.
+        num_workers (int): Number of worker processes.
+    """
+
+    def __init__(self, relax_kwargs: Mapping[str, Any], num_workers: int):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+        self._pool = futures.ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(dict(relax_kwargs),),
+        )
+
+    def submit(self, prot) -> futures.Future:
+        """Queue an unrelaxed protein.
+
+        Returns:
+            Future: Resolves to (relaxed PDB string, relax time in seconds), as
+                measured in the worker.
+        """
+        return self._pool.submit(_relax, prot)
+
+    def close(self, cancel_pending: bool = False):
+        self._pool.shutdown(wait=True, cancel_futures=cancel_pending)
+
+
+def parse_relax_mode(relax_mode: str) -> Optional[int]:
+    """Number of top-ranked models to relax for a --relax_mode value.
+
+    Returns:
+        None for "all", 1 for "best" and N for "top_k=N".
+    """
+    if relax_mode == "all":
+        return None
+    if relax_mode == "best":
+        return 1
+    if relax_mode.startswith("top_k="):
+        try:
+            top_k = int(relax_mode[len("top_k="):])
+        except ValueError:
+            top_k = 0
+        if top_k > 0:
+            return top_k
+    raise ValueError(
+        f'Invalid relax mode "{relax_mode}". Expected "all", "best" or '
+        '"top_k=N" with N > 0.'
+    )
+
+
+def select_models_to_relax(ranking_confidences: Mapping[str, float],
+                           top_k: Optional[int]) -> List[str]:
+    """Names of the `top_k` models with the highest ranking confidence."""
+    ranked = sorted(ranking_confidences, key=ranking_confidences.get,
+                    reverse=True)
+    return ranked if top_k is None else ranked[:top_k]
@@ -0,0 +1,238 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Background sampling of the resources used by a job.
+
+A `ResourceSampler` thread records, at a fixed interval, the CPU utilization,
+memory, open files and disk I/O of the job's process and all of its
+descendants (jackhmmer, hhblits, relax and feature workers, ...). Each sample
+is tagged with the stage the job is in, i.e. the innermost open span of
+foldhelpers.tracing, and its target. `profile` summarizes the samples of each
+stage, to choose the vCPU and memory requests of the job definitions. The
+memory of each sample also feeds the peak memory of the open trace spans.
+
+The memory of the tree is the sum of the PSS of its processes, which splits
+the pages shared between them (e.g. the forked feature workers and the
+libraries they map) instead of counting them once per process like RSS.
+"""
+import collections
+import mmap
+import os
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from foldhelpers import tracing
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+class ProcessTreeStats(NamedTuple):
+    num_processes: int
+    # User and system time, including that of the exited children.
+    cpu_seconds: float
+    pss_bytes: int
+    num_open_files: int
+    # Bytes read from and written to storage, as opposed to the page cache.
+    read_bytes: int
+    write_bytes: int
+
+
+def _io_bytes(pid: int) -> Tuple[int, int]:
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["read_bytes"]), int(counters["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _pss_bytes(pid: int) -> Optional[int]:
+    """Pss of /proc/<pid>/smaps_rollup, None if unavailable (Linux < 4.14)."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _num_open_files(pid: int) -> int:
+    try:
+        return len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return 0
+
+
+def process_tree_stats(pid: Optional[int] = None) -> ProcessTreeStats:
+    """Resource usage of a process and all of its descendants.
+
+    Args:
+        pid (int): Root of the tree. Defaults to the current process.
+    """
+    root = pid if pid is not None else os.getpid()
+    children = collections.defaultdict(list)
+    stats = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name may contain spaces, the fields after it do not.
+        fields = stat[stat.rindex(")") + 2:].split()
+        children[int(fields[1])].append(int(entry))
+        stats[int(entry)] = fields
+
+    tree = [root] if root in stats else []
+    for process in tree:
+        tree.extend(children[process])
+    # Exited children are added to the CPU time and I/O of their parent once
+    # waited for, so the totals of the tree only go down briefly.
+    cpu_ticks = pss_bytes = num_open_files = read_bytes = write_bytes = 0
+    for process in tree:
+        fields = stats[process]
+        cpu_ticks += sum(int(field) for field in fields[11:15])
+        process_pss_bytes = _pss_bytes(process)
+        if process_pss_bytes is None:
+            # The process exited, or the kernel has no smaps_rollup.
+            process_pss_bytes = int(fields[21]) * mmap.PAGESIZE
+        pss_bytes += process_pss_bytes
+        num_open_files += _num_open_files(process)
+        process_read_bytes, process_write_bytes = _io_bytes(process)
+        read_bytes += process_read_bytes
+        write_bytes += process_write_bytes
+    return ProcessTreeStats(
+        num_processes=len(tree),
+        cpu_seconds=cpu_ticks / CLOCK_TICKS,
+        pss_bytes=pss_bytes,
+        num_open_files=num_open_files,
+        read_bytes=read_bytes,
+        write_bytes=write_bytes,
+    )
+
+
+def memory_limit() -> Optional[int]:
+    """Memory limit of the container's cgroup, in bytes, if there is one."""
+    for path in ("/sys/fs/cgroup/memory.max",
+                 "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports "no limit" as a huge number.
+        if value != "max" and int(value) < 2 ** 60:
+            return int(value)
+    return None
+
+
+def memory_usage() -> Optional[int]:
+    """Memory charged to the container's cgroup, in bytes, page cache included."""
+    for path in ("/sys/fs/cgroup/memory.current",
+                 "/sys/fs/cgroup/memory/memory.usage_in_bytes"):
+        try:
+            with open(path) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def summarize(samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Duration and CPU, memory, open files and I/O statistics of samples."""
+    cpu_percent = np.array([sample["cpu_percent"] for sample in samples])
+    return {
+        "num_samples": len(samples),
+        "seconds": sum(sample["interval_sec"] for sample in samples),
+        "cpu_percent_mean": float(cpu_percent.mean()),
+        "cpu_percent_p95": float(np.percentile(cpu_percent, 95)),
+        "cpu_percent_max": float(cpu_percent.max()),
+        "pss_bytes_max": max(sample["pss_bytes"] for sample in samples),
+        "num_open_files_max": max(sample["num_open_files"] for sample in samples),
+        "num_processes_max": max(sample["num_processes"] for sample in samples),
+        "read_bytes": sum(sample["read_bytes"] for sample in samples),
+        "write_bytes": sum(sample["write_bytes"] for sample in samples),
+    }
+
+
+class ResourceSampler:
+    """Samples the resource usage of the job in a background thread.
+
+    Args:
+        interval_sec (float): Time between samples.
+        pid (int): Root of the sampled process tree. Defaults to the current
+            process.
+    """
+
+    def __init__(self, interval_sec: float = 5.0, pid: Optional[int] = None):
+        self.interval_sec = interval_sec
+        self.pid = pid
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        previous_time = time.time()
+        previous = process_tree_stats(self.pid)
+        while not self._stop.wait(self.interval_sec):
+            now = time.time()
+            current = process_tree_stats(self.pid)
+            self._add_sample(now, now - previous_time, previous, current)
+            previous_time, previous = now, current
+
+    def _add_sample(self, now, interval_sec, previous, current):
+        stage = tracing.current_stage()
+        target, stage_name = stage if stage is not None else (None, None)
+        self.samples.append({
+            "time": now,
+            "interval_sec": interval_sec,
+            "stage": stage_name,
+            "target": target,
+            # 100 is one fully used vCPU.
+            "cpu_percent": 100 * max(
+                0.0, current.cpu_seconds - previous.cpu_seconds) / interval_sec,
+            "pss_bytes": current.pss_bytes,
+            "num_open_files": current.num_open_files,
+            "num_processes": current.num_processes,
+            "read_bytes": max(0, current.read_bytes - previous.read_bytes),
+            "write_bytes": max(0, current.write_bytes - previous.write_bytes),
+        })
+        tracing.add_memory_sample(current.pss_bytes)
+
+    def profile(self, **metadata: Any) -> Dict[str, Any]:
+        """Samples and their summary for the job and for each stage.
+
+        Samples taken outside of any span are summarized under "other".
+
+        Args:
+            metadata: Added to the profile, e.g. the presets and the sequence
+                length of each target.
+        """
+        samples = list(self.samples)
+        stages = collections.defaultdict(list)
+        for sample in samples:
+            stages[sample["stage"] or "other"].append(sample)
+        return {
+            **metadata,
+            "interval_sec": self.interval_sec,
+            "memory_limit_bytes": memory_limit(),
+            "job": summarize(samples) if samples else None,
+            "stages": {name: summarize(stage_samples)
+                       for name, stage_samples in stages.items()},
+            "samples": samples,
+        }
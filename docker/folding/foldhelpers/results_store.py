@@ -0,0 +1,110 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Output profiles for the per-model prediction results.
+
+  * "full": the whole prediction_result, pickled (result_{model_name}.pkl).
+  * "standard": everything except the distogram, masked-MSA and
+    experimentally-resolved logits, as a compressed .npz file.
+  * "minimal": pLDDT, PAE, pTM/ipTM and the ranking confidence in float16, as a
+    compressed .npz file.
+Nested entries of the prediction result are stored under "/"-joined names
+(e.g. "structure_module/final_atom_positions") in the .npz profiles.
+"""
+import os
+import pickle
+from typing import Any, Dict, Mapping
+
+import numpy as np
+
+PROFILES = ("full", "standard", "minimal")
+# Large (num_res x num_res x bins, or num_msa x num_res x 23) logits that are
+# not needed to interpret or rank a prediction.
+STANDARD_EXCLUDED = ("distogram", "masked_msa", "experimentally_resolved")
+MINIMAL_KEYS = (
+    "plddt",
+    "predicted_aligned_error",
+    "max_predicted_aligned_error",
+    "ptm",
+    "iptm",
+    "ranking_confidence",
+)
+
+
+def result_output_path(output_dir: str, model_name: str, profile: str) -> str:
+    if profile == "full":
+        return os.path.join(output_dir, f"result_{model_name}.pkl")
+    elif profile in PROFILES:
+        return os.path.join(output_dir, f"result_{model_name}.npz")
+    raise ValueError(f"Unknown output profile {profile}, expected one of {PROFILES}")
+
+
+def flatten_result(result: Mapping[str, Any], prefix: str = "") -> Dict[str, np.ndarray]:
+    """Flatten a nested prediction result into "/"-joined names."""
+    flat = {}
+    for key, value in result.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, Mapping):
+            flat.update(flatten_result(value, prefix=f"{name}/"))
+        else:
+            flat[name] = np.asarray(value)
+    return flat
+
+
+def unflatten_result(flat: Mapping[str, np.ndarray]) -> Dict[str, Any]:
+    """Inverse of `flatten_result`."""
+    result = {}
+    for name, value in flat.items():
+        *parents, key = name.split("/")
+        node = result
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return result
+
+
+def select_profile(result: Mapping[str, Any], profile: str) -> Dict[str, np.ndarray]:
+    """The flattened arrays that `profile` keeps from `result`."""
+    flat = flatten_result(result)
+    if profile == "standard":
+        return {
+            name: value for name, value in flat.items()
+            if name.split("/")[0] not in STANDARD_EXCLUDED
+        }
+    elif profile == "minimal":
+        selected = {}
+        for name in MINIMAL_KEYS:
+            if name in flat:
+                value = flat[name]
+                if np.issubdtype(value.dtype, np.floating):
+                    value = value.astype(np.float16)
+                selected[name] = value
+        return selected
+    raise ValueError(f"Unknown output profile {profile}, expected one of {PROFILES}")
+
+
+def save_result(result: Mapping[str, Any], output_dir: str, model_name: str,
+                profile: str) -> str:
+    """Write the prediction result of `model_name` with `profile`.
+
+    Returns:
+        str: Path of the written file.
+    """
+    path = result_output_path(output_dir, model_name, profile)
+    if profile == "full":
+        with open(path, "wb") as f:
+            pickle.dump(result, f, protocol=4)
+    else:
+        np.savez_compressed(path, **select_profile(result, profile))
+    return path
+
+
+def load_result(path: str) -> Dict[str, Any]:
+    """Load a result written with any profile, as a nested dictionary."""
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    with np.load(path, allow_pickle=False) as archive:
+        return unflatten_result({name: archive[name] for name in archive.files})
+
@@ -0,0 +1,320 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Concurrent, multipart S3 transfers for the folding container.
+"""
+from concurrent import futures
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from absl import logging
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+# Size of the connection pool shared by every thread that uses the client.
+S3_MAX_POOL_CONNECTIONS = 64
+MB = 1024 * 1024
+# Outputs that are rewritten while the job runs, as opposed to written once.
+REWRITTEN_FILES = frozenset(
+    ["timings.json", "ranking_debug.json", "checkpoint.json", "trace.jsonl"])
+
+
+def create_s3_client(max_pool_connections: int = S3_MAX_POOL_CONNECTIONS,
+                     max_attempts: int = 5):
+    """Create an S3 client that can be shared between upload/download threads.
+
+    boto3 clients are thread-safe, so a single client with a large connection
+    pool avoids the per-thread TLS setup of creating one client per worker.
+    """
+    return boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": max_attempts, "mode": "standard"},
+        ),
+    )
+
+
+class UploadResult(NamedTuple):
+    local_path: str
+    s3_key: str
+    num_bytes: int
+    seconds: float
+    attempts: int
+
+
+class UploadReport(NamedTuple):
+    results: List[UploadResult]
+    failures: List[Tuple[str, str, BaseException]]
+    seconds: float
+
+    @property
+    def num_bytes(self) -> int:
+        return sum(r.num_bytes for r in self.results)
+
+    @property
+    def throughput_mb_s(self) -> float:
+        return self.num_bytes / MB / self.seconds if self.seconds > 0 else 0.0
+
+
+class S3Uploader:
+    """Uploads files to S3 with a bounded thread pool.
+
+    Each file is sent with the managed (multipart) transfer of boto3, so large
+    result pickles are split into `multipart_chunksize_mb` parts that are sent
+    in parallel. Whole-file failures are retried with exponential backoff on top
+    of the per-request retries done by botocore.
+
+    Args:
+        client (boto3 object): S3 client, shared by all worker threads. A pooled
+            client from `create_s3_client` is used if omitted.
+        max_workers (int): Number of files uploaded concurrently.
+        multipart_chunksize_mb (int): Part size, and threshold, for multipart
+            uploads.
+        max_attempts (int): Attempts per file before the upload is reported as
+            failed.
+        backoff_seconds (float): Base delay between attempts. Doubles after each
+            failed attempt, with jitter.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_workers: int = 8,
+        multipart_chunksize_mb: int = 64,
+        max_attempts: int = 5,
+        backoff_seconds: float = 1.0,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1.")
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1.")
+        self.client = client if client is not None else create_s3_client()
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        chunksize = multipart_chunksize_mb * MB
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunksize,
+            multipart_chunksize=chunksize,
+            # Split the connection pool between the files in flight.
+            max_concurrency=max(1, S3_MAX_POOL_CONNECTIONS // max_workers),
+            use_threads=True,
+        )
+
+    def upload_file(self, local_path: str, bucket: str, s3_key: str,
+                    extra_args: Optional[dict] = None) -> UploadResult:
+        """Upload a single file, retrying with backoff. Raises on final failure."""
+        num_bytes = os.path.getsize(local_path)
+        t_0 = time.time()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.client.upload_file(
+                    local_path,
+                    bucket,
+                    s3_key,
+                    ExtraArgs=extra_args,
+                    Config=self.transfer_config,
+                )
+                break
+            except Exception as err:
+                if attempt == self.max_attempts:
+                    raise
+                delay = self.backoff_seconds * 2 ** (attempt - 1)
+                delay += random.uniform(0, delay)
+                logging.warning(
+                    f"Upload of {local_path} to s3://{bucket}/{s3_key} failed "
+                    f"(attempt {attempt}/{self.max_attempts}): {err}. "
+                    f"Retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+        t_diff = time.time() - t_0
+        logging.info(
+            f"Uploaded {local_path} to s3://{bucket}/{s3_key} "
+            f"({num_bytes / MB:.1f} MB in {t_diff:.1f}s, "
+            f"{num_bytes / MB / max(t_diff, 1e-6):.1f} MB/s)"
+        )
+        return UploadResult(local_path, s3_key, num_bytes, t_diff, attempt)
+
+    def upload_files(self, files: Sequence[Tuple[str, str]], bucket: str,
+                     extra_args: Optional[dict] = None) -> UploadReport:
+        """Upload (local_path, s3_key) pairs concurrently.
+
+        Failures do not stop the remaining uploads; they are returned in the
+        report so the caller can decide whether the job should fail.
+        """
+        results = []
+        failures = []
+        t_0 = time.time()
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {
+                pool.submit(self.upload_file, local_path, bucket, s3_key,
+                            extra_args): (local_path, s3_key)
+                for local_path, s3_key in files
+            }
+            for future in futures.as_completed(pending):
+                local_path, s3_key = pending[future]
+                try:
+                    results.append(future.result())
+                except Exception as err:
+                    logging.error(
+                        f"Unable to upload {local_path} to s3://{bucket}/{s3_key}: {err}"
+                    )
+                    failures.append((local_path, s3_key, err))
+        report = UploadReport(results, failures, time.time() - t_0)
+        logging.info(
+            f"Uploaded {len(results)} files ({report.num_bytes / MB:.1f} MB) "
+            f"to s3://{bucket} in {report.seconds:.1f}s "
+            f"({report.throughput_mb_s:.1f} MB/s), {len(failures)} failed"
+        )
+        return report
+
+
+class BackgroundUploader:
+    """Streams files to S3 while the job keeps running.
+
+    Files are queued with `submit` as soon as they are written and uploaded by a
+    pool of background threads. Local paths are mapped to keys relative to
+    `local_root`, the same layout that `upload_data` produces for a directory.
+    Call `close` before the job exits to wait for the queue to drain.
+
+    Files that are written once (PDBs, result pickles, features) are uploaded
+    in place. Each queued version of a file that is rewritten (e.g.
+    checkpoint.json after every stage) is a copy, so it is never uploaded
+    half-written. Uploads to the same key are serialized: a version submitted
+    while the previous one is in flight waits for it, replacing any version
+    that was already waiting, so the last version submitted is the one left
+    in S3.
+
+    Args:
+        uploader (S3Uploader): Uploader that performs the transfers.
+        bucket (str): Destination bucket.
+        local_root (str): Local directory that corresponds to `key_prefix`.
+        key_prefix (str): S3 key prefix for `local_root`.
+        rewritten_files (set): Names of the files that are copied before they
+            are uploaded.
+    """
+
+    def __init__(self, uploader: S3Uploader, bucket: str, local_root: str,
+                 key_prefix: str, rewritten_files=REWRITTEN_FILES):
+        self.uploader = uploader
+        self.bucket = bucket
+        self.local_root = local_root
+        self.key_prefix = key_prefix.rstrip("/")
+        self.rewritten_files = rewritten_files
+        self._pool = futures.ThreadPoolExecutor(
+            max_workers=uploader.max_workers, thread_name_prefix="s3-upload")
+        self._staging_dir = tempfile.mkdtemp(prefix="s3-upload-")
+        # Reentrant: a done callback runs in the submitting thread when the
+        # upload finished before it was attached.
+        self._lock = threading.RLock()
+        self._drained = threading.Condition(self._lock)
+        # local path -> future of the upload in flight
+        self._in_flight = {}
+        # local path -> latest version (a copy, or the file itself if it is
+        # written once), waiting for the upload in flight
+        self._waiting = {}
+        # local path -> (size, mtime) of the last version queued for upload
+        self._submitted = {}
+        self._results = []
+        self._failures = []
+        self._t_0 = time.time()
+
+    def s3_key(self, local_path: str) -> str:
+        relative_path = os.path.relpath(local_path, start=self.local_root)
+        return "{}/{}".format(self.key_prefix, relative_path.replace(os.sep, "/"))
+
+    def submit(self, local_path: str):
+        """Queue a file, or every file under a directory, for upload.
+
+        A file that has not changed since it was last queued is skipped.
+        """
+        if os.path.isdir(local_path):
+            for dirpath, _, filenames in os.walk(local_path):
+                for name in filenames:
+                    self.submit(os.path.join(dirpath, name))
+            return
+        stat = os.stat(local_path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if self._submitted.get(local_path) == version:
+                return
+        if os.path.basename(local_path) in self.rewritten_files:
+            fd, source = tempfile.mkstemp(dir=self._staging_dir)
+            os.close(fd)
+            try:
+                shutil.copyfile(local_path, source)
+            except BaseException:
+                os.remove(source)
+                raise
+        else:
+            source = local_path
+        with self._lock:
+            # Only once the copy exists, so a failed copy is retried by the
+            # next submit.
+            self._submitted[local_path] = version
+            if local_path in self._in_flight:
+                replaced = self._waiting.pop(local_path, None)
+                if replaced is not None and replaced != local_path:
+                    os.remove(replaced)
+                self._waiting[local_path] = source
+            else:
+                self._start(local_path, source)
+
+    def _start(self, local_path: str, source: str):
+        """Upload a version of a file. Called with the lock held."""
+        future = self._pool.submit(self._upload, local_path, source)
+        self._in_flight[local_path] = future
+        future.add_done_callback(
+            lambda future: self._record(local_path, future))
+
+    def _upload(self, local_path: str, source: str) -> UploadResult:
+        try:
+            result = self.uploader.upload_file(
+                source, self.bucket, self.s3_key(local_path))
+        finally:
+            if source != local_path:
+                os.remove(source)
+        return result._replace(local_path=local_path)
+
+    def _record(self, local_path: str, future: futures.Future):
+        with self._lock:
+            del self._in_flight[local_path]
+            try:
+                self._results.append(future.result())
+            except Exception as err:
+                s3_key = self.s3_key(local_path)
+                logging.error(
+                    f"Unable to upload {local_path} to s3://{self.bucket}/{s3_key}: {err}"
+                )
+                self._failures.append((local_path, s3_key, err))
+            source = self._waiting.pop(local_path, None)
+            if source is not None:
+                self._start(local_path, source)
+            elif not self._in_flight:
+                self._drained.notify_all()
+
+    def close(self) -> UploadReport:
+        """Wait for all queued uploads to finish and stop the worker threads."""
+        with self._lock:
+            num_pending = len(self._in_flight) + len(self._waiting)
+            logging.info(f"Waiting for {num_pending} queued uploads to finish")
+            # Versions waiting for an upload in flight are started by its
+            # callback, so the queue is empty once nothing is in flight.
+            self._drained.wait_for(lambda: not self._in_flight)
+        self._pool.shutdown(wait=True)
+        shutil.rmtree(self._staging_dir, ignore_errors=True)
+        report = UploadReport(
+            list(self._results), list(self._failures), time.time() - self._t_0)
+        logging.info(
+            f"Streamed {len(report.results)} files ({report.num_bytes / MB:.1f} MB) "
+            f"to s3://{self.bucket}/{self.key_prefix}, {len(report.failures)} failed"
+        )
+        return report
@@ -0,0 +1,63 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Target-major and model-major scheduling of per-target prediction steps.
+
+Each target is a generator of steps (see `predict_structure_steps` in
+run_aws_alphafold.py): the first step computes or loads its features, then
+there is one step per model, and the last one ranks the predictions and writes
+the outputs.
+
+  * "target_major": all steps of a target run before the next target starts.
+  * "model_major": the features of all targets are computed first, then each
+    model runs on every target in turn while its compiled executable and
+    parameters are hot, then the outputs of each target are written.
+"""
+from typing import Any, Callable, Iterator, List, Optional, Sequence
+
+SCHEDULES = ("target_major", "model_major")
+
+
+def advance(steps: Iterator[Any]) -> bool:
+    """Run the next step of a target. Returns False if it had none left."""
+    try:
+        next(steps)
+    except StopIteration:
+        return False
+    return True
+
+
+def run_to_completion(steps: Iterator[Any]):
+    for _ in steps:
+        pass
+
+
+def run_model_major(
+    targets: Sequence[Iterator[Any]],
+    on_round_end: Optional[Callable[[List[Any]], None]] = None,
+):
+    """Run the remaining steps of `targets` round-robin.
+
+    Every round runs one step of each unfinished target, in order, so with
+    targets whose features are ready round k runs model k on all targets.
+
+    Args:
+        targets (list): Step generators of the targets.
+        on_round_end (callable): Called after each round with the values that
+            the steps yielded, e.g. to free the parameters of a model that
+            has run on all targets.
+    """
+    active = list(targets)
+    while active:
+        yielded = []
+        still_active = []
+        for steps in active:
+            try:
+                yielded.append(next(steps))
+            except StopIteration:
+                continue
+            still_active.append(steps)
+        if on_round_end is not None and yielded:
+            on_round_end(yielded)
+        active = still_active
@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+CPU time of the processes of an alignment tool, measured by a wrapper binary.
+
+`wrap` writes an executable script that runs this file in front of the tool:
+it starts the tool, reaps it with os.wait4 and appends the CPU time (user and
+system) of the tool and its descendants to a usage file. A tool runner whose
+`binary_path` is the wrapper runs the tool as before, with the same arguments,
+output and exit status, and `read_cpu_time` sums the runs that it recorded.
+Each search has its own usage file, so searches that run at the same time are
+told apart without touching the subprocess module of the runners.
+
+Usage:
+    python tool_timer.py USAGE_PATH BINARY [ARGS...]
+"""
+import os
+import shlex
+import stat
+import subprocess
+import sys
+import tempfile
+
+
+def wrap(binary_path: str, usage_path: str) -> str:
+    """Executable that runs `binary_path` and records its CPU time.
+
+    Args:
+        binary_path (str): Path of the tool.
+        usage_path (str): File to which the CPU time of each run is appended.
+            The wrapper is written next to it.
+
+    Returns:
+        str: Path of the wrapper.
+    """
+    fd, wrapper_path = tempfile.mkstemp(
+        prefix=f"{os.path.basename(binary_path)}_",
+        dir=os.path.dirname(usage_path) or ".")
+    with os.fdopen(fd, "w") as f:
+        f.write("#!/bin/sh\n")
+        f.write("exec {} {} {} {} \"$@\"\n".format(
+            *map(shlex.quote, (sys.executable, os.path.abspath(__file__),
+                               usage_path, binary_path))))
+    os.chmod(wrapper_path, os.stat(wrapper_path).st_mode | stat.S_IEXEC)
+    return wrapper_path
+
+
+def read_cpu_time(usage_path: str) -> float:
+    """CPU time, in seconds, of the runs recorded in `usage_path`."""
+    try:
+        with open(usage_path) as f:
+            return sum(float(line) for line in f if line.strip())
+    except FileNotFoundError:
+        return 0.0
+
+
+def main(argv) -> int:
+    usage_path, *command = argv[1:]
+    process = subprocess.Popen(command)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    with open(usage_path, "a") as f:
+        f.write(f"{usage.ru_utime + usage.ru_stime}\n")
+    if process.returncode < 0:
+        # Killed by a signal, reported as the shell does.
+        return 128 - process.returncode
+    return process.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
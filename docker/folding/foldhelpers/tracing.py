@@ -0,0 +1,280 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Lightweight tracing of the stages of a job.
+
+A `Trace` writes one JSON line per span to a file (trace.jsonl next to the
+timings.json of a target). Each span has start/end timestamps, wall time, the
+CPU time of the thread that ran it, the peak memory of the job during the span,
+the largest RSS of the child processes that exited so far and the bytes read
+and written by the process.
+
+CPU time is per thread (RUSAGE_THREAD), so spans that run at the same time on
+other threads do not add to each other. It does not include the tools run as
+child processes, whose CPU time the MSA searches record themselves. The peak
+memory is the largest PSS of the process tree in the samples of the resource
+sampler taken during the span (see `add_memory_sample`), so spans only have
+one with --resource_profile, and when they last at least one sampling
+interval.
+
+Spans nest: `Trace.span` makes the span active on the current thread, so code
+that does not know about the trace (e.g. the data pipeline) can open child
+spans with the module-level `span`, which does nothing when no span is active.
+A span must not be held open across a `yield` of the prediction steps, since
+other targets run their steps in between. `current_stage` returns the innermost
+open span of any thread, e.g. to tag the samples of the resource sampler.
+
+With an `emf_namespace`, the lines are CloudWatch embedded metric format
+documents and are also printed to stdout, from where the awslogs driver of
+AWS Batch sends them to CloudWatch Logs, which extracts the metrics.
+"""
+import contextlib
+import itertools
+import json
+import resource
+import sys
+import threading
+import time
+from typing import Any, Optional, Tuple
+
+# (trace, span id) of the innermost active span of each thread.
+_active = threading.local()
+_NULL_SPAN = contextlib.nullcontext()
+# (target, name) of the open spans of all threads, in the order they opened.
+_open_spans = []
+# Peak PSS of the open spans of all traces, by (trace id, span id), None
+# until the first sample.
+_peaks = {}
+_peaks_lock = threading.Lock()
+
+EMF_METRICS = (
+    ("wall_sec", "Seconds"),
+    ("cpu_sec", "Seconds"),
+    ("peak_pss_bytes", "Bytes"),
+    ("bytes_read", "Bytes"),
+    ("bytes_written", "Bytes"),
+)
+
+
+def _io_counters() -> Tuple[int, int]:
+    """Bytes read and written by this process (rchar and wchar)."""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def add_memory_sample(pss_bytes: int):
+    """Add a sample of the memory of the job to the peaks of the open spans."""
+    with _peaks_lock:
+        for key, value in _peaks.items():
+            _peaks[key] = pss_bytes if value is None else max(value, pss_bytes)
+
+
+def _start_peak(key: Tuple[int, int]):
+    with _peaks_lock:
+        _peaks[key] = None
+
+
+def _end_peak(key: Tuple[int, int]) -> Optional[int]:
+    """Peak PSS since `_start_peak`, or None if there was no sample."""
+    with _peaks_lock:
+        return _peaks.pop(key)
+
+
+def _cpu_seconds() -> float:
+    """User and system time of the current thread."""
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Trace:
+    """Spans of one target (or of the job), written to a JSON lines file.
+
+    Args:
+        path (str): File the spans are appended to. If None, spans are not
+            written and only tracked by `current_stage`.
+        target (str): Name of the target, added to every span.
+        emf_namespace (str): Optional CloudWatch namespace. If set, spans are
+            written in embedded metric format and printed to stdout.
+    """
+
+    def __init__(self, path: Optional[str], target: Optional[str] = None,
+                 emf_namespace: Optional[str] = None):
+        self.path = path
+        self.target = target
+        self.emf_namespace = emf_namespace
+        self._file = open(path, "a") if path is not None else None
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        # Root span of the trace, written by close().
+        self._start = time.time()
+        if self._file is not None:
+            _start_peak((id(self), 0))
+            self._thread = threading.get_ident()
+            self._start_cpu = _cpu_seconds()
+            self._start_io = _io_counters()
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes: Any):
+        """Time the body of a `with` statement as a child of the active span."""
+        span_id = next(self._ids)
+        previous = getattr(_active, "span", None)
+        parent_id = self._parent_id()
+        _active.span = (self, span_id)
+        stage = (self.target, name)
+        _open_spans.append(stage)
+        if self._file is not None:
+            _start_peak((id(self), span_id))
+            start = time.time()
+            start_cpu = _cpu_seconds()
+            start_io = _io_counters()
+        try:
+            yield
+        finally:
+            _open_spans.remove(stage)
+            if self._file is not None:
+                end_io = _io_counters()
+                self._write(
+                    name, span_id, parent_id, start, time.time(),
+                    cpu_sec=_cpu_seconds() - start_cpu,
+                    peak_pss_bytes=_end_peak((id(self), span_id)),
+                    bytes_read=end_io[0] - start_io[0],
+                    bytes_written=end_io[1] - start_io[1],
+                    **attributes)
+            _active.span = previous
+
+    def record(self, name: str, start: float, end: float, **attributes: Any):
+        """Add a span that was measured elsewhere, e.g. in a worker process."""
+        self._write(name, next(self._ids), self._parent_id(), start, end,
+                    **attributes)
+
+    def _parent_id(self) -> int:
+        """Id of the span of this trace active on this thread, 0 if none."""
+        active = getattr(_active, "span", None)
+        return active[1] if active is not None and active[0] is self else 0
+
+    def _write(self, name, span_id, parent_id, start, end, **attributes):
+        if self._file is None:
+            return
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        record = {
+            "target": self.target,
+            "name": name,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "start": start,
+            "end": end,
+            "wall_sec": end - start,
+            # Largest child of the whole job so far. ru_maxrss is in kilobytes
+            # on Linux.
+            "max_child_rss_bytes": children_usage.ru_maxrss * 1024,
+        }
+        record.update(attributes)
+        for metric, _ in EMF_METRICS:
+            if metric in record and record[metric] is None:
+                # e.g. no memory sample was taken during the span.
+                del record[metric]
+        if self.emf_namespace is not None:
+            record["_aws"] = {
+                "Timestamp": int(end * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.emf_namespace,
+                    "Dimensions": [["name"]],
+                    "Metrics": [
+                        {"Name": metric, "Unit": unit}
+                        for metric, unit in EMF_METRICS if metric in record
+                    ],
+                }],
+            }
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+        if self.emf_namespace is not None:
+            print(line, file=sys.stdout, flush=True)
+
+    def close(self, **attributes: Any):
+        """Write the root span, which covers the whole trace, and close."""
+        if self._file is None:
+            return
+        end_io = _io_counters()
+        self._write(
+            "target" if self.target is not None else "job", 0, None,
+            self._start, time.time(),
+            # Only the thread that opened the trace is measured.
+            cpu_sec=(_cpu_seconds() - self._start_cpu
+                     if threading.get_ident() == self._thread else None),
+            peak_pss_bytes=_end_peak((id(self), 0)),
+            bytes_read=end_io[0] - self._start_io[0],
+            bytes_written=end_io[1] - self._start_io[1],
+            **attributes)
+        self._file.close()
+
+
+class NullTrace:
+    """Trace that records nothing, used when tracing is off."""
+
+    def span(self, name: str, **attributes: Any):
+        return _NULL_SPAN
+
+    def record(self, name: str, start: float, end: float, **attributes: Any):
+        pass
+
+    def close(self, **attributes: Any):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+def span(name: str, **attributes: Any):
+    """Child span of the span active on this thread, if there is one."""
+    active = getattr(_active, "span", None)
+    if active is None:
+        return _NULL_SPAN
+    return active[0].span(name, **attributes)
+
+
+def record(name: str, start: float, end: float, **attributes: Any):
+    """Add a measured span under the span active on this thread, if any."""
+    active = getattr(_active, "span", None)
+    if active is not None:
+        active[0].record(name, start, end, **attributes)
+
+
+def current_stage() -> Optional[Tuple[Optional[str], str]]:
+    """(target, name) of the most recently opened span that is still open."""
+    try:
+        return _open_spans[-1]
+    except IndexError:
+        return None
+
+
+class TracedMethod:
+    """Proxy of an object whose calls to one method are traced.
+
+    Other attributes are forwarded, so the proxy can replace e.g. an MSA tool
+    runner of the data pipeline.
+    """
+
+    def __init__(self, target: Any, method: str, name: str, **attributes: Any):
+        self._target = target
+        self._method = method
+        self._name = name
+        self._attributes = attributes
+
+    def __getattr__(self, attr: str):
+        if attr.startswith("__") or attr in (
+                "_target", "_method", "_name", "_attributes"):
+            raise AttributeError(attr)
+        value = getattr(self._target, attr)
+        if attr != self._method:
+            return value
+
+        def traced(*args, **kwargs):
+            with span(self._name, **self._attributes):
+                return value(*args, **kwargs)
+        return traced
@@ -3,21 +3,24 @@
 # SPDX-License-Identifier: Apache-2.0
 
 """Full AlphaFold protein structure prediction script."""
+import contextlib
 import json
 import os
 import pathlib
-import pickle
 import random
 import shutil
+import signal
 import sys
+import tempfile
 import time
-from typing import Dict, Union, Optional
+from typing import Callable, Dict, Optional, Sequence, Union
 
 from absl import app
 from absl import flags
 from absl import logging
 from alphafold.common import protein
 from alphafold.common import residue_constants
+from alphafold.data import parsers
 from alphafold.data import pipeline
 from alphafold.data import pipeline_multimer
 from alphafold.data import templates
@@ -26,14 +29,35 @@ from alphafold.data.tools import hmmsearch
 from alphafold.model import config
 from alphafold.model import data
 from alphafold.model import model
+from alphafold.model.tf import shape_placeholders
 from alphafold.relax import relax
 import numpy as np
 
 ### ---------------------------------------------
 ### Modified by Amazon Web Services (AWS) to add urlparse and boto3
+from concurrent import futures
 from urllib.parse import urlparse
-import boto3
-s3 = boto3.client("s3")
+import botocore
+from foldhelpers import array_job
+from foldhelpers import bucketing
+from foldhelpers import chain_store
+from foldhelpers import checkpoint as checkpoint_lib
+from foldhelpers import db_warmer
+from foldhelpers import dedup
+from foldhelpers import feature_cache
+from foldhelpers import feature_worker
+from foldhelpers import features_store
+from foldhelpers import jax_cache
+from foldhelpers import lazy_params
+from foldhelpers import msa_search
+from foldhelpers import prefetch
+from foldhelpers import relax_pool
+from foldhelpers import resource_sampler
+from foldhelpers import results_store
+from foldhelpers import s3_transfer
+from foldhelpers import scheduling
+from foldhelpers import tracing
+s3 = s3_transfer.create_s3_client()
 ### ---------------------------------------------
 logging.set_verbosity(logging.INFO)
 
@@ -122,6 +146,18 @@ flags.DEFINE_boolean('use_gpu_relax', True, 'Whether to relax on GPU. '
                      'Relax on GPU can be much faster than CPU, so it is '
                      'recommended to enable if possible. GPUs must be available'
                      ' if this setting is enabled.')
+### ---------------------------------------------
+### Modified by AWS to overlap relaxation with model inference
+flags.DEFINE_integer('relax_workers', 0, 'Number of worker processes that '
+                     'relax predictions while the next models run. 0 relaxes '
+                     'each prediction in the main process, right after it '
+                     'is predicted.')
+flags.DEFINE_string('relax_mode', 'all', 'Which predictions to relax: "all", '
+                    'only the highest ranked one ("best"), or the N highest '
+                    'ranked ones ("top_k=N"). With "best" and "top_k=N", '
+                    'relaxation starts once all models of a target have been '
+                    'ranked, and the other ranked PDBs are unrelaxed.')
+### ---------------------------------------------
 
 ### ---------------------------------------------
 ### Modified by AWS to add urlparse and boto3
@@ -136,15 +172,263 @@ flags.DEFINE_string(
 flags.DEFINE_list(
     "features_paths",
     None,
-    "Optional paths to features.pkl files generated in "
-    "previous runs. Note that if features_paths is not None, it must be the "
-    "same length as fasta_paths.",
+    "Optional paths to features generated in previous runs: features.pkl "
+    "files, features.npz files or directories written with "
+    "--features_format=npy. Note that if features_paths is not None, it must "
+    "be the same length as fasta_paths.",
+)
+flags.DEFINE_enum(
+    "features_format",
+    "pkl",
+    features_store.FORMATS,
+    "Format of the features written for each target: a pickle (pkl), a "
+    "directory of memory-mappable .npy arrays (npy), an uncompressed, "
+    "memory-mappable .npz file (npz) or a compressed .npz file "
+    "(npz_compressed).",
 )
 flags.DEFINE_boolean(
     "run_features_only",
     False,
     "Should the job stop after generating features?",
 )
+flags.DEFINE_enum(
+    "output_profile",
+    "full",
+    results_store.PROFILES,
+    "What is saved from each model's prediction result: the whole result as "
+    "a pickle (full), everything except the distogram, masked-MSA and "
+    "experimentally-resolved logits (standard), or only pLDDT, PAE, pTM/ipTM "
+    "and the ranking confidence in float16 (minimal). standard and minimal "
+    "are written as compressed .npz files.",
+)
+flags.DEFINE_integer(
+    "prefetch_depth",
+    1,
+    "Number of targets whose inputs (FASTA, features.pkl and timings.json) are "
+    "downloaded from S3 ahead of the target that is being processed. 0 "
+    "downloads each target's inputs just before it is processed.",
+)
+flags.DEFINE_float(
+    "prefetch_max_disk_gb",
+    None,
+    "Optional cap (in GB) on the local disk used by prefetched inputs. The "
+    "inputs of a target are deleted once it has been processed.",
+)
+flags.DEFINE_boolean(
+    "stream_uploads",
+    True,
+    "Upload each output file to S3 as soon as it is written, instead of "
+    "uploading the output directory after all targets have been processed.",
+)
+flags.DEFINE_integer(
+    "upload_max_workers",
+    8,
+    "Number of files uploaded to S3 concurrently.",
+)
+flags.DEFINE_integer(
+    "upload_multipart_chunksize_mb",
+    64,
+    "Part size (in MB) used for multipart uploads of large output files.",
+)
+flags.DEFINE_integer(
+    "upload_max_attempts",
+    5,
+    "Number of attempts, with exponential backoff, before the upload of a "
+    "file is reported as failed.",
+)
+flags.DEFINE_list(
+    "length_buckets",
+    None,
+    "Optional comma-separated sequence lengths, e.g. 256,512,768,1024. The "
+    "features of monomer targets are zero-padded to the smallest bucket that "
+    "fits, so targets in the same bucket reuse the compiled model instead of "
+    "recompiling it, and the predictions are cropped back to the real length. "
+    "Targets longer than the largest bucket are not padded.",
+)
+flags.DEFINE_boolean(
+    "sort_by_bucket",
+    False,
+    "Process the targets of --fasta_paths grouped by length bucket (or by "
+    "length, without --length_buckets), so each model compiles once per "
+    "bucket.",
+)
+flags.DEFINE_string(
+    "jax_cache_dir",
+    None,
+    "Optional shared, writable directory (e.g. /mnt/jax_cache on FSx) for "
+    "JAX's persistent compilation cache, so jobs load the models compiled by "
+    "earlier jobs instead of compiling them again. Needs a JAX with a "
+    "persistent compilation cache; with older versions, models are compiled "
+    "as before.",
+)
+flags.DEFINE_float(
+    "jax_cache_max_gb",
+    20.0,
+    "Size cap (in GB) of --jax_cache_dir. The least recently used compiled "
+    "models are evicted first.",
+)
+flags.DEFINE_boolean(
+    "lazy_model_params",
+    True,
+    "Load the parameters of each model from a memory-mapped .npz file when "
+    "the model first runs, instead of loading all models before the first "
+    "target.",
+)
+flags.DEFINE_boolean(
+    "release_params_after_use",
+    False,
+    "Free the parameters of each model after its last prediction of the job, "
+    "i.e. once it has run on all targets with --schedule=model_major. "
+    "Requires --lazy_model_params.",
+)
+flags.DEFINE_string(
+    "feature_cache",
+    None,
+    "Optional shared directory (e.g. on FSx) or s3://bucket/prefix URI of a "
+    "cache of MSA and template search results. Entries are keyed by the "
+    "sequences, the size and mtime of the database files, the search tool "
+    "binaries, db_preset and max_template_date, so they are reused across "
+    "jobs only when all of them match.",
+)
+flags.DEFINE_float(
+    "feature_cache_max_gb",
+    None,
+    "Optional size cap (in GB) of --feature_cache. The least recently used "
+    "entries are evicted when the job starts.",
+)
+flags.DEFINE_float(
+    "feature_cache_ttl_days",
+    None,
+    "Optional age (in days) after which --feature_cache entries are evicted "
+    "when the job starts.",
+)
+flags.DEFINE_string(
+    "chain_msa_store",
+    None,
+    "Optional shared directory or s3://bucket/prefix URI where the multimer "
+    "data pipeline stores the MSAs of each chain, keyed by the chain "
+    "sequence, and looks them up before searching a chain again.",
+)
+flags.DEFINE_boolean(
+    "precompute_chains",
+    False,
+    "With model_preset=multimer, search every distinct chain of "
+    "--fasta_paths once before the first target is processed, so each chain "
+    "is searched exactly once per job. Uses --chain_msa_store, or a store "
+    "local to the job, removed when it ends, if it is not set.",
+)
+flags.DEFINE_enum(
+    "schedule",
+    "target_major",
+    scheduling.SCHEDULES,
+    "Order in which models run on the targets: every model on one target "
+    "before the next target (target_major), or the features of all targets "
+    "first and then each model on all targets while its compiled executable "
+    "and parameters are hot (model_major). model_major keeps the features "
+    "and unrelaxed predictions of all targets in memory until the last model "
+    "has run. Outputs are the same for both.",
+)
+flags.DEFINE_boolean(
+    "concurrent_msa_search",
+    False,
+    "Run the UniRef90, MGnify and BFD searches of the monomer pipeline "
+    "concurrently, and the template search as soon as the UniRef90 search "
+    "ends, with the vCPUs of --msa_cpus split between them. timings.json "
+    "reports the wall and CPU time of each search.",
+)
+flags.DEFINE_integer(
+    "msa_cpus",
+    None,
+    "Number of vCPUs to split between concurrent MSA searches. Defaults to "
+    "the CPU quota of the container, or the number of CPUs available.",
+)
+flags.DEFINE_string(
+    "fasta_manifest",
+    None,
+    "Optional file (an S3 key if --s3_bucket is set) that lists FASTA paths, "
+    "one per line, in addition to --fasta_paths.",
+)
+flags.DEFINE_integer(
+    "feature_workers",
+    0,
+    "If greater than 0, only compute the features of the targets, in this "
+    "many worker processes, without loading any model or relaxer. Each "
+    "worker uploads the outputs of a target as soon as it is done. With "
+    "--concurrent_msa_search, --msa_cpus is split between the workers.",
+)
+flags.DEFINE_boolean(
+    "warm_databases",
+    False,
+    "Read the sequence databases used by --db_preset and --model_preset into "
+    "the page cache before the first search, skipping the files that are "
+    "already resident. Residency and read statistics are written to "
+    "db_warmup.json in --output_dir.",
+)
+flags.DEFINE_float(
+    "warm_databases_max_gb",
+    None,
+    "Maximum amount of database data (in GB) read by --warm_databases. "
+    "Defaults to 80% of the memory left under the container's limit.",
+)
+flags.DEFINE_boolean(
+    "trace",
+    False,
+    "Record a span for each stage of the job (S3 downloads, MSA searches, "
+    "template featurization, model compilation and execution, output "
+    "writing, relaxation and upload) with its wall and CPU time, bytes read "
+    "and written, and with --resource_profile its peak memory. Spans are "
+    "written as JSON lines to trace.jsonl in the output directory of each "
+    "target, and of the job.",
+)
+flags.DEFINE_string(
+    "trace_emf_namespace",
+    None,
+    "With --trace, write the spans in CloudWatch embedded metric format with "
+    "this namespace, and print them to stdout so that CloudWatch Logs "
+    "extracts their metrics.",
+)
+flags.DEFINE_boolean(
+    "resource_profile",
+    False,
+    "Sample the CPU utilization, memory (PSS), open files and disk I/O of "
+    "the job's processes in the background, tagged with the current stage, "
+    "and write them to resource_profile.json in the output directory. "
+    "nbhelpers.recommend_resources aggregates the profiles of past jobs.",
+)
+flags.DEFINE_float(
+    "resource_profile_interval_sec",
+    5.0,
+    "Time between two samples of --resource_profile.",
+)
+flags.DEFINE_boolean(
+    "resume",
+    False,
+    "Record the completed stages of each target (features, and the "
+    "prediction and relaxation of each model) with digests of their outputs "
+    "in checkpoint.json, which is streamed to S3 with the outputs. When the "
+    "job runs again, e.g. after a Spot interruption, the stages whose outputs "
+    "are intact are skipped and the ranking is rebuilt from the saved "
+    "confidences.",
+)
+flags.DEFINE_string(
+    "shard_manifest",
+    None,
+    "Optional JSON file (an S3 key if --s3_bucket is set) with the FASTA "
+    "paths of each shard of an AWS Batch array job, written by "
+    "nbhelpers.submit_batch_alphafold_array_job. The job processes the shard "
+    "at its array index, in addition to --fasta_paths. Its job-level outputs "
+    "(traces, resource profile, ...) are written under "
+    "<output_dir>/shards/<index>.",
+)
+flags.DEFINE_boolean(
+    "deduplicate_targets",
+    True,
+    "Compute targets whose FASTA files have the same sequences (after "
+    "normalizing case, whitespace and stop codons) only once. The outputs of "
+    "the first such target are then hard-linked into the output directory of "
+    "the others, or copied within S3 if --s3_bucket is set, and the savings "
+    "are written to batch_summary.json.",
+)
 ### ---------------------------------------------
 
 FLAGS = flags.FLAGS
@@ -155,6 +439,8 @@ RELAX_ENERGY_TOLERANCE = 2.39
 RELAX_STIFFNESS = 10.0
 RELAX_EXCLUDE_RESIDUES = []
 RELAX_MAX_OUTER_ITERATIONS = 3
+# Concurrent reads of the input FASTA files.
+FASTA_READ_WORKERS = 16
 
 
 def _check_flag(flag_name: str,
@@ -166,7 +452,13 @@ def _check_flag(flag_name: str,
                      f'"--{other_flag_name}={FLAGS[other_flag_name].value}".')
 
 
-def predict_structure(
+def predict_structure(*args, **kwargs):
+    """Predicts structure using AlphaFold for the given sequence."""
+    for _ in predict_structure_steps(*args, **kwargs):
+        pass
+
+
+def predict_structure_steps(
     fasta_path: str,
     fasta_name: str,
     output_dir_base: str,
@@ -179,10 +471,49 @@ def predict_structure(
 ### Modified by AWS to add support for 2-step jobs
     features_path: Optional[str] = None,
     run_features_only: Optional[bool] = False,
+    features_format: str = 'pkl',
+    output_profile: str = 'full',
+### ---------------------------------------------
+### Modified by AWS to overlap relaxation with model inference
+    relax_workers: Optional[relax_pool.RelaxPool] = None,
+    relax_top_k: Optional[int] = None,
+### ---------------------------------------------
+### Modified by AWS to stream outputs to S3 as they are written
+    on_output: Optional[Callable[[str], None]] = None,
+### ---------------------------------------------
+### Modified by AWS to reuse compiled models across targets
+    length_buckets: Optional[Sequence[int]] = None,
+    compile_cache: Optional[bucketing.CompileCacheTracker] = None,
+    jax_cache_events: Optional[jax_cache.CacheEvents] = None,
+### ---------------------------------------------
+### Modified by AWS to load model parameters on first use
+    release_params: bool = False,
+### ---------------------------------------------
+### Modified by AWS to trace the stages of each target
+    trace_spans: bool = False,
+    trace_emf_namespace: Optional[str] = None,
+    track_stages: bool = False,
+### ---------------------------------------------
+### Modified by AWS to resume from the checkpoint of an earlier attempt
+    resume: bool = False,
+    fetch_output: Optional[Callable[[str], bool]] = None,
 ### ---------------------------------------------
 ):
-    """Predicts structure using AlphaFold for the given sequence."""
+    """Predicts structure using AlphaFold for the given sequence, step by step.
+
+    A generator that yields once the features are ready and then after each
+    model's prediction (yielding the model name), so the caller can interleave
+    the steps of several targets (see --schedule). The ranked outputs and
+    timings are written after the last model.
+
+    With `resume`, the completed stages are recorded in checkpoint.json and
+    those that an earlier attempt completed are skipped (see
+    foldhelpers.checkpoint). `fetch_output` downloads the outputs of that
+    attempt from S3.
+    """
     logging.info('Predicting %s', fasta_name)
+    if on_output is None:
+        on_output = lambda path: None
     timings = {}
     output_dir = os.path.join(output_dir_base, fasta_name)
     if not os.path.exists(output_dir):
@@ -190,27 +521,82 @@ def predict_structure(
     msa_output_dir = os.path.join(output_dir, 'msas')
     if not os.path.exists(msa_output_dir):
         os.makedirs(msa_output_dir)
+### ---------------------------------------------
+### Modified by AWS to trace the stages of each target
+    trace_output_path = os.path.join(output_dir, 'trace.jsonl')
+    if trace_spans:
+        trace = tracing.Trace(trace_output_path, target=fasta_name,
+                              emf_namespace=trace_emf_namespace)
+    elif track_stages:
+        # Only tags the samples of the resource sampler with the stage.
+        trace = tracing.Trace(None, target=fasta_name)
+    else:
+        trace = tracing.NULL_TRACE
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to resume from the checkpoint of an earlier attempt
+    if resume:
+        checkpoint = checkpoint_lib.TargetCheckpoint(
+            output_dir, fetch=fetch_output, on_output=on_output)
+    else:
+        checkpoint = None
+    # Models that an earlier attempt predicted, with their ranking confidence
+    # and timings.
+    resumed_models = {}
+    if checkpoint is not None and not run_features_only:
+        for model_name in model_runners:
+            values = checkpoint.completed('predicted', model_name)
+            if values is not None:
+                resumed_models[model_name] = values
+        timings['resumed_models'] = len(resumed_models)
+    features_output_path = features_store.features_output_path(
+        output_dir, features_format)
+### ---------------------------------------------
 
     # Get features.
     t_0 = time.time()
 ### ---------------------------------------------    
 ### Modified by AWS to add support for 2-step jobs
 
+    if model_runners and len(resumed_models) == len(model_runners):
+        logging.info(f"Resuming {fasta_name}: every model was already predicted.")
+        feature_dict = None
     # If we already have feature.pkl file, skip the MSA and template finding step
-    if features_path is not None:
+    elif features_path is not None:
         logging.info(f"{features_path} found. Loading...")
-        feature_dict = pickle.load(open(features_path, "rb"))
+        with trace.span('load_features'):
+            feature_dict = features_store.load_features(features_path)
+    elif checkpoint is not None and (
+            resumed_features := checkpoint.completed('features')) is not None:
+        logging.info(f"Resuming {fasta_name}: loading the features of an "
+                     f"earlier attempt from {features_output_path}")
+        with trace.span('load_features'):
+            feature_dict = features_store.load_features(features_output_path)
+        timings.update(resumed_features['timings'])
     else:
 ### ---------------------------------------------        
-        feature_dict = data_pipeline.process(
-            input_fasta_path=fasta_path,
-            msa_output_dir=msa_output_dir)
+        with trace.span('features'):
+            feature_dict = data_pipeline.process(
+                input_fasta_path=fasta_path,
+                msa_output_dir=msa_output_dir)
         timings['features'] = time.time() - t_0
+        # Cache statistics of the feature cache and chain MSA store.
+        timings.update(getattr(data_pipeline, 'last_timings', {}))
 
-        # Write out features as a pickled dictionary.
-        features_output_path = os.path.join(output_dir, 'features.pkl')
-        with open(features_output_path, 'wb') as f:
-            pickle.dump(feature_dict, f, protocol=4)
+        # Write out features in the requested format (a pickled dictionary by
+        # default).
+        on_output(msa_output_dir)
+        features_paths = []
+        with trace.span('save_features', format=features_format):
+            for path in features_store.save_features(
+                    feature_dict, features_output_path, features_format):
+                on_output(path)
+                features_paths.append(path)
+        if checkpoint is not None:
+            checkpoint.record('features', features_paths, timings=dict(
+                (name, value) for name, value in timings.items()
+                if name != 'resumed_models'))
 
 ### ---------------------------------------------
 ### Modified by AWS to add support for 2-step jobs.
@@ -224,97 +610,277 @@ def predict_structure(
         timings_output_path = os.path.join(output_dir, "timings.json")
         with open(timings_output_path, "w") as f:
             f.write(json.dumps(timings, indent=4))
+        on_output(timings_output_path)
+        trace.close()
+        if trace_spans:
+            on_output(trace_output_path)
         return
 ### ---------------------------------------------
 
+    yield 'features'
+
     unrelaxed_pdbs = {}
     relaxed_pdbs = {}
     ranking_confidences = {}
+    relax_futures = {}
+    unrelaxed_proteins = {}
+
+    def save_relaxed_pdb(model_name, relaxed_pdb_str):
+        relaxed_pdbs[model_name] = relaxed_pdb_str
+
+        # Save the relaxed PDB.
+        relaxed_output_path = os.path.join(
+            output_dir, f'relaxed_{model_name}.pdb')
+        with open(relaxed_output_path, 'w') as f:
+            f.write(relaxed_pdb_str)
+        on_output(relaxed_output_path)
+        if checkpoint is not None:
+            checkpoint.record('relaxed', [relaxed_output_path],
+                              model_name=model_name,
+                              relax_sec=timings.get(f'relax_{model_name}'))
+
+    def relax_prediction(model_name, unrelaxed_protein):
+        if relax_workers is not None:
+            # Relax the prediction in a worker process while the next model
+            # runs.
+            relax_futures[model_name] = relax_workers.submit(unrelaxed_protein)
+        else:
+            # Relax the prediction.
+            t_0 = time.time()
+            with trace.span('relax', model=model_name):
+                relaxed_pdb_str, _, _ = amber_relaxer.process(
+                    prot=unrelaxed_protein)
+            timings[f'relax_{model_name}'] = time.time() - t_0
+            save_relaxed_pdb(model_name, relaxed_pdb_str)
+
+### ---------------------------------------------
+### Modified by AWS to resume from the checkpoint of an earlier attempt
+    def resume_model(model_name):
+        values = resumed_models[model_name]
+        logging.info(f'Resuming {fasta_name}: {model_name} was already predicted')
+        ranking_confidences[model_name] = values['ranking_confidence']
+        timings.update(values['timings'])
+        with open(os.path.join(output_dir, f'unrelaxed_{model_name}.pdb')) as f:
+            unrelaxed_pdbs[model_name] = f.read()
+        if not amber_relaxer:
+            return
+        relaxed = checkpoint.completed('relaxed', model_name)
+        if relaxed is not None:
+            with open(os.path.join(output_dir, f'relaxed_{model_name}.pdb')) as f:
+                relaxed_pdbs[model_name] = f.read()
+            timings[f'relax_{model_name}'] = relaxed['relax_sec']
+            return
+        unrelaxed_protein = protein.from_pdb_string(unrelaxed_pdbs[model_name])
+        if relax_top_k is None:
+            relax_prediction(model_name, unrelaxed_protein)
+        else:
+            unrelaxed_proteins[model_name] = unrelaxed_protein
+### ---------------------------------------------
 
     # Run the models.
     num_models = len(model_runners)
+    # Prediction slot in which each model runs for the last time.
+    last_slots = {id(runner): name for name, runner in model_runners.items()}
     for model_index, (model_name, model_runner) in enumerate(
         model_runners.items()):
+### ---------------------------------------------
+### Modified by AWS to resume from the checkpoint of an earlier attempt
+        if model_name in resumed_models:
+            resume_model(model_name)
+            if (release_params
+                    and isinstance(model_runner, lazy_params.LazyRunModel)
+                    and last_slots[id(model_runner)] == model_name):
+                model_runner.release()
+            yield model_name
+            continue
+### ---------------------------------------------
         logging.info('Running model %s on %s', model_name, fasta_name)
         t_0 = time.time()
         model_random_seed = model_index + random_seed * num_models
-        processed_feature_dict = model_runner.process_features(
-            feature_dict, random_seed=model_random_seed)
+        with trace.span('process_features', model=model_name):
+            processed_feature_dict = model_runner.process_features(
+                feature_dict, random_seed=model_random_seed)
         timings[f'process_features_{model_name}'] = time.time() - t_0
 
+### ---------------------------------------------
+### Modified by AWS to reuse compiled models across targets
+        num_res = feature_dict['aatype'].shape[0]
+        timings['num_res'] = num_res
+        padded_num_res = num_res
+        if length_buckets and not model_runner.multimer_mode:
+            padded_num_res = bucketing.bucket_for(num_res, length_buckets)
+            timings['padded_num_res'] = padded_num_res
+        if padded_num_res != num_res:
+            processed_feature_dict = bucketing.resize_features(
+                processed_feature_dict, model_runner.config.data.eval.feat,
+                shape_placeholders.NUM_RES, padded_num_res)
+        compile_cache_hit = None
+        if compile_cache is not None:
+            compile_cache_hit = compile_cache.record(
+                id(model_runner),
+                bucketing.shape_signature(processed_feature_dict))
+            timings[f'compile_cache_hit_{model_name}'] = int(compile_cache_hit)
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to load model parameters on first use
+        lazy_runner = isinstance(model_runner, lazy_params.LazyRunModel)
+        if lazy_runner and not model_runner.loaded:
+            with trace.span('params_load', model=model_name):
+                timings[f'params_load_{model_name}'] = model_runner.load()
+### ---------------------------------------------
+
+        if jax_cache_events is not None:
+            jax_cache_before = jax_cache_events.counts()
         t_0 = time.time()
-        prediction_result = model_runner.predict(processed_feature_dict,
-                                                 random_seed=model_random_seed)
+        # Includes the compilation unless the compiled model is reused
+        # (compile_cache_hit).
+        with trace.span('predict', model=model_name,
+                        compile_cache_hit=compile_cache_hit):
+            prediction_result = model_runner.predict(
+                processed_feature_dict, random_seed=model_random_seed)
         t_diff = time.time() - t_0
         timings[f'predict_and_compile_{model_name}'] = t_diff
+        if jax_cache_events is not None:
+            # 1 if the executable was loaded from --jax_cache_dir, 0 if it
+            # was compiled.
+            jax_cache_loaded = jax_cache_events.loaded_since(jax_cache_before)
+            if jax_cache_loaded is not None:
+                timings[f'jax_cache_loaded_{model_name}'] = int(jax_cache_loaded)
         logging.info(
             'Total JAX model %s on %s predict time (includes compilation time, see --benchmark): %.1fs',
             model_name, fasta_name, t_diff)
 
         if benchmark:
             t_0 = time.time()
-            model_runner.predict(processed_feature_dict, 
-                                 random_seed=model_random_seed)
+            with trace.span('predict_benchmark', model=model_name):
+                model_runner.predict(processed_feature_dict,
+                                     random_seed=model_random_seed)
             t_diff = time.time() - t_0
             timings[f'predict_benchmark_{model_name}'] = t_diff
             logging.info(
                 'Total JAX model %s on %s predict time (excludes compilation time): %.1fs',
                 model_name, fasta_name, t_diff)
 
+### ---------------------------------------------
+### Modified by AWS to reuse compiled models across targets
+        if padded_num_res != num_res:
+            pae_config = model_runner.config.model.heads.predicted_aligned_error
+            prediction_result = bucketing.crop_prediction_result(
+                prediction_result, num_res, padded_num_res,
+                pae_max_error_bin=pae_config.max_error_bin,
+                pae_num_bins=pae_config.num_bins)
+            processed_feature_dict = bucketing.resize_features(
+                processed_feature_dict, model_runner.config.data.eval.feat,
+                shape_placeholders.NUM_RES, num_res)
+### ---------------------------------------------
+
         plddt = prediction_result['plddt']
         ranking_confidences[model_name] = prediction_result['ranking_confidence']
 
         # Save the model outputs.
-        result_output_path = os.path.join(output_dir, f'result_{model_name}.pkl')
-        with open(result_output_path, 'wb') as f:
-            pickle.dump(prediction_result, f, protocol=4)
-
-        # Add the predicted LDDT in the b-factor column.
-        # Note that higher predicted LDDT value means higher model confidence.
-        plddt_b_factors = np.repeat(
-            plddt[:, None], residue_constants.atom_type_num, axis=-1)
-        unrelaxed_protein = protein.from_prediction(
-            features=processed_feature_dict,
-            result=prediction_result,
-            b_factors=plddt_b_factors,
-            remove_leading_feature_dimension=not model_runner.multimer_mode)
-
-        unrelaxed_pdbs[model_name] = protein.to_pdb(unrelaxed_protein)
-        unrelaxed_pdb_path = os.path.join(output_dir, f'unrelaxed_{model_name}.pdb')
-        with open(unrelaxed_pdb_path, 'w') as f:
-            f.write(unrelaxed_pdbs[model_name])
-
-        if amber_relaxer:
-            # Relax the prediction.
-            t_0 = time.time()
-            relaxed_pdb_str, _, _ = amber_relaxer.process(prot=unrelaxed_protein)
-            timings[f'relax_{model_name}'] = time.time() - t_0
+        with trace.span('save_result', model=model_name,
+                        profile=output_profile):
+            result_output_path = results_store.save_result(
+                prediction_result, output_dir, model_name, output_profile)
+        on_output(result_output_path)
+
+        with trace.span('write_pdb', model=model_name):
+            # Add the predicted LDDT in the b-factor column.
+            # Note that higher predicted LDDT value means higher model
+            # confidence.
+            plddt_b_factors = np.repeat(
+                plddt[:, None], residue_constants.atom_type_num, axis=-1)
+            unrelaxed_protein = protein.from_prediction(
+                features=processed_feature_dict,
+                result=prediction_result,
+                b_factors=plddt_b_factors,
+                remove_leading_feature_dimension=not model_runner.multimer_mode)
+
+            unrelaxed_pdbs[model_name] = protein.to_pdb(unrelaxed_protein)
+            unrelaxed_pdb_path = os.path.join(
+                output_dir, f'unrelaxed_{model_name}.pdb')
+            with open(unrelaxed_pdb_path, 'w') as f:
+                f.write(unrelaxed_pdbs[model_name])
+        on_output(unrelaxed_pdb_path)
+        if checkpoint is not None:
+            checkpoint.record(
+                'predicted', [result_output_path, unrelaxed_pdb_path],
+                model_name=model_name,
+                ranking_confidence=float(ranking_confidences[model_name]),
+                timings={name: value for name, value in timings.items()
+                         if name.endswith(f'_{model_name}')})
+
+        if amber_relaxer and relax_top_k is None:
+            relax_prediction(model_name, unrelaxed_protein)
+        elif amber_relaxer:
+            # Relaxed once all models are ranked.
+            unrelaxed_proteins[model_name] = unrelaxed_protein
+
+        if (release_params and lazy_runner
+                and last_slots[id(model_runner)] == model_name):
+            model_runner.release()
+
+        yield model_name
+
+    # Relax only the highest ranked models.
+    if amber_relaxer and relax_top_k is not None:
+        for model_name in relax_pool.select_models_to_relax(
+                ranking_confidences, relax_top_k):
+            # Unless an earlier attempt relaxed it.
+            if model_name not in relaxed_pdbs:
+                relax_prediction(model_name, unrelaxed_proteins[model_name])
 
-            relaxed_pdbs[model_name] = relaxed_pdb_str
+    # Wait for the relaxations that ran in worker processes.
+    if relax_futures:
+        t_0 = time.time()
+        with trace.span('relax_wait'):
+            for model_name, future in relax_futures.items():
+                relaxed_pdb_str, timings[f'relax_{model_name}'] = future.result()
+                save_relaxed_pdb(model_name, relaxed_pdb_str)
+        timings['relax_wait'] = time.time() - t_0
 
-            # Save the relaxed PDB.
-            relaxed_output_path = os.path.join(
-                output_dir, f'relaxed_{model_name}.pdb')
-            with open(relaxed_output_path, 'w') as f:
-                f.write(relaxed_pdb_str)
+    if amber_relaxer and relax_top_k is not None:
+        # Estimate the time saved by not relaxing the remaining models.
+        relax_times = [timings[f'relax_{name}'] for name in relaxed_pdbs]
+        num_skipped = len(ranking_confidences) - len(relaxed_pdbs)
+        timings['relax_skipped_models'] = num_skipped
+        timings['relax_saved_estimate'] = (
+            num_skipped * sum(relax_times) / len(relax_times))
 
     # Rank by model confidence and write out relaxed PDBs in rank order.
     ranked_order = []
-    for idx, (model_name, _) in enumerate(
-        sorted(ranking_confidences.items(), key=lambda x: x[1], reverse=True)):
-        ranked_order.append(model_name)
-        ranked_output_path = os.path.join(output_dir, f'ranked_{idx}.pdb')
-        with open(ranked_output_path, 'w') as f:
-            if amber_relaxer:
-                f.write(relaxed_pdbs[model_name])
-            else:
-                f.write(unrelaxed_pdbs[model_name])
+    with trace.span('write_ranked'):
+        for idx, (model_name, _) in enumerate(
+            sorted(ranking_confidences.items(), key=lambda x: x[1], reverse=True)):
+            ranked_order.append(model_name)
+            ranked_output_path = os.path.join(output_dir, f'ranked_{idx}.pdb')
+            with open(ranked_output_path, 'w') as f:
+                if model_name in relaxed_pdbs:
+                    f.write(relaxed_pdbs[model_name])
+                else:
+                    f.write(unrelaxed_pdbs[model_name])
+            on_output(ranked_output_path)
 
     ranking_output_path = os.path.join(output_dir, 'ranking_debug.json')
     with open(ranking_output_path, 'w') as f:
-        label = 'iptm+ptm' if 'iptm' in prediction_result else 'plddts'
+        # Not prediction_result, since resumed models are not predicted.
+        multimer_mode = any(
+            runner.multimer_mode for runner in model_runners.values())
+        label = 'iptm+ptm' if multimer_mode else 'plddts'
         f.write(json.dumps(
-                {label: ranking_confidences, 'order': ranked_order}, indent=4))
+                {label: ranking_confidences, 'order': ranked_order,
+                 'relaxed': [name for name in ranked_order
+                             if name in relaxed_pdbs]}, indent=4))
+    on_output(ranking_output_path)
+
+    if compile_cache is not None:
+        compiled_models = [name for name in ranking_confidences
+                           if f'compile_cache_hit_{name}' in timings]
+        timings['compile_cache_hits'] = sum(
+            timings[f'compile_cache_hit_{name}'] for name in compiled_models)
+        timings['compile_cache_misses'] = (
+            len(compiled_models) - timings['compile_cache_hits'])
 
     logging.info('Final timings for %s: %s', fasta_name, timings)
 
@@ -330,6 +896,10 @@ def predict_structure(
     ### --------------------------------------------- 
     with open(timings_output_path, 'w') as f:
         f.write(json.dumps(timings, indent=4))
+    on_output(timings_output_path)
+    trace.close(num_models=len(ranking_confidences))
+    if trace_spans:
+        on_output(trace_output_path)
 
 
 def main(argv):
@@ -342,6 +912,10 @@ def main(argv):
             raise ValueError(f'Could not find path to the "{tool_name}" binary. Make '
                             'sure it is installed on your system.')
 
+    if FLAGS.release_params_after_use and not FLAGS.lazy_model_params:
+        raise ValueError('--release_params_after_use requires '
+                         '--lazy_model_params.')
+
     use_small_bfd = FLAGS.db_preset == 'reduced_dbs'
     _check_flag('small_bfd_database_path', 'db_preset',
                 should_be_set=use_small_bfd)
@@ -363,8 +937,25 @@ def main(argv):
     else:
         num_ensemble = 1
 
+### ---------------------------------------------
+### Modified by AWS to read the targets from a manifest
+    fasta_paths = list(FLAGS.fasta_paths or [])
+    if FLAGS.fasta_manifest is not None:
+        fasta_paths += feature_worker.read_manifest(
+            _read_input(FLAGS.fasta_manifest))
+    if FLAGS.shard_manifest is not None:
+        shard_paths = array_job.read_shard(
+            _read_input(FLAGS.shard_manifest), array_job.array_index())
+        logging.info(f'Processing the {len(shard_paths)} targets of shard '
+                     f'{array_job.array_index()} of {FLAGS.shard_manifest}')
+        fasta_paths += shard_paths
+    if not fasta_paths:
+        raise ValueError('--fasta_paths, --fasta_manifest or --shard_manifest '
+                         'must list at least one FASTA file.')
+### ---------------------------------------------
+
     # Check for duplicate FASTA file names.
-    fasta_names = [pathlib.Path(p).stem for p in FLAGS.fasta_paths]
+    fasta_names = [pathlib.Path(p).stem for p in fasta_paths]
     if len(fasta_names) != len(set(fasta_names)):
         raise ValueError('All FASTA paths must have a unique basename.')
 
@@ -374,13 +965,477 @@ def main(argv):
     # Check that features_paths has the same number of elements as fasta_paths,
     # (if it is not None)
     if FLAGS.features_paths is not None:
-        if len(FLAGS.features_paths) != len(FLAGS.fasta_paths):
+        if len(FLAGS.features_paths) != len(fasta_paths):
             raise ValueError(
                 "--features_paths must either be omitted or match "
                 "length of --fasta_paths."
             )
+        features_paths = FLAGS.features_paths
+    else:
+        features_paths = [None] * len(fasta_paths)
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to compute identical targets once
+    if FLAGS.deduplicate_targets and len(fasta_paths) > 1:
+        sequences = _read_fasta_files(fasta_paths)
+        # Unreadable targets are left ungrouped, the prefetcher reports them.
+        readable = [i for i, seqs in enumerate(sequences) if seqs is not None]
+        representatives = list(range(len(fasta_paths)))
+        for i, first in zip(readable, dedup.group_targets(
+                [sequences[i] for i in readable])):
+            representatives[i] = readable[first]
+        duplicates = [i for i, rep in enumerate(representatives) if rep != i]
+        dedup_summary = {
+            'num_targets': len(fasta_paths),
+            'num_unique_targets': len(fasta_paths) - len(duplicates),
+            'duplicates': {fasta_names[i]: fasta_names[representatives[i]]
+                           for i in duplicates},
+            'skipped_chains': sum(len(sequences[i]) for i in duplicates),
+            'skipped_residues': sum(len(sequence) for i in duplicates
+                                    for sequence in sequences[i]),
+        }
+        if duplicates:
+            logging.info(f"{len(duplicates)} targets are identical to another "
+                         f"target and are not computed again: "
+                         f"{dedup_summary['duplicates']}")
+            unique = [i for i, rep in enumerate(representatives) if rep == i]
+            fasta_paths = [fasta_paths[i] for i in unique]
+            fasta_names = [fasta_names[i] for i in unique]
+            features_paths = [features_paths[i] for i in unique]
+    else:
+        dedup_summary = None
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to reuse compiled models across targets
+    if FLAGS.jax_cache_dir is not None and jax_cache.enable_cache(
+            FLAGS.jax_cache_dir,
+            max_bytes=int(FLAGS.jax_cache_max_gb * 1024 ** 3)):
+        jax_cache_events = jax_cache.CacheEvents()
+    else:
+        jax_cache_events = None
+    length_buckets = bucketing.parse_buckets(FLAGS.length_buckets)
+    if length_buckets and run_multimer_system:
+        logging.warning('--length_buckets only applies to monomer models, the '
+                        'features of multimer targets are not padded.')
+    if (FLAGS.chain_msa_store or FLAGS.precompute_chains) and not run_multimer_system:
+        logging.warning('--chain_msa_store and --precompute_chains only apply '
+                        'to model_preset=multimer.')
+    if (FLAGS.precompute_chains and run_multimer_system
+            and FLAGS.chain_msa_store is None):
+        # Only shared by the targets of this job, and its feature workers.
+        chain_store_dir = tempfile.mkdtemp(prefix='chain_msas_')
+        FLAGS.chain_msa_store = chain_store_dir
+    else:
+        chain_store_dir = None
+    if FLAGS.resume and FLAGS.s3_bucket is not None and not FLAGS.stream_uploads:
+        logging.warning('Without --stream_uploads, the outputs and checkpoints '
+                        'of --resume only reach S3 when the job ends.')
+    if FLAGS.sort_by_bucket:
+        # Unreadable targets fail first, without waiting for a bucket.
+        lengths = [sum(len(sequence) for sequence in sequences or [])
+                   for sequences in _read_fasta_files(fasta_paths)]
+        order = bucketing.order_by_bucket(lengths, length_buckets)
+        fasta_paths = [fasta_paths[i] for i in order]
+        fasta_names = [fasta_names[i] for i in order]
+        features_paths = [features_paths[i] for i in order]
+        logging.info(f'Processing targets in bucket order: {fasta_names}')
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to reuse MSA and template search results across jobs
+    if FLAGS.feature_cache is not None and (
+            FLAGS.feature_cache_max_gb is not None
+            or FLAGS.feature_cache_ttl_days is not None):
+        try:
+            feature_cache.evict(
+                feature_cache.open_store(FLAGS.feature_cache, client=s3),
+                max_bytes=(int(FLAGS.feature_cache_max_gb * 1024 ** 3)
+                           if FLAGS.feature_cache_max_gb is not None else None),
+                ttl_seconds=(FLAGS.feature_cache_ttl_days * 24 * 3600
+                             if FLAGS.feature_cache_ttl_days is not None
+                             else None))
+        except Exception as err:
+            # Eviction is housekeeping, the next job tries again.
+            logging.warning(f'Unable to evict entries from the features '
+                            f'cache: {err}')
 ### ---------------------------------------------
 
+### ---------------------------------------------
+### Modified by AWS to trace the stages of the job
+    job_trace_path = os.path.join(_job_output_dir(), 'trace.jsonl')
+    if FLAGS.trace:
+        os.makedirs(_job_output_dir(), exist_ok=True)
+        job_trace = tracing.Trace(job_trace_path,
+                                  emf_namespace=FLAGS.trace_emf_namespace)
+    elif FLAGS.resource_profile:
+        job_trace = tracing.Trace(None)
+    else:
+        job_trace = tracing.NULL_TRACE
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to profile the resources used by the job
+    if FLAGS.resource_profile:
+        sampler = resource_sampler.ResourceSampler(
+            FLAGS.resource_profile_interval_sec)
+        sampler.start()
+    else:
+        sampler = None
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to warm the page cache with the sequence databases
+    if FLAGS.warm_databases and any(path is None for path in features_paths):
+        with job_trace.span('warm_databases'):
+            report = db_warmer.warm(
+                _database_paths(run_multimer_system, use_small_bfd),
+                max_bytes=(int(FLAGS.warm_databases_max_gb * 1024 ** 3)
+                           if FLAGS.warm_databases_max_gb is not None
+                           else None))
+        os.makedirs(_job_output_dir(), exist_ok=True)
+        with open(os.path.join(_job_output_dir(), 'db_warmup.json'), 'w') as f:
+            f.write(json.dumps(report.to_dict(), indent=4))
+### ---------------------------------------------
+
+### ---------------------------------------------
+### Modified by AWS to featurize many targets per CPU-only container
+    if FLAGS.feature_workers > 0:
+        if FLAGS.features_paths is not None:
+            raise ValueError('--feature_workers computes the features of '
+                             '--fasta_paths, --features_paths must be omitted.')
+        try:
+            with job_trace.span('feature_workers'):
+                _run_feature_workers(fasta_paths, fasta_names,
+                                     run_multimer_system, use_small_bfd)
+        finally:
+            job_trace.close()
+            if sampler is not None:
+                _write_resource_profile(sampler, fasta_paths, fasta_names,
+                                        upload=True)
+            if chain_store_dir is not None:
+                shutil.rmtree(chain_store_dir, ignore_errors=True)
+        if dedup_summary is not None:
+            _materialize_duplicates(dedup_summary)
+        return
+
+    data_pipeline, chain_pipeline = _create_data_pipeline(
+        run_multimer_system, use_small_bfd, msa_cpus=FLAGS.msa_cpus)
+    if run_multimer_system:
+        num_predictions_per_model = FLAGS.num_multimer_predictions_per_model
+    else:
+        num_predictions_per_model = 1
+### ---------------------------------------------
+
+    model_runners = {}
+    model_names = config.MODEL_PRESETS[FLAGS.model_preset]
+    for model_name in model_names:
+        model_config = config.model_config(model_name)
+        if run_multimer_system:
+            model_config.model.num_ensemble_eval = num_ensemble
+        else:
+            model_config.data.eval.num_ensemble = num_ensemble
+### ---------------------------------------------
+### Modified by AWS to load model parameters on first use
+        if FLAGS.lazy_model_params:
+            model_runner = lazy_params.LazyRunModel(
+                model_config, model_name, FLAGS.data_dir)
+        else:
+            model_params = data.get_model_haiku_params(
+                model_name=model_name, data_dir=FLAGS.data_dir)
+            model_runner = model.RunModel(model_config, model_params)
+### ---------------------------------------------
+        for i in range(num_predictions_per_model):
+            model_runners[f'{model_name}_pred_{i}'] = model_runner
+
+    logging.info('Have %d models: %s', len(model_runners),
+                list(model_runners.keys()))
+
+    relax_workers = None
+    relax_top_k = relax_pool.parse_relax_mode(FLAGS.relax_mode)
+    if FLAGS.run_relax:
+        relax_kwargs = dict(
+            max_iterations=RELAX_MAX_ITERATIONS,
+            tolerance=RELAX_ENERGY_TOLERANCE,
+            stiffness=RELAX_STIFFNESS,
+            exclude_residues=RELAX_EXCLUDE_RESIDUES,
+            max_outer_iterations=RELAX_MAX_OUTER_ITERATIONS,
+            use_gpu=FLAGS.use_gpu_relax)
+        amber_relaxer = relax.AmberRelaxation(**relax_kwargs)
+        if FLAGS.relax_workers > 0:
+            relax_workers = relax_pool.RelaxPool(
+                relax_kwargs, num_workers=FLAGS.relax_workers)
+    else:
+        amber_relaxer = None
+
+    random_seed = FLAGS.random_seed
+    if random_seed is None:
+        random_seed = random.randrange(sys.maxsize // len(model_runners))
+    logging.info('Using random seed %d for the data pipeline', random_seed)
+
+### ---------------------------------------------
+### Modified by AWS to stream outputs to S3 while the next targets run
+    if FLAGS.s3_bucket is not None:
+        uploader = s3_transfer.S3Uploader(
+            client=s3,
+            max_workers=FLAGS.upload_max_workers,
+            multipart_chunksize_mb=FLAGS.upload_multipart_chunksize_mb,
+            max_attempts=FLAGS.upload_max_attempts,
+        )
+    if FLAGS.s3_bucket is not None and FLAGS.stream_uploads:
+        background_uploader = s3_transfer.BackgroundUploader(
+            uploader, FLAGS.s3_bucket, FLAGS.output_dir, FLAGS.output_dir)
+        on_output = background_uploader.submit
+        # Batch sends SIGTERM before stopping the container (e.g. when a Spot
+        # instance is reclaimed); exit through the finally block below so the
+        # outputs that are already written still reach S3.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    else:
+        background_uploader = None
+        on_output = None
+    try:
+        if FLAGS.precompute_chains and chain_pipeline is not None:
+            with job_trace.span('precompute_chains'):
+                _precompute_chains(chain_pipeline, fasta_paths, features_paths)
+        _predict_all_targets(
+            fasta_paths=fasta_paths,
+            fasta_names=fasta_names,
+            features_paths=features_paths,
+            data_pipeline=data_pipeline,
+            model_runners=model_runners,
+            amber_relaxer=amber_relaxer,
+            random_seed=random_seed,
+            on_output=on_output,
+            relax_workers=relax_workers,
+            relax_top_k=relax_top_k,
+            length_buckets=length_buckets,
+            job_trace=job_trace,
+            jax_cache_events=jax_cache_events,
+        )
+    finally:
+        if relax_workers is not None:
+            relax_workers.close(cancel_pending=True)
+        if chain_store_dir is not None:
+            shutil.rmtree(chain_store_dir, ignore_errors=True)
+        if sampler is not None:
+            # Written before the upload, which is not profiled.
+            _write_resource_profile(sampler, fasta_paths, fasta_names)
+        # ---- Upload results back to s3 -----------------------
+        with job_trace.span('upload'):
+            if background_uploader is not None:
+                # Pick up anything that was not streamed (e.g. the input
+                # files).
+                if os.path.isdir(FLAGS.output_dir):
+                    background_uploader.submit(FLAGS.output_dir)
+                report = background_uploader.close()
+            elif FLAGS.s3_bucket is not None:
+                logging.info(f"Uploading {FLAGS.output_dir} to {FLAGS.s3_bucket}")
+                report = upload_data(
+                    FLAGS.output_dir,
+                    f"s3://{FLAGS.s3_bucket}/{FLAGS.output_dir}",
+                    uploader=uploader,
+                )
+        job_trace.close()
+        if FLAGS.trace and FLAGS.s3_bucket is not None:
+            # Written after the upload span ended.
+            upload_data(
+                job_trace_path,
+                f"s3://{FLAGS.s3_bucket}/{_job_output_dir()}",
+                uploader=uploader,
+            )
+        # ----------------------------
+    if FLAGS.s3_bucket is not None and report.failures:
+        raise RuntimeError(
+            f"{len(report.failures)} files could not be uploaded to "
+            f"s3://{FLAGS.s3_bucket}/{FLAGS.output_dir}"
+        )
+    if dedup_summary is not None:
+        _materialize_duplicates(dedup_summary)
+
+
+def _job_output_dir():
+    """Directory of the outputs of the job, as opposed to those of a target.
+
+    The children of an array job share --output_dir, so each one has its own.
+    """
+    if FLAGS.shard_manifest is None:
+        return FLAGS.output_dir
+    return os.path.join(
+        FLAGS.output_dir, 'shards', str(array_job.array_index()))
+
+
+def _read_input(path):
+    """Contents of an input file, from S3 if --s3_bucket is set."""
+    if FLAGS.s3_bucket is not None:
+        response = s3.get_object(Bucket=FLAGS.s3_bucket, Key=path)
+        return response["Body"].read().decode()
+    with open(path) as f:
+        return f.read()
+
+
+_fasta_cache = {}
+
+
+def _fasta_sequences(fasta_path):
+    """Sequences of a (local or S3) FASTA file, read once per job."""
+    if fasta_path not in _fasta_cache:
+        sequences, _ = parsers.parse_fasta(_read_input(fasta_path))
+        _fasta_cache[fasta_path] = sequences
+    return _fasta_cache[fasta_path]
+
+
+def _read_fasta_files(fasta_paths):
+    """Sequences of each FASTA file, read concurrently, None if unreadable."""
+    def read(fasta_path):
+        try:
+            return _fasta_sequences(fasta_path)
+        except Exception as err:
+            logging.warning(f'Unable to read {fasta_path}: {err}')
+            return None
+
+    with futures.ThreadPoolExecutor(max_workers=FASTA_READ_WORKERS) as executor:
+        return list(executor.map(read, fasta_paths))
+
+
+def _fetch_output(path):
+    """Downloads an output of an earlier attempt of the job, if it is in S3."""
+    if FLAGS.s3_bucket is None:
+        return False
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    try:
+        s3.download_file(FLAGS.s3_bucket, path, path)
+    except botocore.exceptions.ClientError:
+        return False
+    logging.info(f'Downloaded {path} from an earlier attempt of the job')
+    return True
+
+
+def _materialize_duplicates(dedup_summary):
+    """Gives duplicate targets the outputs of the target they are identical to.
+
+    The outputs are copied within S3 if --s3_bucket is set and hard-linked
+    locally otherwise. The savings are added to the summary, which is written
+    to batch_summary.json.
+    """
+    work_seconds = {}
+    num_files = num_bytes = 0
+    for fasta_name, representative in dedup_summary['duplicates'].items():
+        source_dir = os.path.join(FLAGS.output_dir, representative)
+        dest_dir = os.path.join(FLAGS.output_dir, fasta_name)
+        if FLAGS.s3_bucket is not None:
+            files, size = dedup.copy_outputs(
+                s3, FLAGS.s3_bucket, source_dir, dest_dir)
+        else:
+            files, size = dedup.link_outputs(source_dir, dest_dir)
+        num_files += files
+        num_bytes += size
+        if representative not in work_seconds:
+            try:
+                timings = json.loads(
+                    _read_input(os.path.join(source_dir, 'timings.json')))
+            except Exception as err:
+                logging.warning(f'Unable to read the timings of '
+                                f'{representative}: {err}')
+                timings = {}
+            work_seconds[representative] = dedup.work_seconds(timings)
+    summary = {
+        'deduplication': {
+            **dedup_summary,
+            'materialized_files': num_files,
+            'materialized_bytes': num_bytes,
+            # The time the duplicates would have taken, from the timings of
+            # the targets they are identical to.
+            'estimated_seconds_saved': sum(
+                work_seconds[representative]
+                for representative in dedup_summary['duplicates'].values()),
+        },
+    }
+    os.makedirs(_job_output_dir(), exist_ok=True)
+    summary_path = os.path.join(_job_output_dir(), 'batch_summary.json')
+    with open(summary_path, 'w') as f:
+        f.write(json.dumps(summary, indent=4))
+    logging.info(
+        f"Computed {dedup_summary['num_unique_targets']} unique targets of "
+        f"{dedup_summary['num_targets']}, saving an estimated "
+        f"{summary['deduplication']['estimated_seconds_saved']:.0f}s")
+    if FLAGS.s3_bucket is not None:
+        upload_data(summary_path, f"s3://{FLAGS.s3_bucket}/{_job_output_dir()}")
+
+
+def _write_resource_profile(sampler, fasta_paths, fasta_names, upload=False):
+    """Stops the resource sampler and writes resource_profile.json."""
+    sampler.stop()
+    # Number of residues of each target, for the recommendations by length.
+    target_lengths = {
+        fasta_name: (sum(len(sequence) for sequence in sequences)
+                     if sequences is not None else None)
+        for fasta_name, sequences in zip(
+            fasta_names, _read_fasta_files(fasta_paths))
+    }
+    profile = sampler.profile(
+        model_preset=FLAGS.model_preset,
+        db_preset=FLAGS.db_preset,
+        run_features_only=FLAGS.run_features_only or FLAGS.feature_workers > 0,
+        num_cpus=msa_search.available_cpus(),
+        target_lengths=target_lengths,
+    )
+    os.makedirs(_job_output_dir(), exist_ok=True)
+    profile_path = os.path.join(_job_output_dir(), 'resource_profile.json')
+    with open(profile_path, 'w') as f:
+        f.write(json.dumps(profile, indent=4))
+    job = profile['job'] or {}
+    logging.info(
+        f"Resource profile: {len(profile['samples'])} samples, "
+        f"p95 CPU {job.get('cpu_percent_p95', 0):.0f}%, "
+        f"peak PSS {job.get('pss_bytes_max', 0) / 1024 ** 3:.1f} GB")
+    if upload and FLAGS.s3_bucket is not None:
+        upload_data(profile_path, f"s3://{FLAGS.s3_bucket}/{_job_output_dir()}")
+
+
+def _feature_cache_context(run_multimer_system):
+    """Databases, tools and settings that cached features depend on."""
+    return feature_cache.pipeline_context(
+        database_paths={
+            flag_name: FLAGS[flag_name].value for flag_name in (
+                'uniref90_database_path', 'mgnify_database_path',
+                'bfd_database_path', 'small_bfd_database_path',
+                'uniclust30_database_path', 'uniprot_database_path',
+                'pdb70_database_path', 'pdb_seqres_database_path',
+                'template_mmcif_dir', 'obsolete_pdbs_path')},
+        binary_paths={
+            tool_name: FLAGS[f'{tool_name}_binary_path'].value
+            for tool_name in ('jackhmmer', 'hhblits', 'hhsearch',
+                              'hmmsearch', 'hmmbuild', 'kalign')},
+        db_preset=FLAGS.db_preset,
+        multimer=run_multimer_system,
+        max_template_date=FLAGS.max_template_date,
+        max_template_hits=MAX_TEMPLATE_HITS)
+
+
+def _database_paths(run_multimer_system, use_small_bfd):
+    """Sequence databases searched by the data pipeline, in search order."""
+    database_paths = [FLAGS.uniref90_database_path, FLAGS.mgnify_database_path]
+    if use_small_bfd:
+        database_paths.append(FLAGS.small_bfd_database_path)
+    else:
+        database_paths += [FLAGS.bfd_database_path,
+                           FLAGS.uniclust30_database_path]
+    if run_multimer_system:
+        database_paths += [FLAGS.pdb_seqres_database_path,
+                           FLAGS.uniprot_database_path]
+    else:
+        database_paths.append(FLAGS.pdb70_database_path)
+    return database_paths
+
+
+def _create_data_pipeline(run_multimer_system, use_small_bfd, msa_cpus=None):
+    """Data pipeline configured by the flags.
+
+    Returns:
+        tuple: The data pipeline, and the chain MSA pipeline it uses (None
+            unless --chain_msa_store is set).
+    """
     if run_multimer_system:
         template_searcher = hmmsearch.Hmmsearch(
             binary_path=FLAGS.hmmsearch_binary_path,
@@ -405,7 +1460,9 @@ def main(argv):
             release_dates_path=None,
             obsolete_pdbs_path=FLAGS.obsolete_pdbs_path)
 
-    monomer_data_pipeline = pipeline.DataPipeline(
+### ---------------------------------------------
+### Modified by AWS to run the independent searches concurrently
+    monomer_pipeline_kwargs = dict(
         jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
         hhblits_binary_path=FLAGS.hhblits_binary_path,
         uniref90_database_path=FLAGS.uniref90_database_path,
@@ -417,123 +1474,309 @@ def main(argv):
         template_featurizer=template_featurizer,
         use_small_bfd=use_small_bfd,
         use_precomputed_msas=FLAGS.use_precomputed_msas)
+    if FLAGS.concurrent_msa_search:
+        monomer_data_pipeline = msa_search.ConcurrentDataPipeline(
+            num_cpus=msa_cpus, **monomer_pipeline_kwargs)
+        logging.info(f'Splitting {monomer_data_pipeline.num_cpus} vCPUs '
+                     'between concurrent MSA searches')
+    else:
+        monomer_data_pipeline = pipeline.DataPipeline(
+            **monomer_pipeline_kwargs)
+### ---------------------------------------------
 
+    chain_pipeline = None
     if run_multimer_system:
-        num_predictions_per_model = FLAGS.num_multimer_predictions_per_model
-        data_pipeline = pipeline_multimer.DataPipeline(
+        multimer_pipeline_kwargs = dict(
             monomer_data_pipeline=monomer_data_pipeline,
             jackhmmer_binary_path=FLAGS.jackhmmer_binary_path,
             uniprot_database_path=FLAGS.uniprot_database_path,
             use_precomputed_msas=FLAGS.use_precomputed_msas)
+### ---------------------------------------------
+### Modified by AWS to search each chain once across multimer targets
+        if FLAGS.chain_msa_store is not None:
+            # main points --chain_msa_store at a directory of the job for
+            # --precompute_chains.
+            chain_pipeline = chain_store.ChainCachingDataPipeline(
+                feature_cache.open_store(FLAGS.chain_msa_store, client=s3),
+                _feature_cache_context(run_multimer_system),
+                **multimer_pipeline_kwargs)
+            data_pipeline = chain_pipeline
+        else:
+            data_pipeline = pipeline_multimer.DataPipeline(
+                **multimer_pipeline_kwargs)
+### ---------------------------------------------
     else:
-        num_predictions_per_model = 1
         data_pipeline = monomer_data_pipeline
 
-    model_runners = {}
-    model_names = config.MODEL_PRESETS[FLAGS.model_preset]
-    for model_name in model_names:
-        model_config = config.model_config(model_name)
-        if run_multimer_system:
-            model_config.model.num_ensemble_eval = num_ensemble
-        else:
-            model_config.data.eval.num_ensemble = num_ensemble
-        model_params = data.get_model_haiku_params(
-            model_name=model_name, data_dir=FLAGS.data_dir)
-        model_runner = model.RunModel(model_config, model_params)
-        for i in range(num_predictions_per_model):
-            model_runners[f'{model_name}_pred_{i}'] = model_runner
+### ---------------------------------------------
+### Modified by AWS to trace the stages of each target
+    if FLAGS.trace:
+        # ConcurrentDataPipeline records its own search spans.
+        msa_search.trace_data_pipeline(
+            data_pipeline, searches=not FLAGS.concurrent_msa_search)
+### ---------------------------------------------
 
-    logging.info('Have %d models: %s', len(model_runners),
-                list(model_runners.keys()))
+### ---------------------------------------------
+### Modified by AWS to reuse MSA and template search results across jobs
+    if FLAGS.feature_cache is not None:
+        data_pipeline = feature_cache.CachedDataPipeline(
+            data_pipeline,
+            feature_cache.open_store(FLAGS.feature_cache, client=s3),
+            _feature_cache_context(run_multimer_system))
+### ---------------------------------------------
 
-    if FLAGS.run_relax:
-        amber_relaxer = relax.AmberRelaxation(
-            max_iterations=RELAX_MAX_ITERATIONS,
-            tolerance=RELAX_ENERGY_TOLERANCE,
-            stiffness=RELAX_STIFFNESS,
-            exclude_residues=RELAX_EXCLUDE_RESIDUES,
-            max_outer_iterations=RELAX_MAX_OUTER_ITERATIONS,
-            use_gpu=FLAGS.use_gpu_relax)
-    else:
-        amber_relaxer = None
+    return data_pipeline, chain_pipeline
 
-    random_seed = FLAGS.random_seed
-    if random_seed is None:
-        random_seed = random.randrange(sys.maxsize // len(model_runners))
-    logging.info('Using random seed %d for the data pipeline', random_seed)
 
-    # Predict structure for each of the sequences.
-    for i, fasta_path in enumerate(FLAGS.fasta_paths):
-        fasta_name = fasta_names[i]
-### ---------------------------------------------
-### Modified by AWS to add support for 2-step jobs and data storage in S3.
+def _precompute_chains(chain_pipeline, fasta_paths, features_paths):
+    """Search each distinct chain of the targets without features once."""
+    paths = [fasta_path for fasta_path, features_path
+             in zip(fasta_paths, features_paths) if features_path is None]
+    # Unreadable targets fail on their own, when they are predicted.
+    fasta_sequences = {
+        fasta_path: sequences
+        for fasta_path, sequences in zip(paths, _read_fasta_files(paths))
+        if sequences is not None
+    }
+    chains = chain_store.unique_chains(fasta_sequences)
+    logging.info(f'Precomputing the MSAs of {len(chains)} distinct chains '
+                 f'of {len(fasta_sequences)} targets')
+    t_0 = time.time()
+    for sequence, paired in chains.items():
+        chain_pipeline.precompute_chain(sequence, paired=paired)
+    logging.info(f'Precomputed the chain MSAs in {time.time() - t_0:.1f}s')
 
-        # --------- Download files from S3 ---------------------------
-        if FLAGS.s3_bucket is not None:
-            s3_fasta_url = os.path.join(FLAGS.s3_bucket, fasta_path)
-            logging.info(
-                f"Downloading {fasta_path} from s3://{s3_fasta_url} to {fasta_path}"
-            )
-            try:
-                if not os.path.exists(os.path.dirname(fasta_path)):
-                    logging.info(f"Creating directory {os.path.dirname(fasta_path)}")
-                    os.makedirs(os.path.dirname(fasta_path))
-                s3.download_file(FLAGS.s3_bucket, fasta_path, fasta_path)
-            except BaseException as err:
-                logging.info(
-                    f"Unable to download {fasta_path} from s3://{s3_fasta_url} to {fasta_path}"
-                )
-                print(err)
-                continue
 
-        if FLAGS.features_paths is not None:
-            features_path = FLAGS.features_paths[i]
-            s3_features_url = os.path.join(FLAGS.s3_bucket, features_path)
-            logging.info(
-                f"Downloading {features_path} from s3://{s3_features_url} to {features_path}"
+def _run_feature_workers(fasta_paths, fasta_names, run_multimer_system,
+                         use_small_bfd):
+    """Computes the features of the targets in a pool of worker processes."""
+    msa_cpus = FLAGS.msa_cpus or msa_search.available_cpus()
+    logging.info(f'Featurizing {len(fasta_paths)} targets with '
+                 f'{FLAGS.feature_workers} workers')
+    worker_pool = feature_worker.FeatureWorkerPool(
+        _create_worker_pipeline,
+        # The workers share the chain store of the job, which main may have
+        # created.
+        (_worker_argv(), run_multimer_system, use_small_bfd,
+         max(1, msa_cpus // FLAGS.feature_workers)),
+        num_workers=FLAGS.feature_workers)
+    failed_targets = {}
+    t_0 = time.time()
+    try:
+        for (_, fasta_name), seconds, err in worker_pool.run(
+                _featurize_target, list(zip(fasta_paths, fasta_names))):
+            if err is not None:
+                logging.error(f'Unable to featurize {fasta_name}: {err}')
+                failed_targets[fasta_name] = str(err)
+            else:
+                logging.info(f'Featurized {fasta_name} in {seconds:.1f}s')
+    finally:
+        worker_pool.close(cancel_pending=True)
+    logging.info(f'Featurized {len(fasta_paths) - len(failed_targets)} of '
+                 f'{len(fasta_paths)} targets in {time.time() - t_0:.1f}s')
+    if failed_targets:
+        raise RuntimeError(
+            f'{len(failed_targets)} targets could not be featurized: '
+            f'{failed_targets}')
+
+
+def _worker_argv():
+    """Command line of the job, with the flags main sets itself."""
+    argv = list(sys.argv)
+    if FLAGS.chain_msa_store is not None:
+        argv.append(f'--chain_msa_store={FLAGS.chain_msa_store}')
+    return argv
+
+
+def _create_worker_pipeline(argv, run_multimer_system, use_small_bfd, msa_cpus):
+    """Data pipeline of a feature worker process."""
+    # Workers are spawned, so the flags of the job are parsed again.
+    FLAGS(argv)
+    data_pipeline, _ = _create_data_pipeline(
+        run_multimer_system, use_small_bfd, msa_cpus=msa_cpus)
+    return data_pipeline
+
+
+def _featurize_target(data_pipeline, fasta_path, fasta_name):
+    """Computes the features of a target in a feature worker and uploads them."""
+    if FLAGS.s3_bucket is not None:
+        os.makedirs(os.path.dirname(fasta_path) or '.', exist_ok=True)
+        s3.download_file(FLAGS.s3_bucket, fasta_path, fasta_path)
+    predict_structure(
+        fasta_path=fasta_path,
+        fasta_name=fasta_name,
+        output_dir_base=FLAGS.output_dir,
+        data_pipeline=data_pipeline,
+        model_runners={},
+        amber_relaxer=None,
+        benchmark=False,
+        random_seed=0,
+        run_features_only=True,
+        features_format=FLAGS.features_format,
+        trace_spans=FLAGS.trace,
+        trace_emf_namespace=FLAGS.trace_emf_namespace,
+        resume=FLAGS.resume,
+        fetch_output=_fetch_output,
+    )
+    if FLAGS.s3_bucket is not None:
+        output_dir = os.path.join(FLAGS.output_dir, fasta_name)
+        report = upload_data(
+            output_dir,
+            f"s3://{FLAGS.s3_bucket}/{output_dir}",
+            uploader=s3_transfer.S3Uploader(
+                client=s3,
+                max_workers=FLAGS.upload_max_workers,
+                multipart_chunksize_mb=FLAGS.upload_multipart_chunksize_mb,
+                max_attempts=FLAGS.upload_max_attempts,
+            ),
+        )
+        if report.failures:
+            raise RuntimeError(
+                f"{len(report.failures)} files could not be uploaded to "
+                f"s3://{FLAGS.s3_bucket}/{output_dir}"
             )
-            try:
-                if not os.path.exists(os.path.dirname(features_path)):
-                    logging.info(f"Creating directory {os.path.dirname(features_path)}")
-                    os.makedirs(os.path.dirname(features_path))
-                s3.download_file(FLAGS.s3_bucket, features_path, features_path)
+        # Keep the disk usage of long manifests bounded.
+        shutil.rmtree(output_dir)
+        os.remove(fasta_path)
 
+
+def _predict_all_targets(
+    fasta_paths,
+    fasta_names,
+    features_paths,
+    data_pipeline,
+    model_runners,
+    amber_relaxer,
+    random_seed,
+    on_output,
+    relax_workers,
+    relax_top_k,
+    length_buckets,
+    job_trace,
+    jax_cache_events=None,
+):
+    """Downloads the inputs for each target and predicts its structure."""
+
+### ---------------------------------------------
+### Modified by AWS to add support for 2-step jobs and data storage in S3.
+### Inputs are downloaded in the background, ahead of the target that is
+### being processed.
+
+    if FLAGS.s3_bucket is not None:
+        prefetch_targets = []
+        for fasta_path, fasta_name, features_path in zip(
+                fasta_paths, fasta_names, features_paths):
+            files = [prefetch.InputFile(fasta_path, fasta_path)]
+            if features_path is not None:
+                for path in features_store.storage_paths(features_path):
+                    files.append(prefetch.InputFile(path, path))
                 ### 5/27/2022: Also download timings.json
-                output_dir = os.path.join(FLAGS.output_dir, fasta_name)
-                timings_output_path = os.path.join(output_dir, "timings.json")
-                s3.download_file(FLAGS.s3_bucket, timings_output_path, timings_output_path)
-                ########################################
-
-            except BaseException as err:
-                logging.info(
-                    f"Unable to download {features_path} from s3://{s3_features_url} to {features_path}"
-                )
-                print(err)
-                continue
+                timings_output_path = os.path.join(
+                    FLAGS.output_dir, fasta_name, "timings.json")
+                files.append(prefetch.InputFile(
+                    timings_output_path, timings_output_path, required=False,
+                    keep=True))
+            prefetch_targets.append(prefetch.PrefetchTarget(fasta_name, files))
+        if FLAGS.prefetch_max_disk_gb is not None:
+            max_disk_bytes = int(FLAGS.prefetch_max_disk_gb * 1024 ** 3)
         else:
-            features_path = None
+            max_disk_bytes = None
+        prefetcher = prefetch.TargetPrefetcher(
+            s3,
+            FLAGS.s3_bucket,
+            prefetch_targets,
+            lookahead=FLAGS.prefetch_depth,
+            max_disk_bytes=max_disk_bytes,
+        )
+    else:
+        prefetcher = None
+
+    failed_targets = {}
+    compile_cache = bucketing.CompileCacheTracker()
+    model_major = FLAGS.schedule == 'model_major'
+    # Targets whose features are ready, for the model-major schedule.
+    featurized_targets = []
+    # Predict structure for each of the sequences.
+    with prefetcher or contextlib.nullcontext():
+        for i, fasta_path in enumerate(fasta_paths):
+            fasta_name = fasta_names[i]
+            features_path = features_paths[i]
+            if prefetcher is not None:
+                try:
+                    with job_trace.span('wait_for_inputs', target=fasta_name):
+                        prefetcher.wait(i)
+                except prefetch.PrefetchError as err:
+                    logging.error(f"Skipping {fasta_name}. {err}")
+                    failed_targets[fasta_name] = str(err)
+                    continue
 ### ---------------------------------------------
 
-        predict_structure(
-            fasta_path=fasta_path,
-            fasta_name=fasta_name,
-            output_dir_base=FLAGS.output_dir,
-            data_pipeline=data_pipeline,
-            model_runners=model_runners,
-            amber_relaxer=amber_relaxer,
-            benchmark=FLAGS.benchmark,
-            random_seed=random_seed,
-### ---------------------------------------------            
+            steps = predict_structure_steps(
+                fasta_path=fasta_path,
+                fasta_name=fasta_name,
+                output_dir_base=FLAGS.output_dir,
+                data_pipeline=data_pipeline,
+                model_runners=model_runners,
+                amber_relaxer=amber_relaxer,
+                benchmark=FLAGS.benchmark,
+                random_seed=random_seed,
+### ---------------------------------------------
 ### Modified by AWS to add support for 2-step jobs.
-            features_path=features_path,
-            run_features_only=FLAGS.run_features_only            
+                features_path=features_path,
+                run_features_only=FLAGS.run_features_only,
+                features_format=FLAGS.features_format,
+                output_profile=FLAGS.output_profile,
+                on_output=on_output,
+                relax_workers=relax_workers,
+                relax_top_k=relax_top_k,
+                length_buckets=length_buckets,
+                compile_cache=compile_cache,
+                jax_cache_events=jax_cache_events,
+                release_params=(FLAGS.release_params_after_use
+                                and not model_major
+                                and i == len(fasta_paths) - 1),
+                trace_spans=FLAGS.trace,
+                trace_emf_namespace=FLAGS.trace_emf_namespace,
+                track_stages=FLAGS.resource_profile,
+                resume=FLAGS.resume,
+                fetch_output=_fetch_output,
+            )
+            if model_major:
+                # Compute the features now, the models run once the features
+                # of all targets are ready.
+                if scheduling.advance(steps):
+                    featurized_targets.append(steps)
+            else:
+                scheduling.run_to_completion(steps)
+            if prefetcher is not None:
+                prefetcher.release(i)
+
+    if featurized_targets:
+        # Prediction slot in which each model runs for the last time.
+        last_slots = {id(runner): name for name, runner in model_runners.items()}
+
+        def release_finished_models(model_names):
+            # Each round runs one prediction slot on all targets.
+            for model_name in set(model_names):
+                model_runner = model_runners[model_name]
+                if (FLAGS.release_params_after_use
+                        and isinstance(model_runner, lazy_params.LazyRunModel)
+                        and last_slots[id(model_runner)] == model_name):
+                    model_runner.release()
+
+        scheduling.run_model_major(
+            featurized_targets, on_round_end=release_finished_models)
+
+    logging.info(
+        f"Compile cache: {compile_cache.hits} hits, "
+        f"{compile_cache.misses} misses"
+    )
+    if failed_targets:
+        raise RuntimeError(
+            f"The inputs of {len(failed_targets)} targets could not be "
+            f"downloaded: {failed_targets}"
         )
 
-    # ---- Upload results back to s3 -----------------------
-    if FLAGS.s3_bucket is not None:
-        logging.info(f"Uploading {FLAGS.output_dir} to {FLAGS.s3_bucket}")
-        upload_data(FLAGS.output_dir, f"s3://{FLAGS.s3_bucket}/{FLAGS.output_dir}")
-    # ----------------------------
 
 def parse_s3_url(url):
     """Returns an (s3 bucket, key name/prefix) tuple from a url with an s3 scheme. (From SageMaker s3 utils)
@@ -551,7 +1794,7 @@ def parse_s3_url(url):
         )
     return parsed_url.netloc, parsed_url.path.lstrip("/")
 
-def upload_data(path, desired_s3_uri, s3=boto3.client("s3"), extra_args=None):
+def upload_data(path, desired_s3_uri, uploader=None, extra_args=None):
     """Upload local file or directory to S3. (From SageMaker Session)
     If a single file is specified for upload, the resulting S3 object key is
     ``{key_prefix}/{filename}`` (filename does not include the local path, if any specified).
@@ -561,22 +1804,19 @@ def upload_data(path, desired_s3_uri, s3=boto3.client("s3"), extra_args=None):
     Args:
         path (str): Path (absolute or relative) of local file or directory to upload.
         desired_s3_uri (str): Name of the S3 Bucket to upload to, plus the object key.
-        s3 (boto3 object): S3 client.
+        uploader (s3_transfer.S3Uploader): Concurrent uploader. One that uses the
+            shared S3 client is created if omitted.
         extra_args (dict): Optional extra arguments that may be passed to the upload operation.
             Similar to ExtraArgs parameter in S3 upload_file function. Please refer to the
             ExtraArgs parameter documentation here:
             https://boto3.amazonaws.com/v1/documentation/api/latest/guide/s3-uploading-files.html#the-extraargs-parameter
     Returns:
-        str: The S3 URI of the uploaded file(s). If a file is specified in the path argument,
-            the URI format is: ``s3://{bucket name}/{key_prefix}/{original_file_name}``.
-            If a directory is specified in the path argument, the URI format is
-            ``s3://{bucket name}/{key_prefix}``.
+        s3_transfer.UploadReport: Per-file results, failures and total throughput.
     """
     # Generate a tuple for each file that we want to upload of the form (local_path, s3_key).
     bucket, key_prefix = parse_s3_url(url=desired_s3_uri)
 
     files = []
-    key_suffix = None
     if os.path.isdir(path):
         for dirpath, _, filenames in os.walk(path):
             for name in filenames:
@@ -592,23 +1832,14 @@ def upload_data(path, desired_s3_uri, s3=boto3.client("s3"), extra_args=None):
         _, name = os.path.split(path)
         s3_key = "{}/{}".format(key_prefix, name)
         files.append((path, s3_key))
-        key_suffix = name
-
-    for local_path, s3_key in files:
-        s3.upload_file(local_path, bucket, s3_key, ExtraArgs=extra_args)
 
-    s3_uri = "s3://{}/{}".format(bucket, key_prefix)
-    # If a specific file was used as input (instead of a directory), we return the full S3 key
-    # of the uploaded object. This prevents unintentionally using other files under the same
-    # prefix during training.
-    if key_suffix:
-        s3_uri = "{}/{}".format(s3_uri, key_suffix)
-    return
+    if uploader is None:
+        uploader = s3_transfer.S3Uploader(client=s3)
+    return uploader.upload_files(files, bucket, extra_args=extra_args)
 ### ---------------------------------------------
 
 if __name__ == '__main__':
     flags.mark_flags_as_required([
-            'fasta_paths',
             'output_dir',
             'data_dir',
             'uniref90_database_path',
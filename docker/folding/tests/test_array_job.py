@@ -0,0 +1,31 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+
+import pytest
+
+from foldhelpers import array_job
+
+MANIFEST = json.dumps({"shards": [["a.fasta", "b.fasta"], ["c.fasta"]]})
+
+
+def test_array_index_of_child_job(monkeypatch):
+    monkeypatch.setenv(array_job.ARRAY_INDEX_ENV, "1")
+
+    assert array_job.array_index() == 1
+    assert array_job.read_shard(MANIFEST, array_job.array_index()) == [
+        "c.fasta"]
+
+
+def test_array_index_outside_of_array_job(monkeypatch):
+    monkeypatch.delenv(array_job.ARRAY_INDEX_ENV, raising=False)
+
+    assert array_job.array_index() == 0
+    assert array_job.read_shard(MANIFEST, array_job.array_index()) == [
+        "a.fasta", "b.fasta"]
+
+
+def test_read_shard_out_of_range():
+    with pytest.raises(ValueError, match="out of range"):
+        array_job.read_shard(MANIFEST, 2)
@@ -0,0 +1,69 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import shutil
+
+import numpy as np
+
+from foldhelpers import checkpoint
+from foldhelpers import features_store
+
+
+def _save_features(output_dir):
+    feature_dict = {
+        "aatype": np.eye(21, dtype=np.int32)[:8],
+        "msa": np.arange(32, dtype=np.int32).reshape(4, 8),
+        "domain_name": np.array([b"target"], dtype=np.object_),
+    }
+    return features_store.save_features(
+        feature_dict, os.path.join(output_dir, "features"), "npy")
+
+
+def test_stage_with_directory_records_its_files(tmp_path):
+    target_checkpoint = checkpoint.TargetCheckpoint(str(tmp_path))
+    target_checkpoint.record("features", _save_features(str(tmp_path)),
+                             timings={"features": 1.0})
+
+    resumed = checkpoint.TargetCheckpoint(str(tmp_path))
+
+    assert sorted(resumed._manifest["target"]["features"]["files"]) == sorted(
+        os.path.join("features", name)
+        for name in os.listdir(tmp_path / "features"))
+    assert resumed.completed("features") == {"timings": {"features": 1.0}}
+
+
+def test_modified_file_in_directory_runs_stage_again(tmp_path):
+    target_checkpoint = checkpoint.TargetCheckpoint(str(tmp_path))
+    target_checkpoint.record("features", _save_features(str(tmp_path)))
+    np.save(tmp_path / "features" / "msa.npy", np.zeros((4, 8), np.int32))
+
+    resumed = checkpoint.TargetCheckpoint(str(tmp_path))
+
+    assert resumed.completed("features") is None
+
+
+def test_missing_files_are_fetched(tmp_path):
+    output_dir = tmp_path / "output"
+    saved_dir = tmp_path / "s3"
+    target_checkpoint = checkpoint.TargetCheckpoint(str(output_dir))
+    target_checkpoint.record("features", _save_features(str(output_dir)))
+    shutil.move(str(output_dir), str(saved_dir))
+    fetched = []
+
+    def fetch(path):
+        saved_path = saved_dir / os.path.relpath(path, output_dir)
+        if not saved_path.exists():
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(saved_path, path)
+        fetched.append(os.path.relpath(path, output_dir))
+        return True
+
+    resumed = checkpoint.TargetCheckpoint(str(output_dir), fetch=fetch)
+
+    assert resumed.completed("features") == {}
+    assert sorted(fetched) == sorted(
+        [checkpoint.MANIFEST_NAME]
+        + [os.path.join("features", name)
+           for name in os.listdir(saved_dir / "features")])
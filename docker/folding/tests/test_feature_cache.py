@@ -0,0 +1,22 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+from foldhelpers import dedup
+from foldhelpers import feature_cache
+
+
+def test_cache_key_matches_deduplication():
+    context = {"cache_version": feature_cache.CACHE_VERSION}
+    sequences = [["MKV LLA*"], ["mkvlla"], ["MKVLLA\n"]]
+
+    keys = {feature_cache.cache_key(seqs, context) for seqs in sequences}
+
+    assert len(keys) == 1
+    assert dedup.group_targets(sequences) == [0, 0, 0]
+
+
+def test_cache_key_depends_on_chain_order():
+    context = {"cache_version": feature_cache.CACHE_VERSION}
+
+    assert (feature_cache.cache_key(["MKV", "LLA"], context)
+            != feature_cache.cache_key(["LLA", "MKV"], context))
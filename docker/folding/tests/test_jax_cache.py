@@ -0,0 +1,42 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+from foldhelpers import jax_cache
+
+
+def test_evict_removes_least_recently_used_files(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"executable_{i}"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (1000 + i, 1000 + i))
+    # Loaded by a recent job.
+    os.utime(tmp_path / "executable_0", (2000, 1000))
+
+    removed_bytes = jax_cache.evict(str(tmp_path), max_bytes=250)
+
+    assert removed_bytes == 300
+    assert sorted(os.listdir(tmp_path)) == ["executable_0", "executable_4"]
+
+
+def test_evict_keeps_a_cache_under_the_cap(tmp_path):
+    (tmp_path / "executable").write_bytes(b"x" * 100)
+
+    assert jax_cache.evict(str(tmp_path), max_bytes=100) == 0
+    assert os.listdir(tmp_path) == ["executable"]
+
+
+def test_cache_events_count_this_process_only():
+    events = jax_cache.CacheEvents()
+    events.available = True
+    before = events.counts()
+    assert events.loaded_since(before) is None
+
+    events._on_event("/jax/compilation_cache/cache_hits")
+    assert events.loaded_since(before) is True
+
+    before = events.counts()
+    events._on_event("/jax/compilation_cache/cache_misses")
+    events._on_event("/jax/compilation_cache/compile_requests_use_cache")
+    assert events.loaded_since(before) is False
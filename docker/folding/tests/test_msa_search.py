@@ -0,0 +1,129 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import stat
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alphafold")
+from alphafold.data import pipeline
+from alphafold.data import templates
+from alphafold.data.tools import hhsearch
+from alphafold.data.tools import jackhmmer
+
+from foldhelpers import msa_search
+
+CPU_SECONDS = 0.2
+
+# Stands in for jackhmmer, hhblits and hhsearch: spends CPU_SECONDS of CPU
+# time and writes hits that are rotations of the query.
+STUB_TOOL = '''#!{python}
+import sys, time
+
+args = sys.argv[1:]
+def value(option):
+    return args[args.index(option) + 1] if option in args else None
+
+start = time.process_time()
+while time.process_time() - start < {cpu_seconds}:
+    pass
+query_path = value("-i") or args[-2]
+lines = [line.strip() for line in open(query_path) if line.strip()]
+query = ""
+for line in lines[1:]:
+    if line.startswith(">"):
+        break
+    query += line
+hits = [query[i:] + query[:i] for i in range(1, 4)]
+if value("-A"):
+    with open(value("-A"), "w") as f:
+        f.write("# STOCKHOLM 1.0\\n\\n")
+        for i, sequence in enumerate([query] + hits):
+            f.write(f"{{'query' if i == 0 else f'hit_{{i}}/1-{{len(query)}}':<20}}{{sequence}}\\n")
+        f.write(f"{{'#=GC RF':<20}}{{'x' * len(query)}}\\n//\\n")
+elif value("-oa3m"):
+    with open(value("-oa3m"), "w") as f:
+        f.write(f">query\\n{{query}}\\n")
+        for i, hit in enumerate(hits):
+            f.write(f">hit_{{i}}\\n{{hit}}\\n")
+else:
+    with open(value("-o"), "w") as f:
+        f.write(f"Query         query\\nMatch_columns {{len(query)}}\\nNo_of_seqs    1\\n")
+'''
+
+
+@pytest.fixture
+def pipeline_kwargs(tmp_path):
+    tool_path = tmp_path / "stub_tool"
+    tool_path.write_text(
+        STUB_TOOL.format(python=sys.executable, cpu_seconds=CPU_SECONDS))
+    tool_path.chmod(tool_path.stat().st_mode | stat.S_IEXEC)
+    databases = {}
+    for name in ("uniref90.fasta", "mgnify.fa", "bfd", "uniclust30", "pdb70"):
+        # jackhmmer databases are files, hh-suite ones are prefixes.
+        for path in (tmp_path / name, tmp_path / f"{name}_a3m.ffdata"):
+            path.touch()
+        databases[name] = str(tmp_path / name)
+    mmcif_dir = tmp_path / "mmcif"
+    mmcif_dir.mkdir()
+    (mmcif_dir / "1abc.cif").touch()
+    return dict(
+        jackhmmer_binary_path=str(tool_path),
+        hhblits_binary_path=str(tool_path),
+        uniref90_database_path=databases["uniref90.fasta"],
+        mgnify_database_path=databases["mgnify.fa"],
+        bfd_database_path=databases["bfd"],
+        uniclust30_database_path=databases["uniclust30"],
+        small_bfd_database_path=None,
+        template_searcher=hhsearch.HHSearch(
+            binary_path=str(tool_path), databases=[databases["pdb70"]]),
+        template_featurizer=templates.HhsearchHitFeaturizer(
+            mmcif_dir=str(mmcif_dir),
+            max_template_date="2022-01-01",
+            max_hits=20,
+            kalign_binary_path=str(tool_path),
+            release_dates_path=None,
+            obsolete_pdbs_path=None),
+        use_small_bfd=False)
+
+
+def _process(data_pipeline, tmp_path, name):
+    fasta_path = tmp_path / "query.fasta"
+    fasta_path.write_text(">query\nMKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEK\n")
+    msa_output_dir = tmp_path / name
+    msa_output_dir.mkdir()
+    return data_pipeline.process(
+        input_fasta_path=str(fasta_path), msa_output_dir=str(msa_output_dir))
+
+
+def test_concurrent_pipeline_matches_serial_pipeline(pipeline_kwargs, tmp_path):
+    serial_features = _process(
+        pipeline.DataPipeline(**pipeline_kwargs), tmp_path, "serial")
+    concurrent_features = _process(
+        msa_search.ConcurrentDataPipeline(num_cpus=4, **pipeline_kwargs),
+        tmp_path, "concurrent")
+
+    assert serial_features.keys() == concurrent_features.keys()
+    for name in serial_features:
+        np.testing.assert_array_equal(
+            serial_features[name], concurrent_features[name])
+
+
+def test_concurrent_pipeline_times_each_search(pipeline_kwargs, tmp_path):
+    data_pipeline = msa_search.ConcurrentDataPipeline(
+        num_cpus=4, **pipeline_kwargs)
+
+    _process(data_pipeline, tmp_path, "msas")
+
+    for search in ("uniref90", "mgnify", "bfd_uniclust", "pdb_templates"):
+        cpu_time = data_pipeline.last_timings[f"{search}_search_cpu"]
+        wall_time = data_pipeline.last_timings[f"{search}_search_wall"]
+        assert CPU_SECONDS <= cpu_time < CPU_SECONDS + 5.0
+        assert wall_time >= CPU_SECONDS
+    # The runners of AlphaFold are left as they are.
+    assert jackhmmer.subprocess is subprocess
+    assert data_pipeline.jackhmmer_uniref90_runner.binary_path == (
+        pipeline_kwargs["jackhmmer_binary_path"])
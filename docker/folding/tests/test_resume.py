@@ -0,0 +1,149 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import multiprocessing
+import os
+import pickle
+import signal
+
+import numpy as np
+import pytest
+
+pytest.importorskip("alphafold")
+import run_aws_alphafold
+from alphafold.common import protein
+from foldhelpers import scheduling
+
+TARGET_NAME = "target"
+NUM_MODELS = 5
+
+
+class StubModelRunner:
+    multimer_mode = False
+
+    def __init__(self, name, predicted, kill=False):
+        self.name = name
+        # Names of the models that this attempt predicted.
+        self.predicted = predicted
+        self.kill = kill
+
+    def process_features(self, raw_features, random_seed):
+        return {
+            "aatype": raw_features["aatype"].argmax(axis=-1)[None],
+            "residue_index": raw_features["residue_index"][None],
+        }
+
+    def predict(self, feat, random_seed):
+        if self.kill:
+            # Like a reclaimed Spot instance.
+            os.kill(os.getpid(), signal.SIGKILL)
+        self.predicted.append(self.name)
+        num_res = feat["aatype"].shape[-1]
+        rng = np.random.default_rng(random_seed)
+        plddt = rng.uniform(50, 90, num_res)
+        return {
+            "plddt": plddt,
+            "ranking_confidence": float(plddt.mean()),
+            "structure_module": {
+                "final_atom_positions": rng.standard_normal((num_res, 37, 3)),
+                "final_atom_mask": np.ones((num_res, 37)),
+            },
+        }
+
+
+class StubRelaxer:
+
+    def process(self, *, prot):
+        return protein.to_pdb(prot), None, None
+
+
+class StubDataPipeline:
+    """Returns the features of `features_path`, and counts its calls."""
+
+    def __init__(self, features_path, processed):
+        self.features_path = features_path
+        self.processed = processed
+
+    def process(self, input_fasta_path, msa_output_dir):
+        self.processed.append(input_fasta_path)
+        with open(self.features_path, "rb") as f:
+            return pickle.load(f)
+
+
+def write_features(path, num_res):
+    rng = np.random.default_rng(0)
+    with open(path, "wb") as f:
+        pickle.dump({
+            "aatype": np.eye(21)[rng.integers(0, 20, num_res)],
+            "residue_index": np.arange(num_res),
+        }, f)
+
+
+def run_attempt(output_dir, features_path, features_format="pkl",
+                kill_at_model=None):
+    """Featurize and predict the target.
+
+    Returns:
+        tuple: Whether the features were computed, and the names of the
+            models that were predicted.
+    """
+    processed = []
+    predicted = []
+    model_runners = {
+        f"model_{i}": StubModelRunner(f"model_{i}", predicted,
+                                      kill=i == kill_at_model)
+        for i in range(1, NUM_MODELS + 1)
+    }
+    scheduling.run_to_completion(run_aws_alphafold.predict_structure_steps(
+        fasta_path="target.fasta",
+        fasta_name=TARGET_NAME,
+        output_dir_base=output_dir,
+        data_pipeline=StubDataPipeline(features_path, processed),
+        model_runners=model_runners,
+        amber_relaxer=StubRelaxer(),
+        benchmark=False,
+        random_seed=0,
+        features_format=features_format,
+        resume=True,
+    ))
+    return bool(processed), predicted
+
+
+def ranked_outputs(output_dir):
+    target_dir = os.path.join(output_dir, TARGET_NAME)
+    with open(os.path.join(target_dir, "ranking_debug.json")) as f:
+        outputs = {"ranking_debug.json": json.load(f)}
+    for name in sorted(os.listdir(target_dir)):
+        if name.startswith("ranked_"):
+            with open(os.path.join(target_dir, name)) as f:
+                outputs[name] = f.read()
+    return outputs
+
+
+@pytest.mark.parametrize("features_format", ["pkl", "npz", "npy"])
+def test_killed_attempt_resumes_unfinished_models(tmp_path, features_format):
+    features_path = str(tmp_path / "features.pkl")
+    write_features(features_path, num_res=32)
+    uninterrupted_dir = str(tmp_path / "uninterrupted")
+    run_attempt(uninterrupted_dir, features_path)
+
+    # The first attempt is killed while it predicts model_3.
+    resumed_dir = str(tmp_path / "resumed")
+    attempt = multiprocessing.get_context("spawn").Process(
+        target=run_attempt,
+        args=(resumed_dir, features_path, features_format, 3))
+    attempt.start()
+    attempt.join()
+    assert attempt.exitcode == -signal.SIGKILL
+    # The PDB of model_1 no longer matches the checkpoint.
+    with open(os.path.join(resumed_dir, TARGET_NAME,
+                           "unrelaxed_model_1.pdb"), "a") as f:
+        f.write("REMARK modified after the checkpoint\n")
+
+    processed, predicted = run_attempt(resumed_dir, features_path,
+                                       features_format)
+
+    assert not processed
+    assert sorted(predicted) == ["model_1", "model_3", "model_4", "model_5"]
+    assert ranked_outputs(resumed_dir) == ranked_outputs(uninterrupted_dir)
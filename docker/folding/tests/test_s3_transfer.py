@@ -0,0 +1,154 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+
+import pytest
+
+from foldhelpers import s3_transfer
+
+
+class FlakyClient:
+    """Client whose first `num_failures` upload_file calls fail."""
+
+    def __init__(self, client, num_failures):
+        self.client = client
+        self.num_failures = num_failures
+
+    def upload_file(self, *args, **kwargs):
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise ConnectionError("connection reset")
+        return self.client.upload_file(*args, **kwargs)
+
+
+def _write(path, num_bytes):
+    with open(path, "wb") as f:
+        f.write(os.urandom(num_bytes))
+    return path
+
+
+def _read(client, key):
+    return client.get_object(Bucket="bucket", Key=key)["Body"].read()
+
+
+def test_upload_file_multipart(s3_client, tmp_path):
+    path = _write(tmp_path / "result_model_1.pkl", 12 * s3_transfer.MB)
+    uploader = s3_transfer.S3Uploader(
+        client=s3_client, multipart_chunksize_mb=5, backoff_seconds=0)
+
+    result = uploader.upload_file(str(path), "bucket", "job/result_model_1.pkl")
+
+    assert result.num_bytes == 12 * s3_transfer.MB
+    assert result.attempts == 1
+    assert _read(s3_client, "job/result_model_1.pkl") == path.read_bytes()
+    # Multipart ETags end with the number of parts.
+    etag = s3_client.head_object(
+        Bucket="bucket", Key="job/result_model_1.pkl")["ETag"]
+    assert etag.strip('"').endswith("-3")
+
+
+def test_upload_file_retries_transient_errors(s3_client, tmp_path):
+    path = _write(tmp_path / "ranked_0.pdb", 1024)
+    uploader = s3_transfer.S3Uploader(
+        client=FlakyClient(s3_client, num_failures=2), backoff_seconds=0)
+
+    result = uploader.upload_file(str(path), "bucket", "job/ranked_0.pdb")
+
+    assert result.attempts == 3
+    assert _read(s3_client, "job/ranked_0.pdb") == path.read_bytes()
+
+
+def test_upload_file_raises_after_max_attempts(s3_client, tmp_path):
+    path = _write(tmp_path / "ranked_0.pdb", 1024)
+    uploader = s3_transfer.S3Uploader(
+        client=FlakyClient(s3_client, num_failures=3), max_attempts=3,
+        backoff_seconds=0)
+
+    with pytest.raises(ConnectionError):
+        uploader.upload_file(str(path), "bucket", "job/ranked_0.pdb")
+
+
+def test_upload_files_reports_failures(s3_client, tmp_path):
+    files = [
+        (str(_write(tmp_path / f"ranked_{i}.pdb", 1024)), f"job/ranked_{i}.pdb")
+        for i in range(4)
+    ]
+    files.append((str(tmp_path / "missing.pdb"), "job/missing.pdb"))
+    uploader = s3_transfer.S3Uploader(
+        client=s3_client, max_workers=2, max_attempts=2, backoff_seconds=0)
+
+    report = uploader.upload_files(files, "bucket")
+
+    assert sorted(r.s3_key for r in report.results) == [
+        f"job/ranked_{i}.pdb" for i in range(4)]
+    assert report.num_bytes == 4 * 1024
+    assert [(path, key) for path, key, _ in report.failures] == [files[-1]]
+    assert isinstance(report.failures[0][2], OSError)
+
+
+def _background_uploader(client, local_root):
+    uploader = s3_transfer.S3Uploader(
+        client=client, max_workers=2, backoff_seconds=0)
+    return s3_transfer.BackgroundUploader(
+        uploader, "bucket", str(local_root), "job")
+
+
+def test_background_uploader_uploads_last_version(s3_client, tmp_path):
+    background_uploader = _background_uploader(s3_client, tmp_path)
+    path = tmp_path / "target" / "checkpoint.json"
+    path.parent.mkdir()
+    for i in range(20):
+        path.write_text(f'{{"version": {i}}}')
+        os.utime(path, ns=(i, i))
+        background_uploader.submit(str(path))
+
+    report = background_uploader.close()
+
+    assert not report.failures
+    assert _read(s3_client, "job/target/checkpoint.json") == b'{"version": 19}'
+    assert not os.path.exists(background_uploader._staging_dir)
+
+
+def test_background_uploader_copies_only_rewritten_files(
+        s3_client, tmp_path, monkeypatch):
+    copied = []
+    copyfile = s3_transfer.shutil.copyfile
+    monkeypatch.setattr(s3_transfer.shutil, "copyfile",
+                        lambda src, dst: copied.append(src) or copyfile(src, dst))
+    background_uploader = _background_uploader(s3_client, tmp_path)
+    target_dir = tmp_path / "target"
+    target_dir.mkdir()
+    pdb_path = _write(target_dir / "ranked_0.pdb", 1024)
+    timings_path = target_dir / "timings.json"
+    timings_path.write_text("{}")
+
+    background_uploader.submit(str(target_dir))
+    # Unchanged files are not uploaded again.
+    background_uploader.submit(str(target_dir))
+    report = background_uploader.close()
+
+    assert copied == [str(timings_path)]
+    assert sorted(r.local_path for r in report.results) == sorted(
+        [str(pdb_path), str(timings_path)])
+    assert _read(s3_client, "job/target/ranked_0.pdb") == pdb_path.read_bytes()
+
+
+def test_background_uploader_retries_failed_copies(
+        s3_client, tmp_path, monkeypatch):
+    background_uploader = _background_uploader(s3_client, tmp_path)
+    path = tmp_path / "timings.json"
+    path.write_text('{"features": 1.0}')
+
+    def fail(src, dst):
+        raise OSError("No space left on device")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(s3_transfer.shutil, "copyfile", fail)
+        with pytest.raises(OSError):
+            background_uploader.submit(str(path))
+    background_uploader.submit(str(path))
+    report = background_uploader.close()
+
+    assert [r.local_path for r in report.results] == [str(path)]
+    assert _read(s3_client, "job/timings.json") == b'{"features": 1.0}'
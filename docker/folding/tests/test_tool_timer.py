@@ -0,0 +1,49 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import stat
+import subprocess
+import sys
+
+from foldhelpers import tool_timer
+
+BUSY_TOOL = '''#!{python}
+import sys, time
+start = time.process_time()
+while time.process_time() - start < float(sys.argv[1]):
+    pass
+print("searched", *sys.argv[2:])
+sys.exit(int(sys.argv[2]))
+'''
+
+
+def _write_tool(tmp_path):
+    path = tmp_path / "busy_tool"
+    path.write_text(BUSY_TOOL.format(python=sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_wrapper_records_cpu_time_of_each_run(tmp_path):
+    usage_path = str(tmp_path / "search.cpu")
+    wrapper = tool_timer.wrap(_write_tool(tmp_path), usage_path)
+
+    for _ in range(2):
+        process = subprocess.run([wrapper, "0.2", "0", "a b"],
+                                 capture_output=True, text=True)
+        assert process.returncode == 0
+        assert process.stdout == "searched 0 a b\n"
+
+    assert 0.4 <= tool_timer.read_cpu_time(usage_path) < 5.0
+
+
+def test_wrapper_returns_exit_status_of_tool(tmp_path):
+    usage_path = str(tmp_path / "search.cpu")
+    wrapper = tool_timer.wrap(_write_tool(tmp_path), usage_path)
+
+    assert subprocess.run([wrapper, "0", "3"]).returncode == 3
+    assert tool_timer.read_cpu_time(usage_path) >= 0.0
+
+
+def test_read_cpu_time_without_runs(tmp_path):
+    assert tool_timer.read_cpu_time(str(tmp_path / "search.cpu")) == 0.0
@@ -0,0 +1,75 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+import threading
+import time
+
+from foldhelpers import tracing
+
+
+def _spans(path):
+    with open(path) as f:
+        return {span["name"]: span for span in map(json.loads, f)}
+
+
+def _busy(seconds):
+    start = time.thread_time()
+    while time.thread_time() - start < seconds:
+        pass
+
+
+def test_concurrent_spans_measure_their_own_thread(tmp_path):
+    trace = tracing.Trace(str(tmp_path / "trace.jsonl"), target="target")
+
+    def run(name, cpu_seconds):
+        with trace.span(name):
+            _busy(cpu_seconds)
+
+    threads = [threading.Thread(target=run, args=("busy", 0.3)),
+               threading.Thread(target=run, args=("idle", 0.0))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    trace.close()
+
+    spans = _spans(tmp_path / "trace.jsonl")
+    assert spans["busy"]["cpu_sec"] >= 0.25
+    assert spans["idle"]["cpu_sec"] < 0.1
+    # The busy thread is not counted in the root span of the main thread.
+    assert spans["target"]["cpu_sec"] < 0.1
+
+
+def test_peak_memory_of_spans_comes_from_samples(tmp_path):
+    trace = tracing.Trace(str(tmp_path / "trace.jsonl"))
+
+    with trace.span("outer"):
+        tracing.add_memory_sample(100)
+        with trace.span("inner"):
+            tracing.add_memory_sample(300)
+        tracing.add_memory_sample(200)
+        with trace.span("unsampled"):
+            pass
+    trace.close()
+
+    spans = _spans(tmp_path / "trace.jsonl")
+    assert spans["outer"]["peak_pss_bytes"] == 300
+    assert spans["inner"]["peak_pss_bytes"] == 300
+    assert "peak_pss_bytes" not in spans["unsampled"]
+    assert spans["job"]["peak_pss_bytes"] == 300
+
+
+def test_trace_without_file_only_tracks_stages(monkeypatch):
+    def fail():
+        raise AssertionError("counters read without a trace file")
+
+    monkeypatch.setattr(tracing, "_cpu_seconds", fail)
+    monkeypatch.setattr(tracing, "_io_counters", fail)
+    trace = tracing.Trace(None, target="target")
+
+    with trace.span("features"):
+        assert tracing.current_stage() == ("target", "features")
+    trace.close()
+
+    assert tracing.current_stage() is None
@@ -0,0 +1,135 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare the time and peak memory of reading large MSAs with msa_arrays and with
+the previous Biopython path of nbhelpers.reduce_stockholm_file.
+
+Generates a Stockholm file (in --num_blocks blocks, like those written by
+jackhmmer) and the equivalent A3M file, then checks that every reader returns
+the same residues in the query's columns.
+
+Usage:
+    python benchmarks/benchmark_msa_parser.py --num_sequences 20000 --query_length 800
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from Bio import AlignIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nbhelpers import msa_arrays
+
+RESIDUES = np.frombuffer(b"ACDEFGHIKLMNPQRSTVWY", dtype=np.uint8)
+
+
+def make_alignment(num_sequences, query_length, gap_fraction, rng):
+    """Aligned rows (uint8) and the columns where the query has a residue."""
+    # Columns where the query has a gap hold the insertions of the hits.
+    num_columns = int(query_length / (1 - gap_fraction))
+    query_columns = np.sort(
+        rng.choice(num_columns, size=query_length, replace=False))
+    rows = RESIDUES[rng.integers(0, len(RESIDUES), (num_sequences, num_columns))]
+    rows[rng.random(rows.shape) < gap_fraction] = msa_arrays.GAP
+    # Like HMMER, the query has "." in the insert columns, and some "-" too.
+    rows[0] = np.where(rng.random(num_columns) < 0.5,
+                       msa_arrays.INSERT_GAP, msa_arrays.GAP)
+    rows[0, query_columns] = RESIDUES[
+        rng.integers(0, len(RESIDUES), query_length)]
+    return rows, query_columns
+
+
+def write_stockholm(path, rows, num_blocks):
+    names = [f"hit_{i}/1-{rows.shape[1]}".encode() for i in range(len(rows))]
+    width = max(len(name) for name in names) + 1
+    with open(path, "wb") as f:
+        f.write(b"# STOCKHOLM 1.0\n\n")
+        for i, name in enumerate(names):
+            f.write(b"#=GS " + name + b" DE generated hit\n")
+        for columns in np.array_split(np.arange(rows.shape[1]), num_blocks):
+            f.write(b"\n")
+            for name, row in zip(names, rows[:, columns]):
+                f.write(name.ljust(width) + row.tobytes() + b"\n")
+        f.write(b"//\n")
+
+
+def write_a3m(path, rows, query_columns):
+    # Residues in the query's gap columns are insertions, in lower case.
+    insertions = np.ones(rows.shape[1], dtype=bool)
+    insertions[query_columns] = False
+    a3m_rows = rows.copy()
+    a3m_rows[:, insertions] = np.where(
+        np.isin(a3m_rows[:, insertions], [msa_arrays.GAP, msa_arrays.INSERT_GAP]),
+        0, a3m_rows[:, insertions] + (ord("a") - ord("A")))
+    with open(path, "wb") as f:
+        for i, row in enumerate(a3m_rows):
+            f.write(f">hit_{i}\n".encode() + row[row != 0].tobytes() + b"\n")
+
+
+def read_biopython(path):
+    """The previous nbhelpers.reduce_stockholm_file, with insert gaps masked."""
+    msa = AlignIO.read(path, "stockholm")
+    msa_arr = np.array([list(rec) for rec in msa])
+    return msa_arr[:, (msa_arr[0, :] != "-") & (msa_arr[0, :] != ".")]
+
+
+def measure(read, path):
+    tracemalloc.start()
+    t_0 = time.time()
+    msa_arr = read(path)
+    seconds = time.time() - t_0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return msa_arr, seconds, peak
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_sequences", type=int, default=20000)
+    parser.add_argument("--query_length", type=int, default=800)
+    parser.add_argument("--gap_fraction", type=float, default=0.3)
+    parser.add_argument("--num_blocks", type=int, default=1)
+    parser.add_argument("--skip_biopython", action="store_true")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        rows, query_columns = make_alignment(
+            args.num_sequences, args.query_length, args.gap_fraction,
+            np.random.default_rng(0))
+        expected = rows[:, query_columns]
+        sto_path = os.path.join(work_dir, "hits.sto")
+        a3m_path = os.path.join(work_dir, "hits.a3m")
+        write_stockholm(sto_path, rows, args.num_blocks)
+        write_a3m(a3m_path, rows, query_columns)
+        print(f"{args.num_sequences} sequences, {rows.shape[1]} columns, "
+              f"{os.path.getsize(sto_path) / 1024 ** 2:.0f} MB Stockholm, "
+              f"{os.path.getsize(a3m_path) / 1024 ** 2:.0f} MB A3M")
+
+        readers = [
+            ("msa_arrays .sto", msa_arrays.read_stockholm, sto_path),
+            ("msa_arrays .a3m", msa_arrays.read_a3m, a3m_path),
+        ]
+        if not args.skip_biopython:
+            readers.insert(0, ("biopython .sto", read_biopython, sto_path))
+        print(f"{'reader':<18}{'wall_sec':>10}{'peak_mb':>10}  same residues")
+        for name, read, path in readers:
+            msa_arr, seconds, peak = measure(read, path)
+            if msa_arr.dtype != np.uint8:
+                msa_arr = msa_arr.astype("S1").view(np.uint8)
+            print(f"{name:<18}{seconds:>10.2f}{peak / 1024 ** 2:>10.0f}  "
+                  f"{np.array_equal(msa_arr, expected)}")
+    finally:
+        shutil.rmtree(work_dir)
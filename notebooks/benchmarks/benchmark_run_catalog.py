@@ -0,0 +1,139 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare reading the metrics of many jobs one at a time, like
+nbhelpers.get_run_metrics, with run_catalog, against a local S3 stand-in (see
+benchmark_s3_download.py) that waits --latency_ms per request.
+
+The script builds the catalog of --num_jobs jobs, adds --num_new_jobs jobs
+and updates it (only the new jobs are fetched), then times fleet-wide pandas
+queries on the catalog.
+
+Usage:
+    python benchmarks/benchmark_run_catalog.py --num_jobs 500 --num_new_jobs 50
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import benchmark_s3_download
+from nbhelpers import run_catalog
+
+MONOMER_MODELS = [f"model_{i}_pred_0" for i in range(1, 6)]
+MULTIMER_MODELS = [
+    f"model_{i}_multimer_v2_pred_{j}" for i in range(1, 6) for j in range(5)]
+
+
+class LocalS3Client(benchmark_s3_download.LocalS3Client):
+
+    def get_object(self, Bucket, Key):
+        self.num_requests += 1
+        time.sleep(self.latency_sec)
+        path = os.path.join(self.root, Bucket, Key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(Key)
+        with open(path, "rb") as f:
+            return {"Body": io.BytesIO(f.read())}
+
+
+def write_jobs(bucket_dir, first_job, num_jobs, rng):
+    """timings.json and ranking_debug.json of single-target jobs."""
+    for i in range(first_job, first_job + num_jobs):
+        job_name = f"job-{i:06d}"
+        target_dir = os.path.join(bucket_dir, job_name, job_name)
+        os.makedirs(target_dir, exist_ok=True)
+        multimer = rng.random() < 0.3
+        models = MULTIMER_MODELS if multimer else MONOMER_MODELS
+        num_res = int(rng.integers(50, 2500))
+        timings = {"features": float(rng.uniform(300, 3600)), "num_res": num_res}
+        confidences = {}
+        for model in models:
+            timings[f"process_features_{model}"] = float(rng.uniform(1, 5))
+            timings[f"predict_and_compile_{model}"] = float(
+                num_res ** 2 / 2e4 * rng.uniform(0.8, 1.2))
+            timings[f"relax_{model}"] = float(rng.uniform(10, 60))
+            confidences[model] = float(rng.uniform(0.3, 0.9) if multimer
+                                       else rng.uniform(40, 95))
+        ranking = {
+            "iptm+ptm" if multimer else "plddts": confidences,
+            "order": sorted(confidences, key=confidences.get, reverse=True),
+        }
+        with open(os.path.join(target_dir, "timings.json"), "w") as f:
+            json.dump(timings, f)
+        with open(os.path.join(target_dir, "ranking_debug.json"), "w") as f:
+            json.dump(ranking, f)
+
+
+def read_sequentially(client, bucket, job_names):
+    """Two GETs per job, one job at a time, like get_run_metrics."""
+    for job_name in job_names:
+        for name in ("timings.json", "ranking_debug.json"):
+            json.loads(client.get_object(
+                Bucket=bucket, Key=f"{job_name}/{job_name}/{name}")["Body"].read())
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_jobs", type=int, default=500)
+    parser.add_argument("--num_new_jobs", type=int, default=50)
+    parser.add_argument("--latency_ms", type=float, default=30)
+    parser.add_argument("--max_workers", type=int, default=32)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        rng = np.random.default_rng(0)
+        root = os.path.join(work_dir, "s3")
+        bucket_dir = os.path.join(root, "bucket")
+        catalog_dir = os.path.join(work_dir, "catalog")
+        write_jobs(bucket_dir, 0, args.num_jobs, rng)
+        client = LocalS3Client(root, args.latency_ms, connection_mb_s=1000,
+                               part_mb=8)
+
+        t_0 = time.time()
+        read_sequentially(client, "bucket", sorted(os.listdir(bucket_dir)))
+        print(f"sequential reads of {args.num_jobs} jobs: "
+              f"{time.time() - t_0:.1f}s")
+
+        client.num_requests = 0
+        summary = run_catalog.update_catalog(
+            client, "bucket", catalog_dir, max_workers=args.max_workers)
+        print(f"catalog build: {summary['seconds']:.1f}s, "
+              f"{client.num_requests} requests")
+
+        write_jobs(bucket_dir, args.num_jobs, args.num_new_jobs, rng)
+        client.num_requests = 0
+        summary = run_catalog.update_catalog(
+            client, "bucket", catalog_dir, max_workers=args.max_workers)
+        print(f"incremental update: {summary['seconds']:.1f}s, "
+              f"{client.num_requests} requests, {summary['added']} jobs added")
+
+        t_0 = time.time()
+        catalog = run_catalog.load_catalog(catalog_dir)
+        predict = catalog[catalog.stage == "predict_and_compile"]
+        median_predict = predict.groupby("model").seconds.median()
+        ranked_first = catalog[(catalog["rank"] == 0)
+                               & (catalog.preset != "multimer")]
+        plddt_by_length = ranked_first.groupby(
+            (ranked_first.length // 500) * 500).confidence.describe()
+        print(f"load and query: {time.time() - t_0:.2f}s, {len(catalog)} rows, "
+              f"{catalog.job.nunique()} jobs")
+        print(median_predict.head())
+        print(plddt_by_length[["count", "mean", "50%"]])
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,192 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare the previous serial nbhelpers.download_dir with s3_download against a
+local S3 stand-in.
+
+The stand-in serves the objects of a folder shaped like the results of a
+multimer job (result pickles, PDBs, JSONs and MSAs). Each request waits for
+--latency_ms and each connection is limited to --connection_mb_s, like a
+notebook instance downloading from S3. ETags are computed like S3, with
+--part_mb parts for the objects uploaded in multiple parts.
+
+notebooks/tests/test_s3_download.py checks the content of the files, the
+filters and the skipping of files already downloaded.
+
+Usage:
+    python benchmarks/benchmark_s3_download.py --num_models 5 --result_mb 64
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nbhelpers import s3_download
+
+MB = s3_download.MB
+JOB_NAME = "job"
+
+
+class LocalS3Client:
+    """The list_objects_v2 and download_file calls of an S3 client, served
+    from a local folder whose subfolders are buckets."""
+
+    def __init__(self, root, latency_ms, connection_mb_s, part_mb):
+        self.root = root
+        self.latency_sec = latency_ms / 1000
+        self.connection_mb_s = connection_mb_s
+        self.part_size = part_mb * MB
+        self.num_requests = 0
+
+    def _etag(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) <= self.part_size:
+            return f'"{hashlib.md5(data).hexdigest()}"'
+        parts = [
+            hashlib.md5(data[start:start + self.part_size]).digest()
+            for start in range(0, len(data), self.part_size)
+        ]
+        return f'"{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}"'
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix="", Delimiter=None):
+        self.num_requests += 1
+        time.sleep(self.latency_sec)
+        bucket_dir = os.path.join(self.root, Bucket)
+        keys = sorted(
+            os.path.relpath(os.path.join(dirpath, name), bucket_dir)
+            for dirpath, _, names in os.walk(bucket_dir)
+            for name in names
+        )
+        contents, common_prefixes = [], set()
+        for key in keys:
+            if not key.startswith(Prefix):
+                continue
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                rest = key[len(Prefix):]
+                common_prefixes.add(Prefix + rest[:rest.index(Delimiter) + 1])
+                continue
+            path = os.path.join(bucket_dir, key)
+            contents.append(
+                {"Key": key, "Size": os.path.getsize(path), "ETag": self._etag(path)})
+        page = {"Contents": contents}
+        if common_prefixes:
+            page["CommonPrefixes"] = [
+                {"Prefix": prefix} for prefix in sorted(common_prefixes)]
+        return [page]
+
+    def download_file(self, Bucket, Key, Filename):
+        self.num_requests += 1
+        time.sleep(self.latency_sec)
+        source = os.path.join(self.root, Bucket, Key)
+        time.sleep(os.path.getsize(source) / MB / self.connection_mb_s)
+        tmp_path = f"{Filename}.tmp"
+        shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, Filename)
+
+
+def download_dir_serial(client, bucket, local="data", prefix=""):
+    """The previous nbhelpers.download_dir."""
+
+    paginator = client.get_paginator("list_objects_v2")
+    file_count = 0
+    for result in paginator.paginate(Bucket=bucket, Delimiter="/", Prefix=prefix):
+        if result.get("CommonPrefixes") is not None:
+            for subdir in result.get("CommonPrefixes"):
+                file_count += download_dir_serial(client, bucket, local, subdir.get("Prefix"))
+        for file in result.get("Contents", []):
+            dest_pathname = os.path.join(local, file.get("Key"))
+            if not os.path.exists(os.path.dirname(dest_pathname)):
+                os.makedirs(os.path.dirname(dest_pathname))
+            client.download_file(bucket, file.get("Key"), dest_pathname)
+            file_count += 1
+    return file_count
+
+
+def write_job(bucket_dir, args):
+    """Objects of a multimer job with num_models models."""
+    rng = np.random.default_rng(0)
+
+    def write(key, num_bytes):
+        path = os.path.join(bucket_dir, JOB_NAME, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(rng.bytes(num_bytes))
+
+    for i in range(args.num_models):
+        model_name = f"model_{i + 1}_multimer_v2_pred_0"
+        write(f"result_{model_name}.pkl", args.result_mb * MB)
+        write(f"unrelaxed_{model_name}.pdb", 400 * 1024)
+        write(f"relaxed_{model_name}.pdb", 400 * 1024)
+        write(f"ranked_{i}.pdb", 400 * 1024)
+    write("features.pkl", args.result_mb * MB // 2)
+    for name in ("ranking_debug.json", "timings.json", "relax_metrics.json"):
+        write(name, 2 * 1024)
+    for chain in ("A", "B"):
+        for name in ("uniref90_hits.sto", "mgnify_hits.sto", "bfd_uniref_hits.a3m",
+                     "uniprot_hits.sto", "pdb_hits.sto"):
+            write(f"msas/{chain}/{name}", 4 * MB)
+
+
+def _parse_args():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_models", type=int, default=5)
+    parser.add_argument("--result_mb", type=int, default=64)
+    parser.add_argument("--latency_ms", type=float, default=30)
+    parser.add_argument("--connection_mb_s", type=float, default=80)
+    parser.add_argument("--part_mb", type=int, default=8)
+    parser.add_argument("--max_workers", type=int, default=16)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+
+    args = _parse_args()
+    work_dir = tempfile.mkdtemp()
+    try:
+        root = os.path.join(work_dir, "s3")
+        write_job(os.path.join(root, "bucket"), args)
+        client = LocalS3Client(
+            root, args.latency_ms, args.connection_mb_s, args.part_mb)
+        all_keys = [obj["Key"] for obj in s3_download.list_objects(
+            client, "bucket", JOB_NAME)]
+        total_mb = sum(obj["Size"] for obj in s3_download.list_objects(
+            client, "bucket", JOB_NAME)) / MB
+        print(f"{len(all_keys)} objects, {total_mb:.0f} MB")
+        print(f"{'run':<28}{'wall_sec':>10}{'files':>8}{'skipped':>9}"
+              f"{'MB':>8}")
+
+        local = os.path.join(work_dir, "serial")
+        t_0 = time.time()
+        num_files = download_dir_serial(client, "bucket", local, JOB_NAME)
+        print(f"{'serial, all files':<28}{time.time() - t_0:>10.2f}{num_files:>8}"
+              f"{0:>9}{total_mb:>8.0f}")
+
+        runs = [
+            ("concurrent, all files", "all", {}),
+            ("concurrent, all, again", "all", {}),
+            ("concurrent, filtered", "filtered",
+             {"exclude": ["result_*.pkl", "features.pkl", "msas/"]}),
+        ]
+        for name, folder, filters in runs:
+            local = os.path.join(work_dir, folder)
+            report = s3_download.download_prefix(
+                client, "bucket", JOB_NAME, local, max_workers=args.max_workers,
+                **filters)
+            print(f"{name:<28}{report.seconds:>10.2f}{len(report.downloaded):>8}"
+                  f"{len(report.skipped):>9}{report.num_bytes / MB:>8.0f}")
+    finally:
+        shutil.rmtree(work_dir)
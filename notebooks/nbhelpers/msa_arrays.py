@@ -0,0 +1,268 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Read Stockholm and A3M alignments into uint8 arrays.
+
+The UniRef90, MGnify and BFD searches of a target can return tens of thousands
+of hits. These readers stream the file line by line, join up to chunk_rows
+aligned rows into a single bytes object and view it as a (rows, columns) uint8
+array, so that no Python object is created per residue. Only the columns
+aligned to a residue of the query (the first sequence) are kept.
+
+Each element is the ASCII code of a residue or gap, e.g.
+`msa_arr.view("S1")` gives the characters and `msa_arr != GAP` the residues.
+"""
+import os
+
+import numpy as np
+
+GAP = ord("-")
+# Gaps in the insert columns of Stockholm files written by HMMER.
+INSERT_GAP = ord(".")
+# A3M insertions relative to the query, removed to keep the query columns.
+_A3M_INSERTIONS = bytes(range(ord("a"), ord("z") + 1)) + b"."
+
+
+def _query_columns(query_row):
+    """Columns where the query has a residue rather than a gap or insert gap."""
+    query = np.frombuffer(query_row, dtype=np.uint8)
+    return (query != GAP) & (query != INSERT_GAP)
+
+
+def _rows_array(rows, path):
+    """(len(rows), row length) uint8 array of aligned rows of the same length."""
+    length = len(rows[0])
+    if any(len(row) != length for row in rows):
+        raise ValueError(f"{path} has aligned rows of different lengths")
+    return np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(len(rows), length)
+
+
+def _stockholm_chunks(path, max_sequences, chunk_rows):
+    """Yields (block index, names, rows) chunks of a Stockholm file."""
+    # Each block of the file has one row per sequence, the first one is the
+    # query. Blocks are split at the same columns for every sequence.
+    first_names = set()
+    block, num_rows, names, pending, mask = 0, 0, [], [], None
+
+    def chunk():
+        rows = _rows_array(pending, path)[:, mask]
+        chunk_names = list(names)
+        names.clear()
+        pending.clear()
+        return block, chunk_names, rows
+
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                if pending:
+                    yield chunk()
+                if num_rows:
+                    block, num_rows = block + 1, 0
+                continue
+            if line.startswith(b"#") or line == b"//":
+                continue
+            name, row = line.split(None, 1)
+            if max_sequences is not None and (
+                    name not in first_names if block
+                    else num_rows >= max_sequences):
+                continue
+            if not block:
+                first_names.add(name)
+            if not num_rows:
+                mask = _query_columns(row)
+            num_rows += 1
+            names.append(name)
+            pending.append(row)
+            if len(pending) >= chunk_rows:
+                yield chunk()
+        if pending:
+            yield chunk()
+
+
+def _num_stockholm_blocks(path):
+    num_blocks, in_block = 0, False
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                in_block = False
+            elif not in_block and not line.startswith((b"#", b"//")):
+                num_blocks += 1
+                in_block = True
+    return num_blocks
+
+
+def read_stockholm(path, max_sequences=None, chunk_rows=4096):
+    """Alignment of a Stockholm file, in the query's columns.
+
+    Args:
+        path (str): Path of the .sto file, e.g. uniref90_hits.sto.
+        max_sequences (int): Only read the first sequences, e.g. to plot the
+            depth of a large alignment quickly.
+        chunk_rows (int): Number of rows converted to an array at once.
+
+    Returns:
+        np.ndarray: (num_sequences, query_length) uint8 array, whose first row
+            is the query.
+    """
+    blocks = []
+    for block, names, rows in _stockholm_chunks(path, max_sequences, chunk_rows):
+        if block == len(blocks):
+            blocks.append(([], []))
+        blocks[block][0].extend(names)
+        blocks[block][1].append(rows)
+    if not blocks:
+        raise ValueError(f"{path} has no aligned sequences")
+    query_names = blocks[0][0]
+    parts = [np.concatenate(blocks[0][1])]
+    order = {name: i for i, name in enumerate(query_names)}
+    for block_names, block_chunks in blocks[1:]:
+        block_arr = np.concatenate(block_chunks)
+        if block_names != query_names:
+            if sorted(block_names) != sorted(query_names):
+                raise ValueError(
+                    f"The blocks of {path} do not have the same sequences")
+            block_arr = block_arr[np.argsort([order[n] for n in block_names])]
+        parts.append(block_arr)
+    return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+
+def _a3m_chunks(path, max_sequences, chunk_rows):
+    pending, parts = [], None
+    num_sequences, mask = 0, None
+
+    def chunk():
+        nonlocal mask
+        if mask is None:
+            mask = _query_columns(pending[0])
+        rows = _rows_array(pending, path)[:, mask]
+        pending.clear()
+        return rows
+
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(b"#"):
+                continue
+            if line.startswith(b">"):
+                if parts is not None:
+                    pending.append(b"".join(parts))
+                    if len(pending) >= chunk_rows:
+                        yield chunk()
+                if max_sequences is not None and num_sequences >= max_sequences:
+                    parts = None
+                    break
+                num_sequences += 1
+                parts = []
+            elif parts is not None:
+                # Sequences may be wrapped over several lines.
+                parts.append(line.translate(None, _A3M_INSERTIONS))
+        if parts is not None:
+            pending.append(b"".join(parts))
+    if pending:
+        yield chunk()
+
+
+def read_a3m(path, max_sequences=None, chunk_rows=4096):
+    """Alignment of an A3M file, in the query's columns.
+
+    Insertions relative to the query (lower case residues and ".") are
+    removed, like the gaps of the query in `read_stockholm`.
+
+    Args:
+        path (str): Path of the .a3m file, e.g. bfd_uniclust_hits.a3m.
+        max_sequences (int): Only read the first sequences.
+        chunk_rows (int): Number of rows converted to an array at once.
+
+    Returns:
+        np.ndarray: (num_sequences, query_length) uint8 array, whose first row
+            is the query.
+    """
+    chunks = list(_a3m_chunks(path, max_sequences, chunk_rows))
+    if not chunks:
+        raise ValueError(f"{path} has no aligned sequences")
+    return np.concatenate(chunks)
+
+
+def read_msa(path, max_sequences=None, chunk_rows=4096):
+    """Alignment of a .sto or .a3m file, in the query's columns."""
+    extension = os.path.splitext(path)[1]
+    if extension == ".sto":
+        return read_stockholm(path, max_sequences, chunk_rows)
+    if extension == ".a3m":
+        return read_a3m(path, max_sequences, chunk_rows)
+    raise ValueError(f"Unsupported alignment format: {path}")
+
+
+def iter_msa(path, max_sequences=None, chunk_rows=4096):
+    """Chunks of up to chunk_rows rows of a .sto or .a3m file, in the query's
+    columns, in order.
+
+    Only chunk_rows rows are held at a time, except for Stockholm files in
+    several blocks, which are read whole. `iter_msa_blocks` streams those too.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".a3m":
+        yield from _a3m_chunks(path, max_sequences, chunk_rows)
+    elif extension == ".sto" and _num_stockholm_blocks(path) <= 1:
+        for _, _, rows in _stockholm_chunks(path, max_sequences, chunk_rows):
+            yield rows
+    else:
+        msa_arr = read_msa(path, max_sequences, chunk_rows)
+        for start in range(0, len(msa_arr), chunk_rows):
+            yield msa_arr[start:start + chunk_rows]
+
+
+def iter_msa_blocks(path, max_sequences=None, chunk_rows=4096):
+    """Chunks of up to chunk_rows rows of a .sto or .a3m file, in the query's
+    columns, with their position in the alignment.
+
+    Stockholm files in several blocks are streamed a block at a time, so a
+    chunk may only hold some of the columns of its rows. Only chunk_rows rows
+    of one block are held at a time, whatever the file.
+
+    Yields:
+        tuple: The index of the sequence of each row, in the order of the
+            first block (the query is 0), the index of the first column of
+            the chunk, and the (rows, columns) uint8 array of the chunk.
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".a3m":
+        num_sequences = 0
+        for rows in _a3m_chunks(path, max_sequences, chunk_rows):
+            yield np.arange(num_sequences, num_sequences + len(rows)), 0, rows
+            num_sequences += len(rows)
+        return
+    if extension != ".sto":
+        raise ValueError(f"Unsupported alignment format: {path}")
+    # Index of each sequence name, from the first block.
+    order = {}
+    block, start, width, num_sequences, num_rows = 0, 0, 0, 0, 0
+    for chunk_block, names, rows in _stockholm_chunks(
+            path, max_sequences, chunk_rows):
+        if chunk_block != block:
+            if num_rows != num_sequences:
+                raise ValueError(
+                    f"The blocks of {path} do not have the same sequences")
+            block, start, num_rows = chunk_block, start + width, 0
+        if not block:
+            indices = np.arange(num_sequences, num_sequences + len(names))
+            order.update(zip(names, indices.tolist()))
+            num_sequences += len(names)
+        else:
+            try:
+                indices = np.array([order[name] for name in names])
+            except KeyError:
+                raise ValueError(
+                    f"The blocks of {path} do not have the same sequences")
+        num_rows += len(names)
+        width = rows.shape[1]
+        yield indices, start, rows
+    if block and num_rows != num_sequences:
+        raise ValueError(f"The blocks of {path} do not have the same sequences")
+
+
+def non_gap_counts(msa_arr):
+    """Number of sequences with a residue in each column of the alignment."""
+    return np.count_nonzero((msa_arr != GAP) & (msa_arr != INSERT_GAP), axis=0)
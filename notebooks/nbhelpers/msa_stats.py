@@ -0,0 +1,258 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Coverage, identity and Neff statistics of the MSAs of a job.
+
+`chain_stats` streams the .sto and .a3m files of one chain in chunks of rows
+(see msa_arrays.iter_msa_blocks) and accumulates arrays whose size only
+depends on the length of the query, and a few numbers per sequence (its
+aligned positions, its matches to the query and its weight):
+
+- the number of sequences with a residue at each position (coverage),
+- a histogram of the identity of the sequences to the query, over the
+  positions they align,
+- the number of effective sequences (Neff), overall and at each position.
+
+Neff uses the position-based sequence weights of Henikoff & Henikoff (1994),
+which need the residue counts of each column, so the files are read twice.
+It is the effective sample size of the weighted sequences, (sum w)^2 /
+sum w^2: the number of sequences if they are all equally distinct, fewer if
+some are redundant. Stockholm files in several blocks are streamed a block at
+a time, and read a third time for the Neff at each position, since the weight
+of a sequence is only known once all of its blocks are read.
+
+`job_stats` gathers the statistics of the msas folder of a job, with one
+subfolder per chain for multimers, and caches them in msa_stats.json in that
+folder, so notebooks do not parse the alignments again.
+"""
+import json
+import os
+
+import numpy as np
+
+from nbhelpers import msa_arrays
+
+CACHE_NAME = "msa_stats.json"
+VERSION = 1
+IDENTITY_BINS = 20
+# Residues, other residue codes (X, B, Z, ...) and gaps.
+_RESIDUES = b"ACDEFGHIKLMNPQRSTVWY"
+_OTHER, _GAP, _NUM_CODES = len(_RESIDUES), len(_RESIDUES) + 1, len(_RESIDUES) + 2
+_CODES = np.full(256, _OTHER, dtype=np.uint8)
+for _i, _residue in enumerate(_RESIDUES):
+    _CODES[_residue] = _CODES[_residue + ord("a") - ord("A")] = _i
+_CODES[msa_arrays.GAP] = _CODES[msa_arrays.INSERT_GAP] = _GAP
+
+
+def msa_paths(msa_folder):
+    """Alignments of a chain's folder, without the template hits."""
+    return sorted(
+        entry.path for entry in os.scandir(msa_folder)
+        if entry.is_file()
+        and os.path.splitext(entry.name)[1] in (".sto", ".a3m")
+        and "pdb_hits" not in entry.name
+    )
+
+
+def _chunks(path, offset, drop_query, chunk_rows):
+    """Coded rows of an alignment, in chunks.
+
+    Args:
+        path (str): .sto or .a3m file, which starts with the query.
+        offset (int): Index of the first sequence of the file among the
+            sequences of all files.
+        drop_query (bool): Leave out the query, which an earlier file has.
+        chunk_rows (int): Number of rows read at once.
+
+    Yields:
+        tuple: The index of the sequence of each row, the index of the first
+            column, the coded rows and the coded query in the chunk's columns.
+    """
+    for indices, start, rows in msa_arrays.iter_msa_blocks(
+            path, chunk_rows=chunk_rows):
+        codes = _CODES[rows]
+        # The query is the first row of each block.
+        if indices[0] == 0:
+            query = codes[0]
+        if drop_query:
+            keep = indices > 0
+            indices, codes = indices[keep] - 1, codes[keep]
+        yield indices + offset, start, codes, query
+
+
+def _grow(array, size):
+    """`array`, padded with zeros to at least `size` rows."""
+    if len(array) >= size:
+        return array
+    grown = np.zeros((max(size, 2 * len(array)),) + array.shape[1:],
+                     dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def chain_stats(paths, chunk_rows=1024):
+    """Statistics of the alignments of one chain.
+
+    Args:
+        paths (list): .sto and .a3m files, which all start with the same query.
+        chunk_rows (int): Number of rows processed at once.
+
+    Returns:
+        dict: JSON-serializable statistics, see the module docstring.
+    """
+    # Accumulators of each position and of each sequence, grown as the
+    # columns and sequences are read.
+    query = np.zeros(0, dtype=np.uint8)
+    coverage = np.zeros(0, dtype=np.int64)
+    residue_counts = np.zeros((0, _NUM_CODES), dtype=np.int64)
+    num_aligned = np.zeros(0, dtype=np.int64)
+    num_matches = np.zeros(0, dtype=np.int64)
+    files = {}
+    length = num_sequences = 0
+    # Index of the first sequence of each file.
+    offsets = []
+    # Files in several blocks, read again for the Neff at each position.
+    block_paths = set()
+    for i, path in enumerate(paths):
+        offsets.append(num_sequences)
+        for indices, start, codes, chunk_query in _chunks(
+                path, num_sequences, i > 0, chunk_rows):
+            end = start + codes.shape[1]
+            if i == 0:
+                query = _grow(query, end)
+                query[start:end] = chunk_query
+                length = max(length, end)
+            elif end > length or not np.array_equal(
+                    query[start:end], chunk_query):
+                raise ValueError(f"{path} does not have the query of {paths[0]}")
+            if start > 0:
+                block_paths.add(path)
+            else:
+                files[os.path.basename(path)] = (
+                    files.get(os.path.basename(path), 0) + len(codes))
+            coverage = _grow(coverage, end)
+            residue_counts = _grow(residue_counts, end)
+            num_sequences = max(num_sequences, int(indices.max(initial=-1)) + 1)
+            num_aligned = _grow(num_aligned, num_sequences)
+            num_matches = _grow(num_matches, num_sequences)
+            aligned = codes != _GAP
+            coverage[start:end] += aligned.sum(axis=0)
+            num_aligned[indices] += aligned.sum(axis=1)
+            num_matches[indices] += (
+                (codes == query[start:end]) & aligned).sum(axis=1)
+            column_offsets = np.arange(codes.shape[1]) * _NUM_CODES
+            residue_counts[start:end] += np.bincount(
+                (codes + column_offsets).ravel(),
+                minlength=codes.shape[1] * _NUM_CODES).reshape(-1, _NUM_CODES)
+    if not length:
+        raise ValueError("No alignments to summarize")
+    coverage, residue_counts = coverage[:length], residue_counts[:length]
+    num_aligned = num_aligned[:num_sequences]
+    num_matches = num_matches[:num_sequences]
+
+    identity = num_matches / np.maximum(num_aligned, 1)
+    identity_histogram = np.bincount(
+        np.minimum((identity * IDENTITY_BINS).astype(int), IDENTITY_BINS - 1)[
+            num_aligned > 0],
+        minlength=IDENTITY_BINS)
+
+    # Weight of a residue: 1 / (number of distinct residues in its column *
+    # number of times it occurs there). Gaps do not count.
+    counts = residue_counts[:, :_GAP].astype(float)
+    distinct = np.count_nonzero(counts, axis=1, keepdims=True)
+    residue_weights = np.zeros((length, _NUM_CODES))
+    np.divide(1.0, distinct * counts, out=residue_weights[:, :_GAP],
+              where=counts > 0)
+    weights = np.zeros(num_sequences)
+    column_weight_sum = np.zeros(length)
+    column_weight_sq_sum = np.zeros(length)
+
+    def add_column_weights(indices, start, codes):
+        aligned = codes != _GAP
+        end = start + codes.shape[1]
+        column_weight_sum[start:end] += weights[indices] @ aligned
+        column_weight_sq_sum[start:end] += (weights[indices] ** 2) @ aligned
+
+    for i, path in enumerate(paths):
+        for indices, start, codes, _ in _chunks(
+                path, offsets[i], i > 0, chunk_rows):
+            positions = np.arange(start, start + codes.shape[1])
+            weights[indices] += (
+                residue_weights[positions, codes].sum(axis=1) / length)
+            if path not in block_paths:
+                # The chunk has every column, so its weights are complete.
+                add_column_weights(indices, start, codes)
+    for i, path in enumerate(paths):
+        if path in block_paths:
+            for indices, start, codes, _ in _chunks(
+                    path, offsets[i], i > 0, chunk_rows):
+                add_column_weights(indices, start, codes)
+
+    neff_per_residue = np.zeros(length)
+    np.divide(column_weight_sum ** 2, column_weight_sq_sum,
+              out=neff_per_residue, where=column_weight_sq_sum > 0)
+    weight_sum, weight_sq_sum = weights.sum(), (weights ** 2).sum()
+    return {
+        "query_length": int(length),
+        "num_sequences": int(sum(files.values())),
+        "files": files,
+        "coverage": coverage.tolist(),
+        "identity_bin_edges": np.linspace(0, 1, IDENTITY_BINS + 1).round(3).tolist(),
+        "identity_histogram": identity_histogram.tolist(),
+        "neff": round(weight_sum ** 2 / weight_sq_sum, 2) if weight_sq_sum else 0.0,
+        "neff_per_residue": neff_per_residue.round(2).tolist(),
+    }
+
+
+def _chain_folders(msa_dir):
+    """Folder of each chain: the chain subfolders of a multimer, or msa_dir."""
+    subfolders = sorted(
+        (entry.name, entry.path) for entry in os.scandir(msa_dir) if entry.is_dir())
+    return dict(subfolders) if subfolders else {"A": msa_dir}
+
+
+def _fingerprint(paths, msa_dir):
+    return {
+        os.path.relpath(path, msa_dir): [os.path.getsize(path), os.path.getmtime(path)]
+        for path in paths
+    }
+
+
+def job_stats(msa_dir, use_cache=True):
+    """Statistics of each chain of a job's msas folder, cached in msa_stats.json.
+
+    The cache is used as long as the alignment files have the same sizes and
+    modification times.
+
+    Args:
+        msa_dir (str): msas folder of the job.
+        use_cache (bool): Read the cache if it is valid.
+
+    Returns:
+        dict: {"multimer": bool, "chains": {chain ID: chain_stats}, ...}.
+            Monomers have one chain, "A".
+    """
+    cache_path = os.path.join(msa_dir, CACHE_NAME)
+    chain_folders = _chain_folders(msa_dir)
+    chain_paths = {
+        chain: msa_paths(folder) for chain, folder in chain_folders.items()
+    }
+    fingerprint = _fingerprint(
+        [path for paths in chain_paths.values() for path in paths], msa_dir)
+    if use_cache and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cached = json.load(f)
+        if cached.get("version") == VERSION and cached.get("files") == fingerprint:
+            return cached
+    stats = {
+        "version": VERSION,
+        "files": fingerprint,
+        "multimer": chain_folders != {"A": msa_dir},
+        "chains": {
+            chain: chain_stats(paths) for chain, paths in chain_paths.items() if paths
+        },
+    }
+    with open(cache_path, "w") as f:
+        json.dump(stats, f)
+    return stats
@@ -4,6 +4,7 @@
 """
 Helper functions for the AWS-Alphafold notebook.
 """
+from concurrent import futures
 from datetime import datetime
 import boto3
 import uuid
@@ -11,7 +12,6 @@ import sagemaker
 from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
-from Bio import AlignIO
 from Bio.Align import MultipleSeqAlignment
 import os
 import pandas as pd
@@ -23,6 +23,14 @@ from string import ascii_uppercase, ascii_lowercase
 import py3Dmol
 import json
 import re
+import heapq
+import io
+from nbhelpers import msa_arrays
+from nbhelpers import msa_stats
+from nbhelpers import prediction_results
+from nbhelpers import run_catalog
+from nbhelpers import s3_download
+from nbhelpers import targets
 
 boto_session = boto3.session.Session()
 sm_session = sagemaker.session.Session(boto_session)
@@ -163,37 +171,62 @@ def get_batch_logs(logStreamName):
     return logs
 
 
-def download_dir(client, bucket, local="data", prefix=""):
-    """Recursively download files from S3."""
-
-    paginator = client.get_paginator("list_objects_v2")
-    file_count = 0
-    for result in paginator.paginate(Bucket=bucket, Delimiter="/", Prefix=prefix):
-        if result.get("CommonPrefixes") is not None:
-            for subdir in result.get("CommonPrefixes"):
-                download_dir(client, bucket, local, subdir.get("Prefix"))
-        for file in result.get("Contents", []):
-            dest_pathname = os.path.join(local, file.get("Key"))
-            if not os.path.exists(os.path.dirname(dest_pathname)):
-                os.makedirs(os.path.dirname(dest_pathname))
-            client.download_file(bucket, file.get("Key"), dest_pathname)
-            file_count += 1
-    print(f"{file_count} files downloaded from s3.")
+def download_dir(
+    client,
+    bucket,
+    local="data",
+    prefix="",
+    include=None,
+    exclude=None,
+    max_workers=16,
+):
+    """Download the files under an S3 prefix concurrently, see s3_download.
+
+    include and exclude are globs, e.g. exclude=["result_*.pkl", "msas/"] to
+    only fetch the ranked PDBs and JSONs. Files that are already present with
+    the same size and ETag are skipped, so an interrupted download resumes.
+    """
+
+    report = s3_download.download_prefix(
+        client,
+        bucket,
+        prefix=prefix,
+        local=local,
+        include=include,
+        exclude=exclude,
+        max_workers=max_workers,
+    )
+    if report.failures:
+        raise RuntimeError(
+            f"{len(report.failures)} files could not be downloaded from "
+            f"s3://{bucket}/{prefix}: {report.failures[0][1]}"
+        )
     return local
 
 
-def download_results(bucket, job_name, local="data"):
-    """Download MSA information from S3"""
-    return download_dir(s3, bucket, local, job_name)
+def download_results(bucket, job_name, local="data", **kwargs):
+    """Download MSA information from S3. Other arguments are passed to
+    download_dir, e.g. exclude=["result_*.pkl"]"""
+    return download_dir(s3, bucket, local, job_name, **kwargs)
+
 
+def load_prediction_result(result_path):
+    """Load a result_{model_name} file written with any output profile, as the
+    nested dictionary of the pickle, see prediction_results."""
+    return prediction_results.load_result(result_path)
 
-def reduce_stockholm_file(sto_file):
+
+def reduce_stockholm_file(sto_file, ascii_codes=False):
     """Read in a .sto file and parse format it into a numpy array of the
-    same length as the first (target) sequence
+    same length as the first (target) sequence, see msa_arrays
+
+    The array holds single characters, like before msa_arrays, or with
+    ascii_codes=True the uint8 codes of msa_arrays, without the conversion.
     """
-    msa = AlignIO.read(sto_file, "stockholm")
-    msa_arr = np.array([list(rec) for rec in msa])
-    return msa_arr[:, msa_arr[0, :] != "-"]
+    msa_arr = msa_arrays.read_stockholm(sto_file)
+    if ascii_codes:
+        return msa_arr
+    return msa_arr.view("S1").astype("U1")
 
 
 def plot_msa_array(msa_arr, id=None):
@@ -201,13 +234,15 @@ def plot_msa_array(msa_arr, id=None):
     total_msa_size = len(msa_arr)
 
     if total_msa_size > 1:
-        aa_map = {res: i for i, res in enumerate("ABCDEFGHIJKLMNOPQRSTUVWXYZ-")}
-        msa_arr = np.array([[aa_map[aa] for aa in seq] for seq in msa_arr])
+        msa_arr = np.asarray(msa_arr)
+        if msa_arr.dtype != np.uint8:
+            # Arrays of characters
+            msa_arr = msa_arr.astype("S1").view(np.uint8)
         plt.figure(figsize=(12, 3))
         plt.title(
             f"Per-Residue Count of Non-Gap Amino Acids in the MSA for Sequence {id}"
         )
-        plt.plot(np.sum(msa_arr != aa_map["-"], axis=0), color="black")
+        plt.plot(msa_arrays.non_gap_counts(msa_arr), color="black")
         plt.ylabel("Non-Gap Count")
         plt.yticks(range(0, total_msa_size + 1, max(1, int(total_msa_size / 3))))
 
@@ -218,36 +253,53 @@ def plot_msa_array(msa_arr, id=None):
         return None
 
 
-def plot_msa_folder(msa_folder, id=None):
-    combined_msa = None
-    with os.scandir(msa_folder) as it:
-        for obj in it:
-            obj_path = os.path.splitext(obj.path)
-            if "pdb_hits" not in obj_path[0] and obj_path[1] == ".sto":
-                msa_arr = reduce_stockholm_file(obj.path)
-                if combined_msa is None:
-                    combined_msa = msa_arr
-                else:
-                    combined_msa = np.concatenate((combined_msa, msa_arr), axis=0)
-    if combined_msa is not None:
-        print(f"Total number of aligned sequences is {len(combined_msa)}")
-        plot_msa_array(combined_msa, id).show()
-        return None
+def plot_msa_stats(chain_stats, id=None):
+    """Plot the coverage and Neff of each position from msa_stats.chain_stats"""
+
+    total_msa_size = chain_stats["num_sequences"]
+    print(
+        f"Total number of aligned sequences is {total_msa_size}, "
+        f"Neff {chain_stats['neff']:.1f}"
+    )
+    if total_msa_size > 1:
+        fig, ax = plt.subplots(figsize=(12, 3))
+        ax.set_title(
+            f"Per-Residue Count of Non-Gap Amino Acids in the MSA for Sequence {id}"
+        )
+        ax.plot(chain_stats["coverage"], color="black")
+        ax.set_ylabel("Non-Gap Count")
+        ax.set_yticks(range(0, total_msa_size + 1, max(1, int(total_msa_size / 3))))
+        neff_ax = ax.twinx()
+        neff_ax.plot(chain_stats["neff_per_residue"], color="tab:blue", alpha=0.6)
+        neff_ax.set_ylabel("Neff", color="tab:blue")
+
+        return plt
+
     else:
+        print("Unable to display MSA of length 1")
         return None
 
 
+def plot_msa_folder(msa_folder, id=None):
+    paths = msa_stats.msa_paths(msa_folder)
+    if paths:
+        plot = plot_msa_stats(msa_stats.chain_stats(paths), id)
+        if plot is not None:
+            plot.show()
+    return None
+
+
 def plot_msa_output_folder(path, id=None):
-    """Plot MSAs in a folder that may have multiple chain folders"""
-    plots = []
-    monomer = True
-    with os.scandir(path) as it:
-        for obj in it:
-            if obj.is_dir():
-                monomer = False
-                plot_msa_folder(obj.path, id + " " + obj.name)
-        if monomer:
-            plot_msa_folder(path, id)
+    """Plot MSAs in a folder that may have multiple chain folders, from the
+    statistics cached in msa_stats.json
+    """
+    stats = msa_stats.job_stats(path)
+    for chain, chain_stats in stats["chains"].items():
+        plot = plot_msa_stats(
+            chain_stats, f"{id} {chain}" if stats["multimer"] else id
+        )
+        if plot is not None:
+            plot.show()
     return None
 
 
@@ -302,6 +354,8 @@ def submit_batch_alphafold_job(
     use_precomputed_msas=False,
     features_paths=None,
     run_features_only=False,
+    features_format="pkl",
+    output_profile="full",
     logtostderr=True,
     cpu=4,
     memory=16,
@@ -310,7 +364,30 @@ def submit_batch_alphafold_job(
     stack_name=None,
     use_spot_instances=False,
     run_relax=True,
-    num_multimer_predictions_per_model=1
+    num_multimer_predictions_per_model=1,
+    relax_workers=0,
+    relax_mode="all",
+    length_buckets=None,
+    sort_by_bucket=False,
+    jax_cache_dir=None,
+    lazy_model_params=True,
+    release_params_after_use=False,
+    schedule="target_major",
+    feature_cache=None,
+    chain_msa_store=None,
+    precompute_chains=False,
+    concurrent_msa_search=False,
+    fasta_manifest=None,
+    feature_workers=0,
+    warm_databases=False,
+    trace=False,
+    trace_emf_namespace=None,
+    resource_profile=False,
+    resume=False,
+    shard_manifest=None,
+    deduplicate_targets=True,
+    array_size=None,
+    batch_client=None,
 ):
 
     if stack_name is None:
@@ -319,7 +396,6 @@ def submit_batch_alphafold_job(
 
     container_overrides = {
         "command": [
-            f"--fasta_paths={fasta_paths}",
             f"--uniref90_database_path={uniref90_database_path}",
             f"--mgnify_database_path={mgnify_database_path}",
             f"--data_dir={data_dir}",
@@ -338,6 +414,15 @@ def submit_batch_alphafold_job(
         ],
     }
 
+    if fasta_paths is not None:
+        container_overrides["command"].append(f"--fasta_paths={fasta_paths}")
+
+    if fasta_manifest is not None:
+        container_overrides["command"].append(f"--fasta_manifest={fasta_manifest}")
+
+    if shard_manifest is not None:
+        container_overrides["command"].append(f"--shard_manifest={shard_manifest}")
+
     if model_preset == "multimer":
         container_overrides["command"].append(
             f"--uniprot_database_path={uniprot_database_path}"
@@ -378,6 +463,74 @@ def submit_batch_alphafold_job(
     if run_features_only:
         container_overrides["command"].append("--run_features_only")
 
+    if features_format != "pkl":
+        container_overrides["command"].append(f"--features_format={features_format}")
+
+    if output_profile != "full":
+        container_overrides["command"].append(f"--output_profile={output_profile}")
+
+    if relax_workers > 0:
+        container_overrides["command"].append(f"--relax_workers={relax_workers}")
+
+    if relax_mode != "all":
+        container_overrides["command"].append(f"--relax_mode={relax_mode}")
+
+    if length_buckets is not None:
+        container_overrides["command"].append(
+            f"--length_buckets={','.join(str(b) for b in length_buckets)}"
+        )
+
+    if sort_by_bucket:
+        container_overrides["command"].append("--sort_by_bucket")
+
+    if jax_cache_dir is not None:
+        container_overrides["command"].append(f"--jax_cache_dir={jax_cache_dir}")
+
+    if not lazy_model_params:
+        container_overrides["command"].append("--nolazy_model_params")
+
+    if release_params_after_use:
+        container_overrides["command"].append("--release_params_after_use")
+
+    if schedule != "target_major":
+        container_overrides["command"].append(f"--schedule={schedule}")
+
+    if feature_cache is not None:
+        container_overrides["command"].append(f"--feature_cache={feature_cache}")
+
+    if chain_msa_store is not None:
+        container_overrides["command"].append(f"--chain_msa_store={chain_msa_store}")
+
+    if precompute_chains:
+        container_overrides["command"].append("--precompute_chains")
+
+    if concurrent_msa_search:
+        container_overrides["command"].append("--concurrent_msa_search")
+        container_overrides["command"].append(f"--msa_cpus={cpu}")
+
+    if feature_workers > 0:
+        container_overrides["command"].append(f"--feature_workers={feature_workers}")
+
+    if warm_databases:
+        container_overrides["command"].append("--warm_databases")
+
+    if trace:
+        container_overrides["command"].append("--trace")
+
+    if trace_emf_namespace is not None:
+        container_overrides["command"].append(
+            f"--trace_emf_namespace={trace_emf_namespace}"
+        )
+
+    if resource_profile:
+        container_overrides["command"].append("--resource_profile")
+
+    if resume:
+        container_overrides["command"].append("--resume")
+
+    if not deduplicate_targets:
+        container_overrides["command"].append("--nodeduplicate_targets")
+
     if logtostderr:
         container_overrides["command"].append("--logtostderr")
 
@@ -400,24 +553,163 @@ def submit_batch_alphafold_job(
             job_queue = batch_resources["cpu_job_queue_od"]
 
     print(container_overrides)
-    if depends_on is None:
-        response = batch.submit_job(
-            jobDefinition=job_definition,
-            jobName=job_name,
-            jobQueue=job_queue,
-            containerOverrides=container_overrides,
-        )
-    else:
-        response = batch.submit_job(
-            jobDefinition=job_definition,
-            jobName=job_name,
-            jobQueue=job_queue,
-            containerOverrides=container_overrides,
-            dependsOn=[{"jobId": depends_on, "type": "SEQUENTIAL"}],
-        )
+    submit_args = dict(
+        jobDefinition=job_definition,
+        jobName=job_name,
+        jobQueue=job_queue,
+        containerOverrides=container_overrides,
+    )
+    # Batch array jobs have at least 2 children.
+    if array_size is not None and array_size > 1:
+        submit_args["arrayProperties"] = {"size": array_size}
+    if depends_on is not None:
+        # Each child of an array job waits for the child of depends_on (an
+        # array job of the same size) with the same index.
+        dependency_type = "N_TO_N" if "arrayProperties" in submit_args else "SEQUENTIAL"
+        submit_args["dependsOn"] = [{"jobId": depends_on, "type": dependency_type}]
+    response = (batch_client or batch).submit_job(**submit_args)
 
     return response
 
+
+# Relative cost of a target, to balance the shards of an array job: one MSA
+# search per distinct chain, and an inference time that grows with the square
+# of the number of residues. A 400-residue monomer costs as much to search as
+# to fold.
+CHAIN_SEARCH_COST = 1.0
+RESIDUE_PAIR_COST = 1 / 400 ** 2
+
+
+def estimate_target_cost(sequences):
+    """Relative cost of predicting the structure of a target (its chains)."""
+    num_res = sum(len(sequence) for sequence in sequences)
+    return (
+        len(set(sequences)) * CHAIN_SEARCH_COST + num_res ** 2 * RESIDUE_PAIR_COST
+    )
+
+
+def pack_shards(costs, num_shards):
+    """Split targets into at most num_shards shards of similar total cost.
+
+    Targets are assigned, most expensive first, to the shard with the lowest
+    total cost so far. No shard is empty.
+
+    Args:
+        costs (dict): Estimated cost of each target, by FASTA path.
+        num_shards (int): Maximum number of shards.
+
+    Returns:
+        list: FASTA paths of each shard.
+    """
+    num_shards = max(1, min(num_shards, len(costs)))
+    shards = [[] for _ in range(num_shards)]
+    shard_costs = [(0.0, i) for i in range(num_shards)]
+    for fasta_path in sorted(costs, key=lambda path: (-costs[path], path)):
+        shard_cost, i = heapq.heappop(shard_costs)
+        shards[i].append(fasta_path)
+        heapq.heappush(shard_costs, (shard_cost + costs[fasta_path], i))
+    return shards
+
+
+def read_fasta_manifest(bucket, manifest_key, s3_client=None):
+    """FASTA paths listed in a manifest in S3, one per line, like --fasta_manifest."""
+    body = (s3_client or s3).get_object(Bucket=bucket, Key=manifest_key)["Body"]
+    return [
+        line.strip()
+        for line in body.read().decode().splitlines()
+        if line.strip() and not line.strip().startswith("#")
+    ]
+
+
+def read_fasta_sequences(bucket, fasta_path, s3_client=None):
+    """Sequences of a FASTA file in S3."""
+    body = (s3_client or s3).get_object(Bucket=bucket, Key=fasta_path)["Body"]
+    return [
+        str(record.seq)
+        for record in SeqIO.parse(io.StringIO(body.read().decode()), "fasta")
+    ]
+
+
+def submit_batch_alphafold_array_job(
+    job_name,
+    s3_bucket,
+    num_shards,
+    fasta_paths=None,
+    fasta_manifest=None,
+    s3_client=None,
+    batch_client=None,
+    max_workers=32,
+    **kwargs,
+):
+    """Submit a library of FASTA files as one Batch array job.
+
+    The FASTA files (S3 keys in s3_bucket, from fasta_paths and from the
+    manifest fasta_manifest) are packed into num_shards shards of similar
+    estimated cost, by sequence length and number of chains, with identical
+    targets in the same shard so they are computed once. The FASTA files are
+    read with max_workers concurrent GET requests. The shards are written to
+    {job_name}/shards.json and each child job of the array processes one of
+    them. Other arguments are passed to
+    submit_batch_alphafold_job, e.g. depends_on=<an array job with the same
+    shards> to fold each shard once its features are ready.
+    """
+    s3_client = s3_client or s3
+    fasta_paths = list(fasta_paths or [])
+    if fasta_manifest is not None:
+        fasta_paths += read_fasta_manifest(s3_bucket, fasta_manifest, s3_client)
+    # Identical targets are packed into the same shard, where the job computes
+    # them once (--deduplicate_targets), and only the first one is costed.
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        target_sequences = list(
+            executor.map(
+                lambda path: read_fasta_sequences(s3_bucket, path, s3_client),
+                fasta_paths,
+            )
+        )
+    costs = {}
+    duplicates = {}
+    first_paths = {}
+    for fasta_path, sequences in zip(fasta_paths, target_sequences):
+        key = targets.target_digest(sequences)
+        if key in first_paths:
+            duplicates.setdefault(first_paths[key], []).append(fasta_path)
+        else:
+            first_paths[key] = fasta_path
+            costs[fasta_path] = estimate_target_cost(sequences)
+    shards = [
+        [path for first_path in shard for path in [first_path] + duplicates.get(first_path, [])]
+        for shard in pack_shards(costs, num_shards)
+    ]
+
+    manifest_key = f"{job_name}/shards.json"
+    s3_client.put_object(
+        Bucket=s3_bucket,
+        Key=manifest_key,
+        Body=json.dumps(
+            {
+                "shards": shards,
+                "costs": [
+                    sum(costs.get(path, 0) for path in shard) for shard in shards
+                ],
+            },
+            indent=4,
+        ).encode(),
+    )
+    print(
+        f"Packed {len(fasta_paths)} targets ({len(costs)} unique) into "
+        f"{len(shards)} shards, "
+        f"s3://{s3_bucket}/{manifest_key}"
+    )
+    return submit_batch_alphafold_job(
+        job_name=job_name,
+        fasta_paths=None,
+        s3_bucket=s3_bucket,
+        shard_manifest=manifest_key,
+        array_size=len(shards),
+        batch_client=batch_client,
+        **kwargs,
+    )
+
 def get_run_metrics(bucket, job_name):
     timings_uri = sagemaker.s3.s3_path_join(bucket, job_name, "timings.json")
     ranking_uri = sagemaker.s3.s3_path_join(bucket, job_name, "ranking_debug.json")
@@ -435,6 +727,114 @@ def get_run_metrics(bucket, job_name):
     return (timing_df, ranking_plddts_df, order_df)
 
 
+def update_run_catalog(bucket, catalog_dir="run_catalog", prefix="", max_workers=32):
+    """Add the jobs under s3://bucket/prefix that are new since the last update
+    to a local Parquet catalog of their timings and rankings, see run_catalog.
+    Returns the catalog as a DataFrame, e.g. for
+    catalog[catalog.stage == "predict_and_compile"].groupby("model").seconds.median()
+    """
+    run_catalog.update_catalog(
+        s3, bucket, catalog_dir=catalog_dir, prefix=prefix, max_workers=max_workers
+    )
+    return run_catalog.load_catalog(catalog_dir)
+
+
+def load_resource_profiles(bucket, job_names):
+    """Read the resource_profile.json of past jobs run with resource_profile=True.
+
+    Each child of an array job writes its own profile, under
+    <job_name>/shards/<index>/, and is returned as "<job_name>/shards/<index>".
+    """
+    profiles = {}
+    for job_name in job_names:
+        profile_keys = [
+            obj["Key"]
+            for obj in s3_download.list_objects(s3, bucket, f"{job_name}/shards/")
+            if obj["Key"].endswith("/resource_profile.json")
+        ] or [f"{job_name}/resource_profile.json"]
+        for key in profile_keys:
+            name = os.path.dirname(key)
+            try:
+                profiles[name] = json.loads(
+                    s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+                )
+            except Exception as err:
+                print(f"Skipping {name}, no resource profile: {err}")
+    return profiles
+
+
+def recommend_resources(
+    bucket,
+    job_names,
+    length_buckets=(256, 512, 1024, 2048),
+    cpu_percentile=95,
+    memory_headroom=1.25,
+):
+    """Recommend the cpu and memory of submit_batch_alphafold_job from past jobs.
+
+    Jobs are grouped by model and database preset, by whether they only
+    computed features, and by the length bucket of their longest target. Each
+    group gets enough vCPUs for the cpu_percentile of the CPU utilization of
+    its busiest job, and memory (in GB) for its highest peak memory plus
+    memory_headroom. The children of array jobs are grouped as separate jobs.
+    """
+    rows = []
+    for job_name, profile in load_resource_profiles(bucket, job_names).items():
+        if not profile["samples"]:
+            continue
+        lengths = [
+            length for length in profile["target_lengths"].values()
+            if length is not None
+        ]
+        max_length = max(lengths) if lengths else None
+        if max_length is None:
+            length_bucket = "unknown"
+        else:
+            length_bucket = next(
+                (f"<={bucket_size}" for bucket_size in length_buckets
+                 if max_length <= bucket_size),
+                f">{length_buckets[-1]}",
+            )
+        rows.append(
+            {
+                "job_name": job_name,
+                "model_preset": profile["model_preset"],
+                "db_preset": profile["db_preset"],
+                "run_features_only": profile["run_features_only"],
+                "length_bucket": length_bucket,
+                "max_sequence_length": max_length,
+                "vcpus_used": np.percentile(
+                    [sample["cpu_percent"] for sample in profile["samples"]],
+                    cpu_percentile,
+                ) / 100,
+                "peak_memory_gb": profile["job"]["pss_bytes_max"] / 1024 ** 3,
+            }
+        )
+    if not rows:
+        return pd.DataFrame()
+
+    recommendations = (
+        pd.DataFrame(rows)
+        .groupby(
+            ["model_preset", "db_preset", "run_features_only", "length_bucket"]
+        )
+        .agg(
+            num_jobs=("job_name", "count"),
+            max_sequence_length=("max_sequence_length", "max"),
+            vcpus_used=("vcpus_used", "max"),
+            peak_memory_gb=("peak_memory_gb", "max"),
+        )
+        .reset_index()
+    )
+    recommendations["cpu"] = np.maximum(
+        1, np.ceil(recommendations["vcpus_used"])
+    ).astype(int)
+    recommendations["memory"] = np.maximum(
+        1, np.ceil(recommendations["peak_memory_gb"] * memory_headroom)
+    ).astype(int)
+    return recommendations
+
+
 def validate_input(input_sequences):
     output = []
     for sequence in input_sequences:
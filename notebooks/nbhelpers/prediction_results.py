@@ -0,0 +1,39 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Reader of the per-model prediction results of every output profile.
+
+The notebook's copy of the loader of the folding container's results_store
+(docker/folding/foldhelpers/results_store.py), which it cannot import.
+"full" results are pickled dictionaries. "standard" and "minimal" results are
+.npz files whose nested entries are stored under "/"-joined names, e.g.
+"structure_module/final_atom_positions". Arrays of "minimal" results are
+float16. notebooks/tests/test_prediction_results.py reads the files written
+by results_store, so the two stay in sync.
+"""
+import pickle
+from typing import Any, Dict, Mapping
+
+import numpy as np
+
+
+def unflatten_result(flat: Mapping[str, np.ndarray]) -> Dict[str, Any]:
+    """Nested dictionary of the "/"-joined names of an .npz result."""
+    result = {}
+    for name, value in flat.items():
+        *parents, key = name.split("/")
+        node = result
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+    return result
+
+
+def load_result(path: str) -> Dict[str, Any]:
+    """Load a result written with any profile, as a nested dictionary."""
+    if path.endswith(".pkl"):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    with np.load(path, allow_pickle=False) as archive:
+        return unflatten_result({name: archive[name] for name in archive.files})
@@ -0,0 +1,275 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Columnar catalog of the timings and rankings of many jobs.
+
+`update_catalog` lists an output prefix, fetches the timings.json and
+ranking_debug.json of the targets it has not seen yet (or whose files changed)
+with a thread pool, and normalizes them into one row per stage:
+
+    job, target, model, stage, seconds, confidence, rank, length, preset
+
+Target-level stages (e.g. features) have no model. The rows of each update are
+appended to a Parquet dataset partitioned by model preset,
+<catalog_dir>/preset=<preset>/part-<time>.parquet, and _catalog_index.json
+records the ETags of the files each target was read from, so later updates
+only fetch new targets. `load_catalog` reads the whole dataset into pandas.
+
+Requires pyarrow.
+"""
+from concurrent import futures
+import json
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from nbhelpers import s3_download
+
+INDEX_NAME = "_catalog_index.json"
+VERSION = 1
+TARGET_FILES = ("timings.json", "ranking_debug.json")
+COLUMNS = [
+    "job", "target", "model", "stage", "seconds", "confidence", "rank",
+    "length", "preset",
+]
+# timings.json entries that are not durations: counters, sizes and estimates.
+NON_TIMING_KEYS = {
+    "num_res",
+    "padded_num_res",
+    "resumed_models",
+    "compile_cache_hits",
+    "compile_cache_misses",
+    "relax_skipped_models",
+    "relax_saved_estimate",
+    "chain_msa_hits",
+    "chain_msa_misses",
+    "feature_cache_hits",
+    "feature_cache_misses",
+    "feature_cache_bytes_saved",
+}
+NON_TIMING_PREFIXES = ("compile_cache_hit_", "jax_cache_loaded_")
+
+
+def model_preset(model_names):
+    """Model preset, from the names of the models of a ranking."""
+    if any("multimer" in name for name in model_names):
+        return "multimer"
+    if any(name.endswith("_ptm") or "_ptm_pred_" in name for name in model_names):
+        return "monomer_ptm"
+    return "monomer"
+
+
+def pdb_length(pdb_str):
+    """Number of residues of a PDB, from its CA atoms."""
+    return sum(
+        1 for line in pdb_str.splitlines()
+        if line.startswith("ATOM") and line[12:16].strip() == "CA"
+    )
+
+
+def target_rows(job, target, timings, ranking, length=None):
+    """Catalog rows of a target.
+
+    Args:
+        job (str): Output prefix of the job.
+        target (str): Name of the target.
+        timings (dict): Contents of timings.json.
+        ranking (dict): Contents of ranking_debug.json, None for targets that
+            were only featurized.
+        length (int): Number of residues, if timings.json does not record it.
+    """
+    ranking = ranking or {}
+    confidences = ranking.get("iptm+ptm", ranking.get("plddts", {}))
+    ranks = {name: i for i, name in enumerate(ranking.get("order", []))}
+    # Longest names first, so that e.g. model_1_pred_10 is not read as
+    # model_1_pred_1.
+    models = sorted(confidences, key=len, reverse=True)
+    length = timings.get("num_res", length)
+    preset = model_preset(models) if models else None
+    rows = []
+    for key, value in timings.items():
+        if key in NON_TIMING_KEYS or key.startswith(NON_TIMING_PREFIXES):
+            continue
+        model = next((name for name in models if key.endswith(f"_{name}")), None)
+        rows.append({
+            "job": job,
+            "target": target,
+            "model": model,
+            "stage": key[:-len(model) - 1] if model else key,
+            "seconds": float(value),
+            "confidence": confidences.get(model),
+            "rank": ranks.get(model),
+            "length": length,
+            "preset": preset,
+        })
+    return rows
+
+
+def _load_index(catalog_dir):
+    path = os.path.join(catalog_dir, INDEX_NAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get("version") == VERSION:
+            return index
+    return {"version": VERSION, "targets": {}}
+
+
+def _save_index(catalog_dir, index):
+    path = os.path.join(catalog_dir, INDEX_NAME)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _target_dirs(df):
+    return (df["job"] + "/" + df["target"]).str.lstrip("/")
+
+
+def _drop_targets(catalog_dir, parts):
+    """Remove the rows of targets from the part files they were written to."""
+    for part, targets in parts.items():
+        path = os.path.join(catalog_dir, part)
+        if not os.path.exists(path):
+            continue
+        df = pd.read_parquet(path)
+        keep = ~_target_dirs(df).isin(targets)
+        if keep.all():
+            continue
+        if keep.any():
+            df[keep].to_parquet(path, index=False)
+        else:
+            os.remove(path)
+
+
+def update_catalog(
+    client,
+    bucket: str,
+    catalog_dir: str = "run_catalog",
+    prefix: str = "",
+    max_workers: int = 32,
+) -> Dict[str, Any]:
+    """Add the targets under an S3 prefix that are not in the catalog yet.
+
+    Targets are the folders with a timings.json. Their timings.json and
+    ranking_debug.json are fetched concurrently. Targets whose files changed
+    since they were cataloged (e.g. a job that was resumed) are read again.
+
+    Args:
+        client (boto3 object): S3 client, shared by all worker threads.
+        bucket (str): Bucket of the job outputs.
+        catalog_dir (str): Local folder of the Parquet dataset.
+        prefix (str): Prefix of the job outputs to scan.
+        max_workers (int): Number of concurrent GET requests.
+
+    Returns:
+        dict: Number of targets listed, added and updated, rows written and
+            the duration of the update.
+    """
+    t_0 = time.time()
+    os.makedirs(catalog_dir, exist_ok=True)
+    index = _load_index(catalog_dir)
+
+    etags = {}
+    for obj in s3_download.list_objects(client, bucket, prefix):
+        target_dir, name = os.path.split(obj["Key"])
+        if name in TARGET_FILES + ("ranked_0.pdb",):
+            etags.setdefault(target_dir, {})[name] = obj["ETag"].strip('"')
+    targets = {
+        target_dir: files for target_dir, files in etags.items()
+        if "timings.json" in files
+    }
+    changed = {
+        target_dir: files for target_dir, files in targets.items()
+        if index["targets"].get(target_dir, {}).get("etags") != files
+    }
+
+    def get(key):
+        return client.get_object(Bucket=bucket, Key=key)["Body"].read().decode()
+
+    def read_target(target_dir):
+        files = changed[target_dir]
+        timings = json.loads(get(f"{target_dir}/timings.json"))
+        ranking = (json.loads(get(f"{target_dir}/ranking_debug.json"))
+                   if "ranking_debug.json" in files else None)
+        length = None
+        if "num_res" not in timings and "ranked_0.pdb" in files:
+            # Jobs from before timings.json recorded the length.
+            length = pdb_length(get(f"{target_dir}/ranked_0.pdb"))
+        job, target = os.path.split(target_dir)
+        return target_rows(job, target, timings, ranking, length)
+
+    rows: List[Dict[str, Any]] = []
+    failures = {}
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(read_target, t): t for t in changed}
+        for future in futures.as_completed(pending):
+            try:
+                rows.extend(future.result())
+            except Exception as err:
+                failures[pending[future]] = err
+    if failures:
+        print(f"Unable to read {len(failures)} targets, they are retried on the "
+              f"next update: {dict(list(failures.items())[:3])}")
+    read = [target_dir for target_dir in changed if target_dir not in failures]
+
+    # Rows of updated targets are replaced.
+    updated = [t for t in read if t in index["targets"]]
+    old_parts = {}
+    for target_dir in updated:
+        part = index["targets"][target_dir]["part"]
+        if part is not None:
+            old_parts.setdefault(part, set()).add(target_dir)
+    _drop_targets(catalog_dir, old_parts)
+
+    # Unique, so that updates within the same second do not overwrite parts.
+    run_id = time.strftime("%Y%m%d%H%M%S", time.gmtime(t_0))
+    run_id = f"{run_id}-{uuid.uuid4().hex[:8]}"
+    df = pd.DataFrame(rows, columns=COLUMNS)
+    df["preset"] = df["preset"].fillna("unknown")
+    df["length"] = df["length"].astype("Int64")
+    df["rank"] = df["rank"].astype("Int64")
+    target_parts = {}
+    for preset, preset_df in df.groupby("preset"):
+        part = os.path.join(f"preset={preset}", f"part-{run_id}.parquet")
+        os.makedirs(os.path.join(catalog_dir, f"preset={preset}"), exist_ok=True)
+        preset_df.drop(columns="preset").to_parquet(
+            os.path.join(catalog_dir, part), index=False)
+        for target_dir in set(_target_dirs(preset_df)):
+            target_parts[target_dir] = part
+    for target_dir in read:
+        index["targets"][target_dir] = {
+            "etags": changed[target_dir],
+            "part": target_parts.get(target_dir),
+        }
+    _save_index(catalog_dir, index)
+
+    summary = {
+        "targets": len(targets),
+        "added": len(read) - len(updated),
+        "updated": len(updated),
+        "failed": len(failures),
+        "rows": len(df),
+        "seconds": time.time() - t_0,
+    }
+    print(
+        f"Cataloged {summary['added']} new and {summary['updated']} updated "
+        f"targets of {summary['targets']} ({summary['rows']} rows) in "
+        f"{summary['seconds']:.1f}s"
+    )
+    return summary
+
+
+def load_catalog(catalog_dir: str = "run_catalog", filters: Optional[list] = None):
+    """The catalog as a DataFrame.
+
+    Args:
+        catalog_dir (str): Folder of the Parquet dataset.
+        filters (list): pyarrow filters, e.g. [("preset", "=", "multimer")],
+            to only read some partitions.
+    """
+    return pd.read_parquet(catalog_dir, filters=filters)
@@ -0,0 +1,214 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Concurrent, filterable and resumable download of S3 prefixes.
+
+`download_prefix` lists the prefix once, keeps the keys that match the include
+and exclude globs, and downloads them with a bounded thread pool. A file that
+is already present locally, with the size and content of the object, is
+skipped, so an interrupted download can be run again to fetch the rest (see
+`local_file_matches`).
+"""
+from concurrent import futures
+import fnmatch
+import hashlib
+import os
+import time
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+MB = 1024 * 1024
+# Part sizes of the multipart uploads of the folding container
+# (--upload_multipart_chunksize_mb) and of the AWS CLI and boto3 defaults.
+MULTIPART_CHUNKSIZES = (64 * MB, 8 * MB)
+
+
+class DownloadReport(NamedTuple):
+    downloaded: List[str]
+    skipped: List[str]
+    failures: List[Tuple[str, BaseException]]
+    num_bytes: int
+    seconds: float
+
+    @property
+    def throughput_mb_s(self) -> float:
+        return self.num_bytes / MB / self.seconds if self.seconds > 0 else 0.0
+
+
+def matches(relative_key: str, patterns: Sequence[str]) -> bool:
+    """Whether a key, relative to the downloaded prefix, matches a glob.
+
+    Patterns ending with "/" match a folder at any depth, e.g. "msas/". Other
+    patterns match the relative key or its file name, e.g. "result_*.pkl".
+    """
+    folders = relative_key.split("/")[:-1]
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            if any(fnmatch.fnmatch(folder, pattern.rstrip("/")) for folder in folders):
+                return True
+        elif fnmatch.fnmatch(relative_key, pattern) or fnmatch.fnmatch(
+            os.path.basename(relative_key), pattern
+        ):
+            return True
+    return False
+
+
+def _md5(path: str) -> str:
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(MB), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _md5_parts(path: str, part_size: int) -> List[bytes]:
+    """MD5 digests of each part of a file."""
+    digests = []
+    with open(path, "rb") as f:
+        while True:
+            digest = hashlib.md5()
+            remaining = part_size
+            while remaining:
+                chunk = f.read(min(MB, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+            if remaining == part_size:
+                return digests
+            digests.append(digest.digest())
+
+
+def local_etag_matches(path: str, etag: str) -> bool:
+    """Whether a local file has the content of an object with this ETag.
+
+    Multipart ETags are the MD5 of the MD5s of the parts, so the part size is
+    inferred from the number of parts.
+    """
+    etag = etag.strip('"')
+    if "-" not in etag:
+        return _md5(path) == etag
+    digest, num_parts = etag.split("-")
+    num_parts = int(num_parts)
+    size = os.path.getsize(path)
+    # The smallest whole number of MB that splits the file into num_parts.
+    inferred = -(-size // num_parts // MB) * MB or MB
+    for part_size in dict.fromkeys((*MULTIPART_CHUNKSIZES, inferred)):
+        if -(-size // part_size) != num_parts:
+            continue
+        parts = _md5_parts(path, part_size)
+        if hashlib.md5(b"".join(parts)).hexdigest() == digest:
+            return True
+    return False
+
+
+def local_file_matches(path: str, obj: dict) -> bool:
+    """Whether a local file is a downloaded copy of a listed object.
+
+    The file must have the size of the object and either its ETag or, for
+    ETags that are not the MD5 of the content (e.g. objects encrypted with
+    SSE-KMS), its LastModified time, which `download_prefix` gives the files
+    that it downloads.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) != obj["Size"]:
+        return False
+    if local_etag_matches(path, obj["ETag"]):
+        return True
+    last_modified = obj.get("LastModified")
+    return last_modified is not None and int(os.path.getmtime(path)) == int(
+        last_modified.timestamp()
+    )
+
+
+def list_objects(client, bucket: str, prefix: str) -> List[dict]:
+    """Every object under a prefix, in one flat listing."""
+    paginator = client.get_paginator("list_objects_v2")
+    return [
+        obj
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix)
+        for obj in page.get("Contents", [])
+        if not obj["Key"].endswith("/")
+    ]
+
+
+def download_prefix(
+    client,
+    bucket: str,
+    prefix: str = "",
+    local: str = "data",
+    include: Optional[Sequence[str]] = None,
+    exclude: Optional[Sequence[str]] = None,
+    max_workers: int = 16,
+    progress_interval_sec: float = 5.0,
+) -> DownloadReport:
+    """Download the objects under a prefix to local/<key>.
+
+    Args:
+        client (boto3 object): S3 client, shared by all worker threads.
+        bucket (str): Bucket to download from.
+        prefix (str): Prefix to download, e.g. a job name.
+        local (str): Local folder, the keys are kept as relative paths.
+        include (list): Globs of the files to download (see `matches`), all
+            files if omitted, e.g. ["ranked_*.pdb", "*.json"].
+        exclude (list): Globs of the files to skip, e.g. ["result_*.pkl",
+            "msas/"].
+        max_workers (int): Number of files downloaded concurrently.
+        progress_interval_sec (float): Time between progress reports.
+    """
+    if max_workers < 1:
+        raise ValueError("max_workers must be at least 1.")
+    t_0 = time.time()
+    objects = []
+    for obj in list_objects(client, bucket, prefix):
+        relative_key = obj["Key"][len(prefix):].lstrip("/")
+        if include and not matches(relative_key, include):
+            continue
+        if exclude and matches(relative_key, exclude):
+            continue
+        objects.append(obj)
+    total_bytes = sum(obj["Size"] for obj in objects)
+
+    def download(obj):
+        dest_pathname = os.path.join(local, obj["Key"])
+        if local_file_matches(dest_pathname, obj):
+            return False
+        os.makedirs(os.path.dirname(dest_pathname) or ".", exist_ok=True)
+        client.download_file(bucket, obj["Key"], dest_pathname)
+        if "LastModified" in obj:
+            timestamp = obj["LastModified"].timestamp()
+            os.utime(dest_pathname, (timestamp, timestamp))
+        return True
+
+    downloaded, skipped, failures = [], [], []
+    num_bytes = done_bytes = 0
+    last_report = time.time()
+    with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(download, obj): obj for obj in objects}
+        for future in futures.as_completed(pending):
+            obj = pending[future]
+            done_bytes += obj["Size"]
+            try:
+                if future.result():
+                    downloaded.append(obj["Key"])
+                    num_bytes += obj["Size"]
+                else:
+                    skipped.append(obj["Key"])
+            except Exception as err:
+                failures.append((obj["Key"], err))
+            if time.time() - last_report >= progress_interval_sec:
+                last_report = time.time()
+                seconds = last_report - t_0
+                print(
+                    f"{len(downloaded) + len(skipped) + len(failures)}/"
+                    f"{len(objects)} files, {done_bytes / MB:.0f}/"
+                    f"{total_bytes / MB:.0f} MB, {num_bytes / MB / seconds:.1f} MB/s"
+                )
+    report = DownloadReport(
+        downloaded, skipped, failures, num_bytes, time.time() - t_0
+    )
+    print(
+        f"{len(downloaded)} files downloaded from s3 ({num_bytes / MB:.1f} MB in "
+        f"{report.seconds:.1f}s, {report.throughput_mb_s:.1f} MB/s), "
+        f"{len(skipped)} already present, {len(failures)} failed."
+    )
+    return report
@@ -0,0 +1,25 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Digests of the sequences of targets, to group identical targets.
+
+The notebook's copy of the normalization and digest of the folding container's
+dedup module (docker/folding/foldhelpers/dedup.py), which it cannot import, so
+that submit_batch_alphafold_array_job groups identical targets exactly like
+--deduplicate_targets does. notebooks/tests/test_targets.py compares the two,
+so they stay in sync.
+"""
+import hashlib
+from typing import Sequence
+
+
+def normalize_sequence(sequence: str) -> str:
+    """Sequence in upper case, without whitespace or a trailing stop codon."""
+    return "".join(sequence.split()).upper().rstrip("*")
+
+
+def target_digest(sequences: Sequence[str]) -> str:
+    """SHA-256 digest of the normalized chains of a target, in order."""
+    normalized = "\n".join(normalize_sequence(sequence) for sequence in sequences)
+    return hashlib.sha256(normalized.encode()).hexdigest()
@@ -0,0 +1,131 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import io
+import json
+import os
+
+import pytest
+
+for module in ("sagemaker", "py3Dmol", "matplotlib"):
+    pytest.importorskip(module)
+moto = pytest.importorskip("moto")
+# nbhelpers creates its clients and looks up the default SageMaker bucket
+# when it is imported.
+for name, value in (("AWS_ACCESS_KEY_ID", "testing"),
+                    ("AWS_SECRET_ACCESS_KEY", "testing"),
+                    ("AWS_DEFAULT_REGION", "us-east-1")):
+    os.environ.setdefault(name, value)
+with moto.mock_aws():
+    from nbhelpers import nbhelpers
+
+BATCH_RESOURCES = {
+    "gpu_job_definition": "gpu-definition",
+    "gpu_job_queue": "gpu-queue",
+    "cpu_job_definition": "cpu-definition",
+    "cpu_job_queue_od": "cpu-queue",
+    "cpu_job_queue_spot": None,
+}
+
+
+class StubBatchClient:
+    """Records the jobs that are submitted."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit_job(self, **kwargs):
+        self.jobs.append(kwargs)
+        return {"jobId": f"job-{len(self.jobs)}", "jobName": kwargs["jobName"]}
+
+
+class StubS3Client:
+    """Objects of one bucket, in a dictionary."""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+
+@pytest.fixture(autouse=True)
+def batch_resources(monkeypatch):
+    monkeypatch.setattr(nbhelpers, "get_batch_resources",
+                        lambda stack_name: BATCH_RESOURCES)
+
+
+def _submit(batch_client, **kwargs):
+    nbhelpers.submit_batch_alphafold_job(
+        job_name="job", fasta_paths=None, s3_bucket="bucket",
+        stack_name="stack", batch_client=batch_client, **kwargs)
+    return batch_client.jobs[-1]
+
+
+def test_pack_shards_balances_costs():
+    costs = {f"target_{i}.fasta": float(i) for i in range(1, 11)}
+
+    shards = nbhelpers.pack_shards(costs, 3)
+
+    assert sorted(path for shard in shards for path in shard) == sorted(costs)
+    shard_costs = [sum(costs[path] for path in shard) for shard in shards]
+    assert max(shard_costs) - min(shard_costs) <= max(costs.values())
+
+
+def test_pack_shards_never_leaves_a_shard_empty():
+    costs = {"a.fasta": 5.0, "b.fasta": 1.0}
+
+    assert nbhelpers.pack_shards(costs, 4) == [["a.fasta"], ["b.fasta"]]
+    assert nbhelpers.pack_shards(costs, 0) == [["a.fasta", "b.fasta"]]
+
+
+@pytest.mark.parametrize("array_size", [None, 1])
+def test_job_without_array_properties(array_size):
+    job = _submit(StubBatchClient(), array_size=array_size,
+                  depends_on="features-job")
+
+    assert "arrayProperties" not in job
+    assert job["dependsOn"] == [{"jobId": "features-job", "type": "SEQUENTIAL"}]
+
+
+def test_array_job_depends_on_children_with_same_index():
+    job = _submit(StubBatchClient(), array_size=4, shard_manifest="shards.json",
+                  depends_on="features-job")
+
+    assert job["arrayProperties"] == {"size": 4}
+    assert job["dependsOn"] == [{"jobId": "features-job", "type": "N_TO_N"}]
+    assert "--shard_manifest=shards.json" in job["containerOverrides"]["command"]
+
+
+def test_array_job_stages_share_shards():
+    objects = {
+        "a.fasta": b">a\nMKTAYIAKQR\n",
+        # Identical to a.fasta, up to case and line breaks.
+        "a_copy.fasta": b">a copy\nmktay\niakqr\n",
+        "b.fasta": b">b\nMKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEK\n",
+        "c.fasta": b">c\nGSHMLEDPVDAFQ\n",
+    }
+    s3_client = StubS3Client(objects)
+    batch_client = StubBatchClient()
+
+    features_job = nbhelpers.submit_batch_alphafold_array_job(
+        "features", "bucket", 2, fasta_paths=list(objects),
+        s3_client=s3_client, batch_client=batch_client, stack_name="stack",
+        run_features_only=True, gpu=0)
+    nbhelpers.submit_batch_alphafold_array_job(
+        "fold", "bucket", 2, fasta_paths=list(objects),
+        s3_client=s3_client, batch_client=batch_client, stack_name="stack",
+        depends_on=features_job["jobId"])
+
+    shards = json.loads(s3_client.objects["features/shards.json"])["shards"]
+    assert shards == json.loads(s3_client.objects["fold/shards.json"])["shards"]
+    assert len(shards) == 2
+    assert any({"a.fasta", "a_copy.fasta"} <= set(shard) for shard in shards)
+    features_submit, fold_submit = batch_client.jobs
+    assert features_submit["arrayProperties"] == {"size": 2}
+    assert "dependsOn" not in features_submit
+    assert fold_submit["arrayProperties"] == {"size": 2}
+    assert fold_submit["dependsOn"] == [{"jobId": "job-1", "type": "N_TO_N"}]
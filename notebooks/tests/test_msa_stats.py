@@ -0,0 +1,123 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import numpy as np
+import pytest
+
+from nbhelpers import msa_arrays
+from nbhelpers import msa_stats
+
+QUERY_LENGTH = 50
+
+
+def _alignment(num_hits, rng=np.random.default_rng(0)):
+    """Query and hits with random substitutions and gaps."""
+    residues = np.array(list("ACDEFGHIKLMNPQRSTVWYX"))
+    query = rng.choice(residues[:20], QUERY_LENGTH)
+    rows = [query]
+    for _ in range(num_hits):
+        row = query.copy()
+        substituted = rng.random(QUERY_LENGTH) < rng.uniform(0, 0.8)
+        row[substituted] = rng.choice(residues, substituted.sum())
+        row[rng.random(QUERY_LENGTH) < rng.uniform(0, 0.5)] = "-"
+        rows.append(row)
+    return ["".join(row) for row in rows]
+
+
+def _write_stockholm(path, rows, block_width, reverse_later_blocks=False):
+    names = ["query"] + [f"hit_{i}/1-{QUERY_LENGTH}" for i in range(1, len(rows))]
+    with open(path, "w") as f:
+        f.write("# STOCKHOLM 1.0\n\n")
+        for start in range(0, QUERY_LENGTH, block_width):
+            block = list(zip(names, rows))
+            if start and reverse_later_blocks:
+                # The query stays first.
+                block = block[:1] + block[:0:-1]
+            for name, row in block:
+                f.write(f"{name:<24}{row[start:start + block_width]}\n")
+            f.write("\n")
+        f.write("//\n")
+    return str(path)
+
+
+def _write_a3m(path, rows):
+    with open(path, "w") as f:
+        for i, row in enumerate(rows):
+            f.write(f">seq_{i}\n{row}\n")
+    return str(path)
+
+
+@pytest.fixture
+def alignments(tmp_path):
+    sto_rows = _alignment(200)
+    a3m_rows = [sto_rows[0]] + _alignment(60)[1:]
+    return {
+        "single": _write_stockholm(tmp_path / "single.sto", sto_rows,
+                                   QUERY_LENGTH),
+        "blocks": _write_stockholm(tmp_path / "blocks.sto", sto_rows, 16,
+                                   reverse_later_blocks=True),
+        "a3m": _write_a3m(tmp_path / "bfd.a3m", a3m_rows),
+    }
+
+
+def test_blocks_are_streamed_in_order_of_first_block(alignments):
+    msa_arr = msa_arrays.read_msa(alignments["single"])
+    chunks = list(msa_arrays.iter_msa_blocks(alignments["blocks"], chunk_rows=64))
+
+    assert max(len(rows) for _, _, rows in chunks) <= 64
+    streamed = np.zeros_like(msa_arr)
+    for indices, start, rows in chunks:
+        streamed[indices, start:start + rows.shape[1]] = rows
+    np.testing.assert_array_equal(streamed, msa_arr)
+
+
+def test_blocks_with_other_sequences(tmp_path):
+    path = tmp_path / "bad.sto"
+    path.write_text("# STOCKHOLM 1.0\n\nquery AC\nhit_1 AC\n\n"
+                    "query DE\nhit_2 DE\n//\n")
+
+    with pytest.raises(ValueError, match="same sequences"):
+        list(msa_arrays.iter_msa_blocks(str(path)))
+
+
+@pytest.mark.parametrize("chunk_rows", [7, 1024])
+def test_stockholm_blocks_give_same_stats(alignments, chunk_rows):
+    single = msa_stats.chain_stats(
+        [alignments["single"], alignments["a3m"]], chunk_rows=chunk_rows)
+    blocks = msa_stats.chain_stats(
+        [alignments["blocks"], alignments["a3m"]], chunk_rows=chunk_rows)
+
+    assert blocks.pop("files") == {"blocks.sto": 201, "bfd.a3m": 60}
+    assert single.pop("files") == {"single.sto": 201, "bfd.a3m": 60}
+    assert blocks == single
+
+
+def test_stats_match_whole_alignment(alignments):
+    paths = [alignments["a3m"], alignments["blocks"]]
+    stats = msa_stats.chain_stats(paths, chunk_rows=16)
+
+    codes = msa_stats._CODES[np.concatenate(
+        [msa_arrays.read_msa(paths[0]), msa_arrays.read_msa(paths[1])[1:]])]
+    aligned = codes != msa_stats._GAP
+    num_aligned = aligned.sum(axis=1)
+    identity = ((codes == codes[0]) & aligned).sum(axis=1)[num_aligned > 0] / (
+        num_aligned[num_aligned > 0])
+    weights = np.zeros(len(codes))
+    for column in codes.T:
+        residues, inverse, counts = np.unique(
+            column, return_inverse=True, return_counts=True)
+        is_residue = residues != msa_stats._GAP
+        column_weights = np.where(
+            is_residue, 1 / (is_residue.sum() * counts), 0.0)
+        weights += column_weights[inverse] / QUERY_LENGTH
+    assert stats["num_sequences"] == len(codes)
+    assert stats["coverage"] == aligned.sum(axis=0).tolist()
+    bins = msa_stats.IDENTITY_BINS
+    assert stats["identity_histogram"] == np.bincount(
+        np.minimum((identity * bins).astype(int), bins - 1),
+        minlength=bins).tolist()
+    assert stats["neff"] == pytest.approx(
+        weights.sum() ** 2 / (weights ** 2).sum(), abs=0.01)
+    np.testing.assert_allclose(
+        stats["neff_per_residue"],
+        (weights @ aligned) ** 2 / (weights ** 2 @ aligned), atol=0.01)
@@ -0,0 +1,64 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from nbhelpers import prediction_results
+
+# The writer of the folding container, whose files the notebook reads.
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "docker", "folding"))
+from foldhelpers import results_store  # noqa: E402
+
+
+def _prediction_result(num_res=16, rng=np.random.default_rng(0)):
+    return {
+        "plddt": rng.uniform(0, 100, num_res),
+        "predicted_aligned_error": rng.uniform(0, 30, (num_res, num_res)),
+        "max_predicted_aligned_error": np.float64(31.75),
+        "ptm": np.float64(0.8),
+        "ranking_confidence": np.float64(0.8),
+        "distogram": {
+            "logits": rng.standard_normal((num_res, num_res, 64)),
+            "bin_edges": np.linspace(2.3, 21.7, 63),
+        },
+        "experimentally_resolved": {
+            "logits": rng.standard_normal((num_res, 37))},
+        "structure_module": {
+            "final_atom_positions": rng.standard_normal((num_res, 37, 3)),
+            "final_atom_mask": np.ones((num_res, 37)),
+        },
+    }
+
+
+def _assert_equal(actual, expected):
+    assert sorted(actual) == sorted(expected)
+    for key, value in expected.items():
+        if isinstance(value, dict):
+            _assert_equal(actual[key], value)
+        else:
+            np.testing.assert_array_equal(actual[key], value)
+
+
+@pytest.mark.parametrize("profile", results_store.PROFILES)
+def test_load_result_round_trip(profile, tmp_path):
+    result = _prediction_result()
+
+    path = results_store.save_result(result, str(tmp_path), "model_1", profile)
+    loaded = prediction_results.load_result(path)
+
+    _assert_equal(loaded, results_store.load_result(path))
+    if profile == "full":
+        _assert_equal(loaded, result)
+    elif profile == "standard":
+        assert "distogram" not in loaded
+        assert "experimentally_resolved" not in loaded
+        _assert_equal(loaded["structure_module"], result["structure_module"])
+    else:
+        assert loaded["plddt"].dtype == np.float16
+        assert sorted(loaded) == sorted(
+            key for key in results_store.MINIMAL_KEYS if key in result)
@@ -0,0 +1,139 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import io
+import os
+
+import pytest
+
+from nbhelpers import s3_download
+
+boto3 = pytest.importorskip("boto3")
+from boto3.s3.transfer import TransferConfig  # noqa: E402
+
+MB = s3_download.MB
+KEYS = [
+    "job/result_model_1_multimer_v2_pred_0.pkl",
+    "job/ranked_0.pdb",
+    "job/ranking_debug.json",
+    "job/msas/A/uniref90_hits.sto",
+    "job/msas/B/uniref90_hits.sto",
+]
+
+
+class KmsEtagClient:
+    """Client that lists the ETags of SSE-KMS objects, which are not the MD5
+    of their content."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_paginator(self, operation_name):
+        paginator = self.client.get_paginator(operation_name)
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                for page in paginator.paginate(**kwargs):
+                    for obj in page.get("Contents", []):
+                        digest = hashlib.md5(obj["Key"].encode()).hexdigest()
+                        obj["ETag"] = f'"{digest}"'
+                    yield page
+
+        return Paginator()
+
+    def download_file(self, *args, **kwargs):
+        return self.client.download_file(*args, **kwargs)
+
+
+@pytest.fixture
+def job(s3_client):
+    """Objects of a job, the result pickle uploaded in 8 MB parts."""
+    contents = {key: os.urandom(1024) for key in KEYS[1:]}
+    for key, body in contents.items():
+        s3_client.put_object(Bucket="bucket", Key=key, Body=body)
+    contents[KEYS[0]] = os.urandom(20 * MB)
+    s3_client.upload_fileobj(
+        io.BytesIO(contents[KEYS[0]]), "bucket", KEYS[0],
+        Config=TransferConfig(multipart_threshold=8 * MB,
+                              multipart_chunksize=8 * MB))
+    return contents
+
+
+def _download(client, local, **kwargs):
+    return s3_download.download_prefix(
+        client, "bucket", "job", str(local), max_workers=4, **kwargs)
+
+
+def _rewrite(path):
+    """Change a local file after its download, as a later edit does."""
+    with open(path, "wb") as f:
+        f.write(os.urandom(1024))
+    mtime = os.path.getmtime(path) + 60
+    os.utime(path, (mtime, mtime))
+
+
+def _read(local, key):
+    with open(os.path.join(local, key), "rb") as f:
+        return f.read()
+
+
+def test_download_prefix_content(s3_client, job, tmp_path):
+    report = _download(s3_client, tmp_path)
+
+    assert sorted(report.downloaded) == sorted(KEYS)
+    assert not report.skipped and not report.failures
+    assert report.num_bytes == sum(len(body) for body in job.values())
+    for key, body in job.items():
+        assert _read(tmp_path, key) == body
+
+
+def test_download_prefix_filters(s3_client, job, tmp_path):
+    report = _download(
+        s3_client, tmp_path, exclude=["result_*.pkl", "msas/"])
+
+    assert sorted(report.downloaded) == ["job/ranked_0.pdb",
+                                         "job/ranking_debug.json"]
+    assert not os.path.exists(tmp_path / "job" / "msas")
+
+    report = _download(
+        s3_client, tmp_path / "included", include=["*.sto"],
+        exclude=["B/"])
+
+    assert report.downloaded == ["job/msas/A/uniref90_hits.sto"]
+
+
+def test_download_prefix_skips_downloaded_files(s3_client, job, tmp_path):
+    _download(s3_client, tmp_path)
+    changed = "job/ranked_0.pdb"
+    _rewrite(tmp_path / changed)
+
+    report = _download(s3_client, tmp_path)
+
+    assert report.downloaded == [changed]
+    assert sorted(report.skipped) == sorted(set(KEYS) - {changed})
+    assert _read(tmp_path, changed) == job[changed]
+
+
+def test_local_etag_matches_multipart(s3_client, job, tmp_path):
+    _download(s3_client, tmp_path)
+    etag = s3_client.head_object(Bucket="bucket", Key=KEYS[0])["ETag"]
+
+    assert etag.strip('"').endswith("-3")
+    assert s3_download.local_etag_matches(str(tmp_path / KEYS[0]), etag)
+
+
+def test_download_prefix_skips_sse_kms_objects(s3_client, job, tmp_path):
+    client = KmsEtagClient(s3_client)
+    _download(client, tmp_path)
+
+    report = _download(client, tmp_path)
+
+    assert sorted(report.skipped) == sorted(KEYS)
+    # A local file that was modified after the download no longer matches.
+    _rewrite(tmp_path / "job/ranked_0.pdb")
+
+    report = _download(client, tmp_path)
+
+    assert report.downloaded == ["job/ranked_0.pdb"]
+    assert _read(tmp_path, "job/ranked_0.pdb") == job["job/ranked_0.pdb"]
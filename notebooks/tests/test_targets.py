@@ -0,0 +1,35 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+import os
+import sys
+
+import pytest
+
+from nbhelpers import targets
+
+# The deduplication of the folding container, which the notebook copies.
+pytest.importorskip("absl")
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "docker", "folding"))
+from foldhelpers import dedup  # noqa: E402
+
+SEQUENCES = [
+    ["MKTAYIAKQR"],
+    ["mktay iakqr\n*"],
+    ["MKTAYIAKQR", "GSHMLEDPVDAFQ"],
+    ["GSHMLEDPVDAFQ", "MKTAYIAKQR"],
+    [""],
+]
+
+
+@pytest.mark.parametrize("sequences", SEQUENCES)
+def test_same_digest_as_folding_container(sequences):
+    assert targets.target_digest(sequences) == dedup.target_digest(sequences)
+
+
+def test_identical_targets_have_same_digest():
+    digests = [targets.target_digest(sequences) for sequences in SEQUENCES]
+
+    assert digests[0] == digests[1]
+    assert len(set(digests)) == 4